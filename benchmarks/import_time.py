@@ -0,0 +1,88 @@
+"""Measure the import time of run.py and of every pipeline module.
+
+Every import runs in a fresh interpreter without OpenAI credentials, so a
+client constructed at import time fails the check. Pipelines that do not
+train or run models, and run.py itself, must not load the ML stack at all.
+
+    python benchmarks/import_time.py --repeat 5 --max-seconds 3
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from run import PIPELINES  # noqa: E402
+
+HEAVY_MODULES = ("torch", "transformers", "trl", "unsloth")
+# Pipelines allowed to load the heavy modules
+ML_PIPELINES = {"training", "inference"}
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+    "pipelines": [name for name in sys.modules if name.startswith("pipelines.")],
+}}))
+"""
+
+
+def probe(module: str) -> dict:
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    env["PYTHONPATH"] = str(ROOT)
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise click.ClickException(f"Importing {module} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@click.command()
+@click.option("--repeat", default=3, help="Imports per module, the fastest counts.")
+@click.option(
+    "--max-seconds",
+    type=float,
+    default=None,
+    help="Fail if run.py or a non-ML pipeline takes longer to import.",
+)
+def main(repeat: int, max_seconds: float | None) -> None:
+    targets = {"run": "run"}
+    targets.update({name: module for name, (module, _, _) in PIPELINES.items()})
+    failures = []
+
+    for name, module in targets.items():
+        runs = [probe(module) for _ in range(repeat)]
+        seconds = min(run["seconds"] for run in runs)
+        loaded = runs[0]["loaded"]
+        click.echo(f"{name:<20} {seconds:6.2f}s  heavy modules: {loaded or '-'}")
+
+        if name == "run" and runs[0]["pipelines"]:
+            failures.append(f"run imports pipelines eagerly: {runs[0]['pipelines']}")
+        if name in ML_PIPELINES:
+            continue
+        if loaded:
+            failures.append(f"{name} imports {loaded}")
+        if max_seconds is not None and seconds > max_seconds:
+            failures.append(f"{name} takes {seconds:.2f}s > {max_seconds}s")
+
+    if failures:
+        raise click.ClickException("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
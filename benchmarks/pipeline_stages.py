@@ -0,0 +1,245 @@
+"""Benchmark the hot paths of the data preparation and batch processing pipelines.
+
+Runs offline on a synthetic image dataset against a local stub of the OpenAI
+API, see ``stub_openai``. The production steps are run through their
+entrypoints and the stage timings they log as ZenML metadata, see
+``utils.instrumentation``, are collected instead of being sent to ZenML.
+Standalone stages cover the image encoder and ``format_data_for_training``.
+Reports rows/sec, MB/sec, peak RSS and API calls per endpoint:
+
+    python benchmarks/pipeline_stages.py --rows 2000 --output results.json
+    python benchmarks/pipeline_stages.py --rows 2000 --baseline results.json
+"""
+
+import json
+import os
+import sys
+import tempfile
+from contextlib import ExitStack
+from pathlib import Path
+from unittest import mock
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# Keep the per-request logs of the steps out of the report
+os.environ.setdefault("ZENML_LOGGING_VERBOSITY", "WARN")
+
+from benchmarks.stub_openai import StubOpenAI  # noqa: E402
+from benchmarks.synthetic import (  # noqa: E402
+    synthetic_dataset,
+    synthetic_images,
+    write_parquet_source,
+)
+
+# Modules of the benchmarked steps, their metadata is collected
+STEP_MODULES = (
+    "steps.data_alt_text_generator",
+    "steps.data_uploader",
+    "steps.batch_tasks",
+)
+
+
+def _standalone_stages(images: list[bytes], timer) -> None:
+    from datasets import Image
+
+    from utils.images import image_bytes_to_base64
+    from utils.prompts import format_batch_for_training
+
+    for _ in timer.timed(
+        "image_bytes_to_base64",
+        (image_bytes_to_base64(image) for image in images),
+        bytes=lambda result: len(result[0]),
+    ):
+        pass
+
+    data = synthetic_dataset(images).cast_column("image", Image())
+    for _ in timer.timed(
+        "format_data_for_training", data.with_transform(format_batch_for_training)
+    ):
+        pass
+
+
+def _pipeline_stages(
+    images: list[bytes], directory: Path, num_workers: int, collected: dict
+) -> None:
+    from steps.batch_tasks import (
+        add_batch_results_to_dataset,
+        download_batch_results,
+        wait_and_update_batch,
+    )
+    from steps.data_alt_text_generator import generate_alt_text_batch_files
+    from steps.data_loader import load_data
+    from steps.data_uploader import upload_files_to_openai
+
+    current: dict = {}
+
+    def log_metadata(metadata: dict, **kwargs) -> None:
+        current.update(metadata)
+
+    def run(name: str, step, *args, **kwargs):
+        current.clear()
+        result = step.entrypoint(*args, **kwargs)
+        collected[name] = dict(current.get("stages", {}))
+        return result
+
+    source = write_parquet_source(synthetic_dataset(images), directory / "source")
+    batches = directory / "batches"
+    store = str(batches / "tasks.sqlite")
+
+    with ExitStack() as stack:
+        for module in STEP_MODULES:
+            stack.enter_context(
+                mock.patch(f"{module}.log_metadata", side_effect=log_metadata)
+            )
+
+        data = load_data.entrypoint(source, split="train", task_store_path=store)
+        files = run(
+            "generate_alt_text_batch_files",
+            generate_alt_text_batch_files,
+            data,
+            path=str(batches),
+            num_workers=num_workers,
+            response_cache_path=None,
+        )
+        tasks = run(
+            "upload_files_to_openai",
+            upload_files_to_openai,
+            files,
+            manifest_path=str(batches / "upload_manifest.json"),
+            task_store_path=store,
+        )
+        tasks = run(
+            "wait_and_update_batch",
+            wait_and_update_batch,
+            tasks,
+            wait_seconds=0.05,
+            min_wait_seconds=0.01,
+            path=str(batches),
+            task_store_path=store,
+        )
+        results = run(
+            "download_batch_results",
+            download_batch_results,
+            tasks,
+            path=str(batches),
+            task_store_path=store,
+        )
+        run(
+            "add_batch_results_to_dataset",
+            add_batch_results_to_dataset,
+            results,
+            local_dir=str(directory / "published"),
+            image_index_path=str(batches / "image_index.parquet"),
+            response_cache_path=None,
+            task_store_path=store,
+        )
+
+
+def _check_baseline(report: dict, baseline_path: Path, tolerance: float) -> list[str]:
+    baseline = json.loads(baseline_path.read_text())
+    regressions = []
+    for name, stage in report["stages"].items():
+        before = baseline["stages"].get(name, {}).get("rows_per_second")
+        after = stage["rows_per_second"]
+        if before and after < before * (1 - tolerance):
+            regressions.append(
+                f"{name}: {after:.1f} rows/sec, baseline {before:.1f} rows/sec"
+            )
+    return regressions
+
+
+@click.command()
+@click.option("--rows", default=1000, help="Rows of the synthetic dataset.")
+@click.option("--image-size", default=256, help="Side length of the images.")
+@click.option(
+    "--image-format",
+    type=click.Choice(["JPEG", "PNG", "WEBP", "BMP"], case_sensitive=False),
+    default="JPEG",
+    help="Encoding of the images, BMP is transcoded to PNG.",
+)
+@click.option(
+    "--duplicate-fraction", default=0.1, help="Fraction of repeated images."
+)
+@click.option("--num-workers", default=1, help="Encoding processes.")
+@click.option(
+    "--polls-to-complete", default=2, help="Batch retrievals until completion."
+)
+@click.option("--output", type=click.Path(path_type=Path), help="Write JSON report.")
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, path_type=Path),
+    help="Fail if a stage is slower than in this JSON report.",
+)
+@click.option(
+    "--tolerance", default=0.2, help="Allowed rows/sec drop against the baseline."
+)
+def main(
+    rows: int,
+    image_size: int,
+    image_format: str,
+    duplicate_fraction: float,
+    num_workers: int,
+    polls_to_complete: int,
+    output: Path | None,
+    baseline: Path | None,
+    tolerance: float,
+) -> None:
+    from datasets import disable_progress_bars
+
+    from utils.instrumentation import StageTimer, peak_rss_bytes
+
+    disable_progress_bars()
+    images = synthetic_images(
+        rows, image_size, image_format.upper(), duplicate_fraction
+    )
+    click.echo(
+        f"{rows} {image_format.upper()} images of {image_size}px, "
+        f"{sum(map(len, images)) / 2**20:.1f} MB"
+    )
+
+    timer = StageTimer()
+    _standalone_stages(images, timer)
+    stages = timer.metadata()["stages"]
+    by_step = {}
+
+    with StubOpenAI(polls_to_complete=polls_to_complete) as stub:
+        os.environ["OPENAI_BASE_URL"] = stub.base_url
+        os.environ["OPENAI_API_KEY"] = "benchmark"
+        with tempfile.TemporaryDirectory() as directory:
+            _pipeline_stages(images, Path(directory), num_workers, by_step)
+
+    for step_name, step_stages in by_step.items():
+        for name, stage in step_stages.items():
+            stages[f"{step_name}.{name}"] = stage
+
+    report = {
+        "rows": rows,
+        "stages": stages,
+        "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+        "api_calls": dict(sorted(stub.calls.items())),
+    }
+
+    click.echo(f"\n{'stage':<56} {'seconds':>8} {'rows/s':>10} {'MB/s':>8}")
+    for name, stage in stages.items():
+        click.echo(
+            f"{name:<56} {stage['seconds']:>8.3f} "
+            f"{stage['rows_per_second']:>10.1f} "
+            f"{stage['bytes_per_second'] / 2**20:>8.1f}"
+        )
+    click.echo(f"\npeak RSS: {report['peak_rss_mb']} MB")
+    click.echo("API calls:")
+    for route, count in report["api_calls"].items():
+        click.echo(f"  {route:<40} {count:>6}")
+
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2))
+    if baseline is not None:
+        regressions = _check_baseline(report, baseline, tolerance)
+        if regressions:
+            raise click.ClickException("Regressions:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Local stub of the OpenAI files, batches and chat completions endpoints.
+
+The stub keeps uploaded files and batches in memory and counts every API
+call by endpoint. A batch completes after ``polls_to_complete`` retrievals,
+its output holds one successful caption per request line. Transient server
+errors can be injected per endpoint, and batches can be made to fail.
+Pointing the OpenAI clients at ``base_url`` runs the batch pipeline offline:
+
+    with StubOpenAI() as stub:
+        os.environ["OPENAI_BASE_URL"] = stub.base_url
+"""
+
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ID_SEGMENT = re.compile(r"/(file|batch)-\d+")
+
+
+def _caption(custom_id: str) -> str:
+    return f"A synthetic test image ({custom_id})."
+
+
+class StubOpenAI:
+    """In-memory OpenAI API stub served on a local port.
+
+    Args:
+        polls_to_complete: Retrievals of a batch until it completes.
+        latency_seconds: Delay added to every response.
+        failures: Number of calls per endpoint, e.g. ``"POST /v1/files"``,
+            that fail with a 500 error before the endpoint succeeds.
+        failed_batches: Number of batches, in the order they finish, that
+            fail without any output instead of completing.
+    """
+
+    def __init__(
+        self,
+        polls_to_complete: int = 1,
+        latency_seconds: float = 0.0,
+        failures: dict[str, int] | None = None,
+        failed_batches: int = 0,
+    ):
+        self.polls_to_complete = polls_to_complete
+        self.latency_seconds = latency_seconds
+        self.failures = Counter(failures or {})
+        self.failed_batches = failed_batches
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.calls: Counter[str] = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubOpenAI":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubOpenAI":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _new_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+
+    def _store_file(self, data: bytes, filename: str, purpose: str) -> dict:
+        file_id = self._new_id("file")
+        self.files[file_id] = data
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+
+    def _fail(self, batch: dict) -> None:
+        batch["status"] = "failed"
+        batch["errors"] = {
+            "object": "list",
+            "data": [{"code": "stub_failure", "message": "Failed by the stub."}],
+        }
+
+    def _complete(self, batch: dict) -> None:
+        lines = []
+        for line in self.files[batch["input_file_id"]].splitlines():
+            if not line.strip():
+                continue
+            custom_id = json.loads(line)["custom_id"]
+            lines.append(
+                {
+                    "id": f"response-{custom_id}",
+                    "custom_id": custom_id,
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "choices": [
+                                {"message": {"content": _caption(custom_id)}}
+                            ]
+                        },
+                    },
+                    "error": None,
+                }
+            )
+        output = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        batch["output_file_id"] = self._store_file(
+            output, f"{batch['id']}_output.jsonl", "batch_output"
+        )["id"]
+        batch["status"] = "completed"
+        batch["request_counts"] = {
+            "total": len(lines),
+            "completed": len(lines),
+            "failed": 0,
+        }
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, body: dict | bytes, status: int = 200) -> None:
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                stub.bytes_sent += len(data)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self) -> bytes:
+                data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.bytes_received += len(data)
+                return data
+
+            def _route(self) -> str:
+                path = self.path.split("?")[0]
+                route = f"{self.command} {_ID_SEGMENT.sub('/{id}', path)}"
+                with stub._lock:
+                    stub.calls[route] += 1
+                    failing = stub.failures[route] > 0
+                    if failing:
+                        stub.failures[route] -= 1
+                if stub.latency_seconds:
+                    time.sleep(stub.latency_seconds)
+                return "failure" if failing else route
+
+            def do_POST(self) -> None:
+                route = self._route()
+                body = self._read_body()
+
+                if route == "failure":
+                    self._send({"error": {"message": "stub failure"}}, status=500)
+                elif route == "POST /v1/files":
+                    filename, purpose, data = _parse_upload(
+                        self.headers["Content-Type"], body
+                    )
+                    self._send(stub._store_file(data, filename, purpose))
+                elif route == "POST /v1/batches":
+                    request = json.loads(body)
+                    batch_id = stub._new_id("batch")
+                    stub.batches[batch_id] = {
+                        "id": batch_id,
+                        "object": "batch",
+                        "endpoint": request["endpoint"],
+                        "completion_window": request["completion_window"],
+                        "created_at": int(time.time()),
+                        "input_file_id": request["input_file_id"],
+                        "status": "in_progress",
+                        "polls": 0,
+                    }
+                    self._send(_public(stub.batches[batch_id]))
+                elif route == "POST /v1/chat/completions":
+                    self._send(_chat_completion(json.loads(body)))
+                else:
+                    self._send({"error": {"message": route}}, status=404)
+
+            def do_GET(self) -> None:
+                route = self._route()
+                path = self.path.split("?")[0]
+                key = path.rstrip("/").split("/")
+
+                if route == "failure":
+                    self._send({"error": {"message": "stub failure"}}, status=500)
+                elif route == "GET /v1/batches":
+                    batches = [_public(b) for b in reversed(stub.batches.values())]
+                    self._send(
+                        {"object": "list", "data": batches, "has_more": False}
+                    )
+                elif route == "GET /v1/batches/{id}":
+                    batch = stub.batches[key[-1]]
+                    batch["polls"] += 1
+                    if (
+                        batch["status"] == "in_progress"
+                        and batch["polls"] >= stub.polls_to_complete
+                    ):
+                        with stub._lock:
+                            failing = stub.failed_batches > 0
+                            stub.failed_batches -= failing
+                        if failing:
+                            stub._fail(batch)
+                        else:
+                            stub._complete(batch)
+                    self._send(_public(batch))
+                elif route == "GET /v1/files/{id}/content":
+                    self._send(stub.files[key[-2]])
+                else:
+                    self._send({"error": {"message": route}}, status=404)
+
+        return Handler
+
+
+def _public(batch: dict) -> dict:
+    return {key: value for key, value in batch.items() if key != "polls"}
+
+
+def _parse_upload(content_type: str, body: bytes) -> tuple[str, str, bytes]:
+    """Filename, purpose and content of a multipart file upload."""
+    boundary = content_type.split("boundary=")[1].strip('"').encode()
+    filename, purpose, data = "upload.jsonl", "batch", b""
+
+    for part in body.split(b"--" + boundary):
+        headers, _, content = part.partition(b"\r\n\r\n")
+        content = content.removesuffix(b"\r\n")
+        if b'name="file"' in headers:
+            match = re.search(rb'filename="([^"]*)"', headers)
+            filename = match.group(1).decode() if match else filename
+            data = content
+        elif b'name="purpose"' in headers:
+            purpose = content.decode()
+
+    return filename, purpose, data
+
+
+def _chat_completion(request: dict) -> dict:
+    caption = _caption(f"chat-{len(json.dumps(request))}")
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": caption},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+    }
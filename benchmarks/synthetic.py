@@ -0,0 +1,51 @@
+"""Synthetic image datasets for the benchmarks."""
+
+import io
+from pathlib import Path
+
+import numpy as np
+from datasets import Dataset, Features, Image, Value
+from PIL import Image as PILImage
+
+
+def synthetic_images(
+    rows: int,
+    size: int = 256,
+    image_format: str = "JPEG",
+    duplicate_fraction: float = 0.0,
+    seed: int = 0,
+) -> list[bytes]:
+    """Encoded noise images, a ``duplicate_fraction`` of them repeated.
+
+    Noise does not compress, so the encoded size is a worst case for the
+    base64 encoding and upload stages.
+    """
+    rng = np.random.default_rng(seed)
+    unique = max(1, round(rows * (1 - duplicate_fraction)))
+    images = []
+
+    for _ in range(unique):
+        pixels = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        PILImage.fromarray(pixels).save(buffer, format=image_format)
+        images.append(buffer.getvalue())
+
+    return images + [images[i] for i in rng.integers(0, unique, rows - unique)]
+
+
+def synthetic_dataset(images: list[bytes]) -> Dataset:
+    """Dataset with undecoded ``image`` and reference ``alt_text`` columns."""
+    return Dataset.from_dict(
+        {
+            "image": [{"bytes": image, "path": None} for image in images],
+            "alt_text": [f"Random noise, sample {i}." for i in range(len(images))],
+        },
+        features=Features({"image": Image(decode=False), "alt_text": Value("string")}),
+    )
+
+
+def write_parquet_source(data: Dataset, directory: Path) -> str:
+    """Write ``data`` as a local dataset that ``load_dataset`` reads as ``train``."""
+    directory.mkdir(parents=True, exist_ok=True)
+    data.to_parquet(directory / "train.parquet")
+    return str(directory)
@@ -1,14 +1,22 @@
 from zenml import pipeline
 
 from steps.data_loader import load_data
+from steps.image_preprocessing import downscale_images
 from steps.data_alt_text_generator import generate_alt_text_batch_files
 from steps.data_uploader import upload_files_to_openai
 from utils.pydantic_models import BatchFileTaskList
 
 
 @pipeline(name="alt_text_data_preparation_pipeline")
-def data_preparation_pipeline() -> BatchFileTaskList:
-    data = load_data()
-    files = generate_alt_text_batch_files(data=data)
-    batch_tasks = upload_files_to_openai(files=files)
+def data_preparation_pipeline(
+    num_shards: int = 1, shard_index: int = 0
+) -> BatchFileTaskList:
+    data = load_data(num_shards=num_shards, shard_index=shard_index)
+    data = downscale_images(data=data)
+    files = generate_alt_text_batch_files(
+        data=data, num_shards=num_shards, shard_index=shard_index
+    )
+    batch_tasks = upload_files_to_openai(
+        files=files, num_shards=num_shards, shard_index=shard_index
+    )
     return batch_tasks
@@ -0,0 +1,8 @@
+from zenml import pipeline
+
+from steps.inference_tasks import generate_alt_text_locally
+
+
+@pipeline(name="alt_text_inference_pipeline")
+def inference_pipeline() -> str:
+    return generate_alt_text_locally()
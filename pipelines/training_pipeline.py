@@ -1,10 +1,14 @@
 from zenml import pipeline
 
 from steps.data_loader import load_training_data
+from steps.evaluation_tasks import evaluate_model
+from steps.feature_tasks import preprocess_training_features
 from steps.training_tasks import train_model
 
 
 @pipeline(name="alt_text_training_pipeline")
 def training_pipeline():
     data = load_training_data()
-    train_model(data)
+    features = preprocess_training_features(data)
+    model_name = train_model(data, features)
+    evaluate_model(data, model_name)
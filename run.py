@@ -1,40 +1,73 @@
+from importlib import import_module
+
 import click
 from dotenv import load_dotenv
 
+from utils.shards import shard_tag
+
 load_dotenv()
 
-from pipelines.data_preparation_pipeline import data_preparation_pipeline # noqa: E402
-from pipelines.batch_processing_pipeline import batch_processing_pipeline  # noqa: E402
-from pipelines.training_pipeline import training_pipeline # noqa: E402
+# Pipeline name -> (module, pipeline function, config path). Modules are only
+# imported for the selected pipeline, so e.g. batch processing does not load
+# the training dependencies.
+PIPELINES = {
+    "data_preparation": (
+        "pipelines.data_preparation_pipeline",
+        "data_preparation_pipeline",
+        "configs/data_preparation.yaml",
+    ),
+    "batch_processing": (
+        "pipelines.batch_processing_pipeline",
+        "batch_processing_pipeline",
+        "configs/batch_processing.yaml",
+    ),
+    "training": (
+        "pipelines.training_pipeline",
+        "training_pipeline",
+        "configs/training.yaml",
+    ),
+    "inference": (
+        "pipelines.inference_pipeline",
+        "inference_pipeline",
+        "configs/inference.yaml",
+    ),
+}
 
 
 @click.command()
 @click.option(
     "--pipeline",
-    type=click.Choice(["data_preparation", "batch_processing", "training"]),
+    type=click.Choice(list(PIPELINES)),
     required=True,
     help="Specify the pipeline to run.",
 )
-def main(pipeline: str) -> None:
-    data_preparation_config_path = "configs/data_preparation.yaml"
-    batch_processing_config_path = "configs/batch_processing.yaml"
-    training_config_path = "configs/training.yaml"
-
-    match pipeline:
-        case "data_preparation":
-            data_preparation_pipeline.with_options(
-                config_path=data_preparation_config_path
-            )()
-        case "batch_processing":
-            batch_processing_pipeline.with_options(
-                config_path=batch_processing_config_path
-            )()
-        case "training":
-            training_pipeline.with_options(config_path=training_config_path)()
-        case _:
-            click.echo(
-                "Invalid pipeline specified. Please choose from 'data_preparation', 'batch_processing', or 'training'."
-            )
+@click.option(
+    "--num-shards",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of workers data preparation is divided between.",
+)
+@click.option(
+    "--shard-index",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Zero-based shard of this data preparation worker.",
+)
+def main(pipeline: str, num_shards: int, shard_index: int) -> None:
+    module_name, pipeline_name, config_path = PIPELINES[pipeline]
+    pipeline_fn = getattr(import_module(module_name), pipeline_name)
+
+    if num_shards == 1:
+        pipeline_fn.with_options(config_path=config_path)()
+    elif pipeline != "data_preparation":
+        raise click.UsageError("Only data_preparation can be run in shards.")
+    elif shard_index >= num_shards:
+        raise click.UsageError("--shard-index must be less than --num-shards.")
+    else:
+        # The tag identifies the latest run of every shard when merging
+        pipeline_fn.with_options(
+            config_path=config_path, tags=[shard_tag(shard_index, num_shards)]
+        )(num_shards=num_shards, shard_index=shard_index)
 
 
 if __name__ == "__main__":
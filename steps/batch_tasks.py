@@ -1,97 +1,317 @@
+import asyncio
+from collections import Counter
 from pathlib import Path
-from openai import OpenAI
-from zenml import step
-from zenml.client import Client
+import httpx
+from openai import AsyncOpenAI
+from zenml import log_metadata, step
 from zenml.logger import get_logger
-from time import sleep
-from datasets import Dataset
-import pandas as pd
+from datasets import Dataset, Image, concatenate_datasets
+import pyarrow as pa
+import pyarrow.compute as pc
 
-from utils.pydantic_models import BatchFileTaskList
+from steps.data_loader import load_source_dataset
+from utils.batch_files import (
+    IMAGE_CUSTOM_ID_PREFIX,
+    IMAGE_INDEX_FILE,
+    read_image_index,
+    read_image_index_metadata,
+)
+from utils.batch_results import fan_out_captions, iter_batch_results
+from utils.dataset_sinks import HuggingFaceDatasetSink, LocalDatasetSink
+from utils.batch_poller import BatchPoller
+from utils.batch_retries import BatchRetrier
+from utils.downloads import ResultDownloader, result_file_path
+from utils.instrumentation import StageTimer
+from utils.pydantic_models import BatchFileTask, BatchFileTaskList
+from utils.rate_limit import RateLimiter
+from utils.realtime import RealtimeRunner
+from utils.response_cache import ResponseCache
+from utils.shards import latest_shard_runs, shard_directory, shard_tag
+from utils.task_store import TaskStore
+from utils.upload_manifest import UploadManifest
 
-client = Client()
-openai = OpenAI()
 logger = get_logger(__name__)
 
 
-@step
+def _open_task_store(path: str | None) -> TaskStore | None:
+    return TaskStore(path) if path else None
+
+
+def _shard_tags(num_shards: int) -> list[str]:
+    return [shard_tag(shard_index, num_shards) for shard_index in range(num_shards)]
+
+
+# The task store changes between runs, its state must never come from the cache
+@step(enable_cache=False)
 def load_batch_task_list(
     pipeline_name: str = "alt_text_data_preparation_pipeline",
     step_name: str = "upload_files_to_openai",
+    num_shards: int = 1,
+    task_store_path: str | None = "./batches/tasks.sqlite",
 ) -> BatchFileTaskList:
+    """Load the batch tasks of all shards with their latest recorded state.
+
+    Tasks are read from the task store, where every state change of a
+    previous run was recorded, so an interrupted run resumes where it
+    stopped. Shards missing from the store are loaded from the latest
+    successful data preparation run of every shard and added to the store.
+
+    Args:
+        pipeline_name: Pipeline that uploaded the batch files.
+        step_name: Step that returned the task list.
+        num_shards: Number of shards the data was prepared in.
+        task_store_path: Task store, None to always load the run artifacts.
+
+    Returns:
+        BatchFileTaskList: Tasks of all shards, in shard order.
+    """
+    store = _open_task_store(task_store_path)
+    tasks = store.tasks(_shard_tags(num_shards)) if store else None
+
+    if tasks is not None:
+        logger.info(f"Loaded {len(tasks)} tasks from the task store.")
+    else:
+        logger.info(
+            f"Loading batch task list from pipeline: {pipeline_name}, step: {step_name}"
+        )
+        tasks = []
+        runs = latest_shard_runs(pipeline_name, num_shards)
+        for shard, run in zip(_shard_tags(num_shards), runs):
+            shard_tasks = run.steps[step_name].output.load().tasks
+            logger.info(f"Loaded {len(shard_tasks)} tasks from run {run.name}.")
+            if store:
+                store.replace_shard(shard, shard_tasks)
+            tasks.extend(shard_tasks)
+
+    if store:
+        store.close()
+    logger.info(f"Loaded task list with {len(tasks)} tasks.")
+    return BatchFileTaskList(tasks=tasks)
+
+
+def _record_retries(store: TaskStore | None, retries: list[BatchFileTask]) -> None:
+    """Add retry tasks to the task store, in the shard of the task they retry."""
+    if store:
+        for task in retries:
+            store.add(store.shard_of(task.retry_of) or "", [task])
+
+
+def _realtime_status(succeeded: int, failed: int) -> str:
+    if failed and not succeeded:
+        return "failed"
+    # Like a batch that completed with errors, failures are in the error file
+    return "completed"
+
+
+def _run_realtime(
+    task_list: BatchFileTaskList,
+    directory: Path,
+    limiter: RateLimiter,
+    max_concurrent: int,
+    max_retries: int,
+    max_batch_retries: int,
+    store: TaskStore | None,
+) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    limits = httpx.Limits(
+        max_connections=max_concurrent, max_keepalive_connections=max_concurrent
+    )
+
+    async def run_task(runner: RealtimeRunner, task: BatchFileTask) -> None:
+        result_path = result_file_path(directory, task, "result")
+        error_path = result_file_path(directory, task, "errors")
+
+        if result_path.exists():
+            # Finished in an earlier run, failures are in the error file
+            succeeded = sum(1 for _ in iter_batch_results(result_path))
+            failed = (
+                sum(1 for _ in iter_batch_results(error_path))
+                if error_path.exists()
+                else 0
+            )
+        else:
+            logger.info(f"Sending requests of {task.path} in realtime.")
+            succeeded, failed = await runner.run_file(
+                Path(task.path), result_path, error_path, task.estimated_tokens or 0
+            )
+
+        task.status = _realtime_status(succeeded, failed)
+        task.result_path = str(result_path)
+        task.error_path = str(error_path) if failed else None
+        if store:
+            store.update(task)
+
+    async def run() -> RealtimeRunner:
+        async with AsyncOpenAI(
+            http_client=httpx.AsyncClient(limits=limits), max_retries=0
+        ) as client:
+            runner = RealtimeRunner(client, limiter, max_concurrent, max_retries)
+            # Retry files are sent in realtime as well, they are not uploaded
+            retrier = BatchRetrier(client, None, max_attempts=max_batch_retries)
+            tasks = task_list.tasks
+
+            while tasks:
+                for task in tasks:
+                    await run_task(runner, task)
+                tasks = await retrier.retry_tasks(task_list.tasks)
+                task_list.tasks.extend(tasks)
+                _record_retries(store, tasks)
+            return runner
+
+    runner = asyncio.run(run())
+    log_metadata(
+        metadata={
+            "realtime": {"requests": runner.requests, "failed": runner.failed}
+        }
+    )
     logger.info(
-        f"Loading batch task list from pipeline: {pipeline_name}, step: {step_name}"
+        f"Sent {runner.requests} requests in realtime, {runner.failed} failed."
     )
-    run = client.get_pipeline(pipeline_name).last_successful_run
-    task_list = run.steps[step_name].output.load()
-    logger.info(f"Loaded task list with {len(task_list.tasks)} tasks.")
-    return task_list
 
 
 @step()
 def wait_and_update_batch(
     task_list: BatchFileTaskList,
     wait_seconds: int = 60,
+    min_wait_seconds: int = 5,
+    token_budget: int | None = None,
+    download_results: bool = True,
+    max_concurrent_downloads: int = 4,
+    path: str = "./batches",
+    mode: str = "batch",
+    requests_per_minute: int | None = 500,
+    tokens_per_minute: int | None = 200_000,
+    max_concurrent_requests: int = 32,
+    max_retries: int = 5,
+    max_batch_retries: int = 2,
+    task_store_path: str | None = "./batches/tasks.sqlite",
 ) -> BatchFileTaskList:
-    for task in task_list.tasks:
-        if task.batch_id is not None:
-            logger.info(f"Task {task.file_id} already has a batch ID {task.batch_id}.")
-            batch = openai.batches.retrieve(task.batch_id)
-            task.status = batch.status
-            task.result_file_id = getattr(batch, "output_file_id", None)
-            logger.info(
-                f"Updated task {task.file_id} with existing batch ID {task.batch_id}."
+    """Create missing OpenAI batches and wait until all of them are terminal.
+
+    All batches are polled concurrently, starting every ``min_wait_seconds`` and
+    backing off up to ``wait_seconds`` while a batch's status does not change.
+    With a ``token_budget``, batches are only submitted while the estimated
+    input tokens of all in-flight batches fit into the budget. With
+    ``download_results``, the result file of each batch is downloaded as soon
+    as the batch completes, overlapping with the batches still running.
+
+    Requests without a successful response in a failed, expired, cancelled or
+    partially failed batch are collected into a retry file that is submitted
+    as a new task, up to ``max_batch_retries`` times per request. Retry tasks
+    are appended to the returned task list. The partial results of such a
+    batch are downloaded to build its retry file even if ``download_results``
+    is off, batches that completed without errors are not.
+
+    Every state change is recorded in the task store as it happens. With a
+    task store the recorded state is trusted, so finished batches are not
+    looked up again and no listing of all batches is needed.
+
+    With ``mode="realtime"`` no batches are created. The requests of the batch
+    files are sent to the API directly instead, limited to
+    ``requests_per_minute`` and ``tokens_per_minute``, and their results are
+    written in the Batch API output format, see ``RealtimeRunner``. A task
+    whose requests all failed ends as failed, failures of other tasks are in
+    their error file like for a batch that completed with errors. Failed
+    requests are retried in realtime, up to ``max_batch_retries`` times.
+
+    Args:
+        task_list: Tasks of the uploaded batch files.
+        wait_seconds: Maximum poll interval in seconds.
+        min_wait_seconds: Initial poll interval in seconds.
+        token_budget: Maximum enqueued input tokens, None submits everything
+            at once.
+        download_results: Whether to download results of completed batches,
+            batches with requests to retry are always downloaded.
+        max_concurrent_downloads: Maximum number of simultaneous downloads.
+        path: Directory the result files are written to.
+        mode: "batch" for the Batch API, "realtime" for direct requests.
+        requests_per_minute: Realtime request limit, None for no limit.
+        tokens_per_minute: Realtime input token limit, None for no limit.
+        max_concurrent_requests: Maximum realtime requests in flight.
+        max_retries: Retries per realtime request for transient errors.
+        max_batch_retries: Retries of the failed requests of a batch.
+        task_store_path: Task store, None to keep the state only in the
+            returned task list.
+
+    Returns:
+        BatchFileTaskList: The tasks with their final batch status.
+    """
+    if mode not in ("batch", "realtime"):
+        raise ValueError(f"Unknown mode: {mode}")
+
+    store = _open_task_store(task_store_path)
+    timer = StageTimer()
+    if mode == "realtime":
+        with timer.stage("realtime", rows=len(task_list.tasks)):
+            _run_realtime(
+                task_list,
+                Path(path),
+                RateLimiter(requests_per_minute, tokens_per_minute),
+                max_concurrent_requests,
+                max_retries,
+                max_batch_retries,
+                store,
             )
-            continue
+        if store:
+            store.close()
+        log_metadata(metadata=timer.metadata())
+        return task_list
 
-        for batch in openai.batches.list():
-            if batch.input_file_id == task.file_id:
-                task.status = batch.status
-                task.result_file_id = getattr(batch, "output_file_id", None)
-                task.batch_id = batch.id
-                logger.info(
-                    f"Found existing OpenAI Batch {batch.id} for task {task.file_id}."
-                )
-                break
-
-    do_not_work_status = [
-        "validating",
-        "finalizing",
-        "completed",
-        "cancelling",
-        "cancelled",
-    ]
-    stop_working_status = ["failed", "expired", "cancelled", "completed"]
+    async def run() -> None:
+        async with AsyncOpenAI() as client:
+            downloader = ResultDownloader(
+                client, Path(path), max_concurrent=max_concurrent_downloads
+            )
 
-    for task in task_list.tasks:
-        if task.status in do_not_work_status:
-            logger.info(f"Task {task.file_id} is in status {task.status}, ignoring.")
-            continue
+            async def on_terminal(task: BatchFileTask) -> None:
+                # Retries are built from the downloaded partial results
+                needs_retry = task.attempt < max_batch_retries and (
+                    task.status != "completed" or task.error_file_id is not None
+                )
+                if not (download_results or needs_retry):
+                    return
+                if not download_results:
+                    logger.info(
+                        f"Downloading the results of {task.file_id} "
+                        f"({task.status}) to retry its failed requests."
+                    )
+                await downloader(task)
+                if store:
+                    store.update(task)
 
-        logger.info(f"Starting OpenAI Batch for task {task.file_id}.")
-        if task.status != "in_progress":
-            # Only create a new batch if the task is not already in progress
-            job = openai.batches.create(
-                input_file_id=task.file_id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h",
+            poller = BatchPoller(
+                client,
+                min_wait=min_wait_seconds,
+                max_wait=wait_seconds,
+                token_budget=token_budget,
+                on_terminal=on_terminal,
+                on_update=store.update if store else None,
+                list_batches=store is None,
             )
-            task.batch_id = job.id
-            task.status = job.status
-            logger.info(
-                f"Created OpenAI Batch with ID {task.batch_id} for task {task.file_id}."
+            retrier = BatchRetrier(
+                client,
+                UploadManifest(Path(path) / "upload_manifest.json"),
+                max_attempts=max_batch_retries,
             )
+            tasks = task_list.tasks
+
+            while tasks:
+                await poller.run(tasks)
+                tasks = await retrier.retry_tasks(task_list.tasks)
+                task_list.tasks.extend(tasks)
+                _record_retries(store, tasks)
 
-        # Wait for the task to complete or reach a terminal status
-        while task.status not in stop_working_status:
-            sleep(wait_seconds)
-            job = openai.batches.retrieve(task.batch_id)
-            task.status = job.status
-            task.result_file_id = getattr(job, "output_file_id", None)
-            logger.info(f"Updated task {task.file_id} status to {task.status}.")
+    # Submission, polling, downloads and retries overlap in one event loop and
+    # are timed together
+    with timer.stage("poll"):
+        asyncio.run(run())
+    timer.add("poll", rows=len(task_list.tasks))
+    if store:
+        store.close()
+    log_metadata(metadata=timer.metadata())
 
     for task in task_list.tasks:
-        print(f"{task}")
+        logger.info(f"{task}")
 
     return task_list
 
@@ -99,74 +319,291 @@ def wait_and_update_batch(
 @step()
 def download_batch_results(
     task_list: BatchFileTaskList,
+    max_concurrent_downloads: int = 4,
+    path: str = "./batches",
+    task_store_path: str | None = "./batches/tasks.sqlite",
 ) -> list[Path]:
+    """Download the output and error files of all finished batches.
+
+    Files are streamed to disk in chunks, several at a time, and only appear
+    under their final name once complete. Files already downloaded by
+    ``wait_and_update_batch`` are not downloaded again. Output files of
+    batches that did not complete hold their partial results.
+
+    Args:
+        task_list: Tasks with their final batch status.
+        max_concurrent_downloads: Maximum number of simultaneous downloads.
+        path: Directory the result files are written to.
+        task_store_path: Task store the result paths are recorded in.
+
+    Returns:
+        list[Path]: Paths of the downloaded output and error files.
+    """
     logger.info("Downloading batch results for all tasks.")
-    downloaded_files = []
 
-    for task in task_list.tasks:
-        if task.status == "completed" and task.result_file_id:
-            logger.info(f"Downloading result file for task {task.file_id}.")
-            file_content = openai.files.content(task.result_file_id)
-            file_path = Path(f"batches/{task.file_id}_result.jsonl")
+    async def run() -> None:
+        async with AsyncOpenAI() as client:
+            downloader = ResultDownloader(
+                client, Path(path), max_concurrent=max_concurrent_downloads
+            )
+            await asyncio.gather(*(downloader(task) for task in task_list.tasks))
+
+    timer = StageTimer()
+    with timer.stage("download"):
+        asyncio.run(run())
+    downloaded_files = []
 
-            with open(file_path, "wb") as f:
-                f.write(file_content.read())
+    if task_store_path:
+        with TaskStore(task_store_path) as store:
+            for task in task_list.tasks:
+                store.update(task)
 
-            downloaded_files.append(file_path)
-            logger.info(f"Downloaded result file to {file_path}.")
+    for task in task_list.tasks:
+        if task.result_path:
+            downloaded_files.append(Path(task.result_path))
         else:
             logger.warning(f"No result file for task {task.file_id}.")
+        if task.error_path:
+            downloaded_files.append(Path(task.error_path))
 
+    timer.add(
+        "download",
+        rows=len(downloaded_files),
+        bytes=sum(path.stat().st_size for path in downloaded_files if path.exists()),
+    )
+    log_metadata(metadata=timer.metadata())
     logger.info(f"Downloaded {len(downloaded_files)} result files.")
     return downloaded_files
 
 
+def _merge_response_cache(
+    cache: ResponseCache,
+    index_paths: list[Path],
+    shard_hashes: list[pa.ChunkedArray],
+    captions: dict[str, str],
+) -> int:
+    """Add cached captions to ``captions``, then store the new ones in the cache.
+
+    The cache key of every shard is read from its image index. Returns the
+    number of captions taken from the cache.
+    """
+    merged = 0
+
+    for index_path, hashes in zip(index_paths, shard_hashes):
+        metadata = read_image_index_metadata(index_path)
+        if "openai_model" not in metadata:
+            continue
+
+        key = (metadata["openai_model"], metadata["prompt_hash"])
+        unique = pc.unique(hashes).drop_null().to_pylist()
+        new = {hash: captions[hash] for hash in unique if hash in captions}
+        cached = cache.get_many(*key, (hash for hash in unique if hash not in new))
+        captions.update(cached)
+        merged += len(cached)
+        cache.put_many(*key, new)
+
+    return merged
+
+
 @step()
 def add_batch_results_to_dataset(
     result_files: list[Path],
     pipeline_name: str = "alt_text_data_preparation_pipeline",
     step_name: str = "load_data",
     hf_repo_id: str = "scheidti/vqav2-small-alt-text",
+    local_dir: str | None = None,
+    rows_per_shard: int = 5000,
+    image_row: str = "image",
+    image_index_path: str = f"./batches/{IMAGE_INDEX_FILE}",
+    num_shards: int = 1,
+    response_cache_path: str | None = "./cache/responses.sqlite",
+    response_cache_max_bytes: int | None = 1_000_000_000,
+    task_store_path: str | None = "./batches/tasks.sqlite",
 ) -> str:
+    """Add the generated alt texts as a new column and publish the dataset.
+
+    Result files are parsed line by line. A successful result of a retried
+    request takes precedence over failures of earlier attempts, in any file
+    order. Captions are attached with a single column append, using the image
+    index written by ``generate_alt_text_batch_files`` to fan each caption
+    out to every row with the same image. Counts of skipped results by status
+    code, and the number of requested images without any result, are
+    recorded as step metadata.
+
+    The dataset is published to a ``DatasetSink`` as content-addressed Parquet
+    shards, only shards whose content changed since the last run are uploaded.
+
+    Data prepared in ``num_shards`` shards is reassembled from the latest run
+    of every shard, in shard order, together with the shards' image indices.
+    Shards whose source was recorded in the task store by ``load_data`` are
+    loaded from that source directly, at the recorded revision, instead of
+    from the run artifacts. Every shard must have as many rows as were
+    recorded and as its image index, otherwise results would be attached to
+    the wrong rows.
+
+    New captions are stored in the response cache, and captions of images
+    that ``generate_alt_text_batch_files`` skipped as cache hits are merged
+    back in from it.
+
+    Args:
+        result_files: Downloaded Batch API output files.
+        pipeline_name: Pipeline that loaded the source dataset.
+        step_name: Step that loaded the source dataset.
+        hf_repo_id: Hugging Face dataset repository to publish to.
+        local_dir: Publish to this local directory instead of the Hub.
+        rows_per_shard: Number of rows per published Parquet shard.
+        image_row: Name of the column containing image data.
+        image_index_path: Row to image hash index of the batch files, the
+            index of every shard is read from its shard directory.
+        num_shards: Number of shards the data was prepared in.
+        response_cache_path: SQLite response cache, None to disable it.
+        response_cache_max_bytes: Size limit of the cached alt texts, least
+            recently used entries are evicted beyond it.
+        task_store_path: Task store with the recorded sources of the shards.
+
+    Returns:
+        str: URI of the dataset sink, see ``open_dataset_sink``.
+    """
     logger.info("Adding batch results to dataset.")
-    run = client.get_pipeline(pipeline_name).last_successful_run
-    dataset: Dataset = run.steps[step_name].output.load()
-    alt_text_mapping = {}
+    timer = StageTimer()
+    store = _open_task_store(task_store_path)
+    sources = store.sources(_shard_tags(num_shards)) if store else None
+    if store:
+        store.close()
+
+    with timer.stage("load_source"):
+        if sources is not None:
+            logger.info("Loading the source data recorded in the task store.")
+            shards = []
+            for shard_index, source in enumerate(sources):
+                rows = source.pop("rows", None)
+                shard = load_source_dataset(**source)
+                if rows is not None and len(shard) != rows:
+                    raise ValueError(
+                        f"Shard {shard_index} of {source['dataset']} has "
+                        f"{len(shard)} rows, {rows} were recorded when the "
+                        f"batch files were prepared."
+                    )
+                shards.append(shard)
+        else:
+            runs = latest_shard_runs(pipeline_name, num_shards)
+            shards = [run.steps[step_name].output.load() for run in runs]
+        dataset: Dataset = concatenate_datasets(shards)
+    timer.add("load_source", rows=len(dataset))
+    index_paths = [
+        shard_directory(Path(image_index_path).parent, shard_index, num_shards)
+        / Path(image_index_path).name
+        for shard_index in range(num_shards)
+    ]
+    captions = {}
+    failures = {}
 
     for file_path in result_files:
         logger.info(f"Adding results from {file_path} to dataset.")
-        data = pd.read_json(file_path, lines=True)
-        for _, row in data.iterrows():
-            status_code = row.get("response").get("status_code")
-            row_id = int(row.get("custom_id").replace("row_", ""))
-
-            if status_code != 200:
-                logger.warning(
-                    f"Skipping row {row_id} due to status code {status_code}."
+        timer.add("parse_results", bytes=Path(file_path).stat().st_size)
+        for result in timer.timed("parse_results", iter_batch_results(file_path)):
+            if result.status_code != 200:
+                failures[result.custom_id] = str(result.status_code)
+            elif not result.alt_text:
+                failures[result.custom_id] = "empty"
+            else:
+                captions[result.custom_id] = result.alt_text
+
+    skipped = Counter(
+        reason
+        for custom_id, reason in failures.items()
+        if custom_id not in captions
+    )
+
+    missing_indices = [path for path in index_paths if not path.exists()]
+    if missing_indices:
+        raise FileNotFoundError(
+            f"Missing image index {[str(path) for path in missing_indices]}. "
+            f"Results are matched to rows through the image index written by "
+            f"generate_alt_text_batch_files, prepare the batch files again."
+        )
+
+    with timer.stage("fan_out", rows=len(dataset)):
+        # Requests were deduplicated by image, fan results out to all rows
+        shard_hashes = [read_image_index(index_path) for index_path in index_paths]
+        for shard, hashes, index_path in zip(shards, shard_hashes, index_paths):
+            if len(shard) != len(hashes):
+                raise ValueError(
+                    f"The source data has {len(shard)} rows but the image index "
+                    f"{index_path} has {len(hashes)}, prepare the batch files "
+                    f"again."
                 )
-                continue
-
-            alt_text = (
-                row.get("response")
-                .get("body")
-                .get("choices")[0]
-                .get("message")
-                .get("content")
+        image_hashes = pa.chunked_array(
+            [chunk for hashes in shard_hashes for chunk in hashes.chunks],
+            pa.string(),
+        )
+        image_captions = {
+            custom_id.removeprefix(IMAGE_CUSTOM_ID_PREFIX): alt_text
+            for custom_id, alt_text in captions.items()
+        }
+
+        if response_cache_path:
+            with ResponseCache(
+                response_cache_path, max_bytes=response_cache_max_bytes
+            ) as cache:
+                cached = _merge_response_cache(
+                    cache, index_paths, shard_hashes, image_captions
+                )
+                entries, cache_bytes = cache.size()
+            log_metadata(
+                metadata={
+                    "response_cache": {
+                        "merged": cached,
+                        "entries": entries,
+                        "bytes": cache_bytes,
+                    }
+                }
             )
+            logger.info(f"Merged {cached} captions from the response cache.")
+
+        alt_texts = fan_out_captions(image_hashes, image_captions)
 
-            if not alt_text:
-                logger.warning(f"No alt text generated for row {row_id}.")
-                continue
+    # Images that were requested but have neither a caption nor a failed result,
+    # e.g. requests of a batch that expired after the last retry
+    returned = image_captions.keys() | {
+        custom_id.removeprefix(IMAGE_CUSTOM_ID_PREFIX) for custom_id in failures
+    }
+    missing = sum(
+        1
+        for image_hash in pc.unique(image_hashes).drop_null().to_pylist()
+        if image_hash not in returned
+    )
+
+    if skipped:
+        logger.warning(f"Skipped results by status code: {dict(skipped)}")
+    if missing:
+        logger.warning(f"No result for {missing} images, their alt text is empty.")
+    log_metadata(
+        metadata={
+            "captions": len(captions),
+            "skipped_by_status": dict(skipped),
+            "missing": missing,
+        }
+    )
 
-            alt_text_mapping[row_id] = alt_text
+    dataset = dataset.add_column("alt_text", alt_texts)
+    # load_data keeps images undecoded, publish them as regular image features
+    dataset = dataset.cast_column(image_row, Image())
 
-    def add_alt_text(example, idx):
-        example["alt_text"] = alt_text_mapping.get(idx, "")
-        return example
+    if local_dir is not None:
+        sink = LocalDatasetSink(local_dir, rows_per_shard=rows_per_shard)
+    else:
+        sink = HuggingFaceDatasetSink(hf_repo_id, rows_per_shard=rows_per_shard)
 
-    dataset = dataset.map(add_alt_text, with_indices=True)
-    logger.info(f"Attempting to push dataset to Hugging Face Hub: {hf_repo_id}")
-    commit_info = dataset.push_to_hub(hf_repo_id)
-    logger.info(f"Dataset pushed to Hugging Face Hub at {commit_info.repo_url}.")
+    logger.info(f"Publishing dataset to {sink.uri}")
+    with timer.stage("publish", rows=len(dataset)):
+        summary = sink.publish(dataset)
+    timer.add("publish", bytes=summary.uploaded_bytes)
+    log_metadata(metadata={"publish": summary._asdict(), **timer.metadata()})
+    logger.info(
+        f"Published dataset to {sink.uri}: uploaded {summary.uploaded} of "
+        f"{summary.shards} shards ({summary.uploaded_bytes} bytes), "
+        f"deleted {summary.deleted}."
+    )
 
-    return commit_info.repo_url.repo_id
+    return sink.uri
@@ -1,72 +1,202 @@
-import json
-
+from collections.abc import Iterator
+from functools import partial
 from pathlib import Path
-from zenml import step
+from time import perf_counter
+from zenml import log_metadata, step
 from zenml.logger import get_logger
 from datasets import Dataset
 
-from utils.images import image_to_base64
+from utils.batch_files import (
+    IMAGE_INDEX_FILE,
+    ImageIndexWriter,
+    JsonlShardWriter,
+    RequestChunk,
+    encode_request_chunk,
+    image_custom_id,
+    image_hash,
+)
+from utils.images import iter_image_buffers
+from utils.instrumentation import StageTimer
+from utils.parallel import ordered_map
 from utils.prompts import generate_alt_text_prompt
+from utils.pydantic_models import BatchFileList
+from utils.response_cache import ResponseCache, prompt_hash
+from utils.shards import shard_directory
 
 logger = get_logger(__name__)
 
 
+def _iter_request_chunks(
+    data: Dataset,
+    image_row: str,
+    chunk_size: int,
+    index: ImageIndexWriter,
+    cache: ResponseCache | None = None,
+    cache_key: tuple[str, str] = ("", ""),
+) -> Iterator[RequestChunk]:
+    seen = set()
+
+    # The Arrow format skips image decoding regardless of the column feature,
+    # so the stored bytes are handed to the encoder as they are.
+    for table in data.with_format("arrow").iter(batch_size=chunk_size):
+        hashes = []
+        chunk = []
+
+        for image in iter_image_buffers(table[image_row]):
+            if image is None:
+                hashes.append(None)
+                continue
+
+            hash = image_hash(image)
+            hashes.append(hash)
+
+            if hash not in seen:
+                seen.add(hash)
+                chunk.append((hash, image))
+
+        index.write(hashes)
+        if cache is not None and chunk:
+            cached = cache.get_many(*cache_key, (hash for hash, _ in chunk))
+            chunk = [(hash, image) for hash, image in chunk if hash not in cached]
+        if chunk:
+            yield [(image_custom_id(hash), image) for hash, image in chunk]
+
+
 @step
 def generate_alt_text_batch_files(
     data: Dataset,
     image_row: str = "image",
     openai_model: str = "gpt-4.1-nano",
     batch_size: int = 2000,
+    max_file_bytes: int = 190_000_000,
+    num_workers: int = 1,
+    encode_chunk_size: int = 64,
     path: str = "./batches",
-) -> list[Path]:
+    num_shards: int = 1,
+    shard_index: int = 0,
+    response_cache_path: str | None = "./cache/responses.sqlite",
+) -> BatchFileList:
+    """Write OpenAI Batch API request files for every image in the dataset.
+
+    Requests are generated lazily and streamed straight into JSONL shards, so
+    memory use does not depend on the dataset size. A new shard is started once
+    the current one holds ``batch_size`` requests or would grow beyond
+    ``max_file_bytes``. With ``num_workers`` greater than one, chunks of rows
+    are encoded in a process pool while the output keeps the row order.
+
+    Images are deduplicated by content hash: only one request is sent per
+    unique image, using ``img_<hash>`` as custom ID, and the row to hash index
+    is written to ``image_index.parquet`` next to the batch files so results
+    can be fanned back out to every row.
+
+    When the data is one of ``num_shards`` shards, the files are written to a
+    subdirectory of ``path`` per shard, see ``shard_directory``. Custom IDs are
+    derived from image content and therefore unique across shards.
+
+    Images whose caption for the same model and prompt is already in the
+    response cache, filled by ``add_batch_results_to_dataset``, are left out
+    of the requests. The model and prompt hash are stored in the image index
+    so the cached captions can be merged back in with the new results.
+
+    Args:
+        data: Dataset containing the images.
+        image_row: Name of the column containing image data. Defaults to "image".
+        openai_model: Model used for the chat completion requests.
+        batch_size: Maximum number of requests per batch file.
+        max_file_bytes: Maximum size of a batch file in bytes.
+        num_workers: Number of processes used to encode images.
+        encode_chunk_size: Number of rows sent to a worker at once.
+        path: Directory the batch files are written to, on storage shared
+            by all workers when the shards are prepared on several machines.
+        num_shards: Number of shards the dataset is divided into.
+        shard_index: Index of the shard in ``data``.
+        response_cache_path: SQLite response cache, None to send every image.
+
+    Returns:
+        BatchFileList: The written batch files with their request count, size
+            and estimated input tokens.
+    """
     dataset_size = len(data)
-    batches = [
-        data.select(range(i, min(i + batch_size, dataset_size)))
-        for i in range(0, dataset_size, batch_size)
-    ]
-    files = []
-    index = 0
     logger.info(
-        f"Generating alt text for {dataset_size} rows in batches of {batch_size}"
+        f"Generating alt text requests for {dataset_size} rows with {num_workers} "
+        f"workers, at most {batch_size} requests or {max_file_bytes} bytes per file"
     )
 
-    for batch in batches:
-        logger.info(f"Processing batch {batches.index(batch) + 1}/{len(batches)}")
-        batch_path = Path(path) / f"batch_{batches.index(batch)}.jsonl"
-        batch_data = []
-
-        for row in batch:
-            entry = {
-                "custom_id": f"row_{index}",
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": {"model": openai_model, "messages": []},
+    directory = shard_directory(Path(path), shard_index, num_shards)
+    encode = partial(encode_request_chunk, openai_model=openai_model)
+    cache_key = (openai_model, prompt_hash(generate_alt_text_prompt))
+    cache = ResponseCache(response_cache_path) if response_cache_path else None
+    requests = 0
+    timer = StageTimer()
+    started = perf_counter()
+
+    with (
+        JsonlShardWriter(
+            directory, max_bytes=max_file_bytes, max_lines=batch_size
+        ) as writer,
+        ImageIndexWriter(
+            directory / IMAGE_INDEX_FILE,
+            metadata={"openai_model": cache_key[0], "prompt_hash": cache_key[1]},
+        ) as index,
+    ):
+        chunks = timer.timed(
+            "read_images",
+            _iter_request_chunks(
+                data, image_row, encode_chunk_size, index, cache, cache_key
+            ),
+            rows=len,
+            bytes=lambda chunk: sum(len(image) for _, image in chunk),
+        )
+        encoded = timer.timed(
+            "encode_requests",
+            ordered_map(encode, chunks, num_workers=num_workers),
+            rows=lambda result: len(result[0]),
+            bytes=lambda result: sum(len(line) for line, _ in result[0]),
+        )
+        for lines, skipped in encoded:
+            with timer.stage(
+                "write_jsonl",
+                rows=len(lines),
+                bytes=sum(len(line) for line, _ in lines),
+            ):
+                for line, tokens in lines:
+                    writer.write(line, tokens)
+            for custom_id in skipped:
+                logger.warning(f"Skipping image {custom_id}, unable to encode it.")
+            requests += len(lines)
+
+    elapsed = perf_counter() - started
+    rows_per_second = dataset_size / elapsed if elapsed > 0 else 0.0
+    log_metadata(
+        metadata={
+            "rows": dataset_size,
+            "requests": requests,
+            "num_workers": num_workers,
+            "encode_seconds": round(elapsed, 3),
+            "rows_per_second": round(rows_per_second, 2),
+            "estimated_tokens": sum(file.estimated_tokens for file in writer.files),
+            **timer.metadata(),
+        }
+    )
+    if cache is not None:
+        log_metadata(
+            metadata={
+                "response_cache": {
+                    "hits": cache.hits,
+                    "misses": cache.misses,
+                    "hit_rate": round(cache.hit_rate, 4),
+                }
             }
-            image = row[image_row]
-            base64, format = image_to_base64(image)
-
-            if base64:
-                entry["body"]["messages"].append(
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": generate_alt_text_prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/{format};base64,{base64}",
-                                },
-                            },
-                        ],
-                    }
-                )
-                batch_data.append(entry)
-
-            index += 1
-
-        batch_path.write_text("\n".join([json.dumps(item) for item in batch_data]))
-        files.append(batch_path)
-        logger.info(f"Batch {batches.index(batch)} saved to {batch_path}")
-
-    logger.info(f"Generated {len(files)} batch files in {path}")
-    return files
+        )
+        logger.info(
+            f"Response cache: {cache.hits} hits, {cache.misses} misses "
+            f"({cache.hit_rate:.1%} hit rate)"
+        )
+        cache.close()
+
+    files = writer.files
+    logger.info(
+        f"Generated {len(files)} batch files with {requests} requests for "
+        f"{dataset_size} rows in {directory} ({rows_per_second:.1f} rows/sec)"
+    )
+    return BatchFileList(files=files)
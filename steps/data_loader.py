@@ -1,36 +1,107 @@
+from pathlib import Path
+
 from zenml import step
 from zenml.logger import get_logger
-from zenml.client import Client
-from datasets import load_dataset, Dataset, DatasetDict
+from datasets import concatenate_datasets, load_dataset, Dataset, DatasetDict, Image
+
+from utils.clients import get_zenml_client
+from utils.dataset_sinks import open_dataset_sink
+from utils.shards import shard_tag
+from utils.splits import hash_split
+from utils.task_store import TaskStore
 
 logger = get_logger(__name__)
 
-client = Client()
 
+def resolve_revision(dataset: str, revision: str | None = None) -> str | None:
+    """Commit of a Hub dataset at ``revision``, unchanged for local datasets.
 
-@step
+    Offline the revision cannot be resolved and is returned unchanged too.
+    """
+    from huggingface_hub import HfApi, constants
+
+    if Path(dataset).exists() or constants.HF_HUB_OFFLINE:
+        return revision
+    return HfApi().dataset_info(dataset, revision=revision).sha
+
+
+def load_source_dataset(
+    dataset: str,
+    image_row: str = "image",
+    split: str = "validation",
+    decode_images: bool = False,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    revision: str | None = None,
+) -> Dataset:
+    """Load one shard of a dataset's image column, see ``load_data``."""
+    data = load_dataset(dataset, split=split, revision=revision)
+
+    cols_to_drop = [col for col in data.column_names if col != image_row]
+    data = data.remove_columns(cols_to_drop)
+    data = data.cast_column(image_row, Image(decode=decode_images))
+
+    if num_shards > 1:
+        data = data.shard(num_shards, shard_index, contiguous=True)
+        logger.info(f"Selected shard {shard_index} of {num_shards}: {len(data)} rows.")
+
+    return data
+
+
+# Records state in the task store, which a cached run would skip
+@step(enable_cache=False)
 def load_data(
-    dataset: str, image_row: str = "image", split: str = "validation"
+    dataset: str,
+    image_row: str = "image",
+    split: str = "validation",
+    decode_images: bool = False,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    revision: str | None = None,
+    task_store_path: str | None = "./batches/tasks.sqlite",
 ) -> Dataset:
     """Load a dataset and filter to keep only the specified image column.
 
     This ZenML step loads a dataset from Hugging Face datasets and removes all
     columns except for the specified image column, preparing the data for
-    further processing in the pipeline.
+    further processing in the pipeline. The source is recorded in the task
+    store, pinned to the commit of the dataset repository and with the number
+    of rows of the shard, so the batch processing pipeline can load exactly
+    the same data again.
 
     Args:
         dataset: Name of the dataset to load from Hugging Face datasets.
         image_row: Name of the column containing image data. Defaults to "image".
         split: Dataset split to load (e.g., "train", "validation", "test").
                Defaults to "validation".
+        decode_images: Whether the image column is decoded into PIL images on
+               access. Disabled by default so the original encoded bytes are
+               kept and passed through without a decode/re-encode round trip.
+        num_shards: Number of workers the split is divided between.
+        shard_index: Zero-based index of this worker's contiguous shard.
+        revision: Branch, tag or commit of the dataset repository, defaults
+               to the latest commit of the main branch.
+        task_store_path: Task store the source is recorded in, None to skip.
 
     Returns:
         Dataset: A Hugging Face Dataset containing only the specified image column.
     """
-    data = load_dataset(dataset, split=split)
-
-    cols_to_drop = [col for col in data.column_names if col != image_row]
-    data = data.remove_columns(cols_to_drop)
+    source = {
+        "dataset": dataset,
+        "image_row": image_row,
+        "split": split,
+        "decode_images": decode_images,
+        "num_shards": num_shards,
+        "shard_index": shard_index,
+        "revision": resolve_revision(dataset, revision),
+    }
+    data = load_source_dataset(**source)
+
+    if task_store_path:
+        with TaskStore(task_store_path) as store:
+            store.record_source(
+                shard_tag(shard_index, num_shards), {**source, "rows": len(data)}
+            )
 
     logger.info(f"Loaded dataset {dataset} with split {split}.")
     return data
@@ -43,35 +114,63 @@ def load_training_data(
     test_size: int = 1000,
     validation_size: int = 1000,
     seed: int = 42,
+    split_mode: str = "random",
+    hash_column: str = "image",
+    test_fraction: float = 0.05,
+    validation_fraction: float = 0.05,
 ) -> DatasetDict:
-    run = client.get_pipeline(pipeline_name).last_successful_run
-    hf_dataset_id: str = run.steps[step_name].output.load()
-    data: DatasetDict = load_dataset(hf_dataset_id)
-
-    combined_dataset = None
-    for _, split_data in data.items():
-        if combined_dataset is None:
-            combined_dataset = split_data
-        else:
-            combined_dataset = combined_dataset.concatenate(split_data)
-
-    train_val_split = combined_dataset.train_test_split(
-        test_size=test_size, shuffle=True, seed=seed
-    )
-    test_dataset = train_val_split["test"]
-    train_val_dataset = train_val_split["train"]
+    """Load the published alt text dataset and split it for training.
 
-    train_val_split = train_val_dataset.train_test_split(
-        test_size=validation_size, shuffle=True, seed=seed
-    )
-    train_dataset = train_val_split["train"]
-    validation_dataset = train_val_split["test"]
+    With ``split_mode="random"`` fixed numbers of rows are drawn at random
+    for test and validation. With ``split_mode="hash"`` every row is assigned
+    by a stable hash of ``hash_column``, see ``hash_split``. The assignment
+    of existing rows then stays the same as the dataset grows, which keeps
+    downstream caches of the splits valid.
 
-    result = DatasetDict(
-        {"train": train_dataset, "test": test_dataset, "validation": validation_dataset}
-    )
+    Args:
+        pipeline_name: Pipeline that published the dataset.
+        step_name: Step that returned the dataset URI.
+        test_size: Number of test rows in random mode.
+        validation_size: Number of validation rows in random mode.
+        seed: Shuffle seed in random mode.
+        split_mode: "random" or "hash".
+        hash_column: Column hashed in hash mode, the image or an ID column.
+        test_fraction: Fraction of test rows in hash mode.
+        validation_fraction: Fraction of validation rows in hash mode.
+
+    Returns:
+        DatasetDict: Train, test and validation splits.
+    """
+    run = get_zenml_client().get_pipeline(pipeline_name).last_successful_run
+    dataset_uri: str = run.steps[step_name].output.load()
+    data: DatasetDict = open_dataset_sink(dataset_uri).load()
+    combined_dataset = concatenate_datasets(list(data.values()))
+
+    if split_mode == "hash":
+        result = hash_split(
+            combined_dataset, hash_column, test_fraction, validation_fraction
+        )
+    elif split_mode == "random":
+        train_val_split = combined_dataset.train_test_split(
+            test_size=test_size, shuffle=True, seed=seed
+        )
+        test_dataset = train_val_split["test"]
+        train_val_dataset = train_val_split["train"]
+
+        train_val_split = train_val_dataset.train_test_split(
+            test_size=validation_size, shuffle=True, seed=seed
+        )
+        result = DatasetDict(
+            {
+                "train": train_val_split["train"],
+                "test": test_dataset,
+                "validation": train_val_split["test"],
+            }
+        )
+    else:
+        raise ValueError(f"Unknown split mode: {split_mode}")
 
     logger.info(
-        f"Created splits - Train: {len(train_dataset)}, Test: {len(test_dataset)}, Validation: {len(validation_dataset)}"
+        f"Created splits - Train: {len(result['train'])}, Test: {len(result['test'])}, Validation: {len(result['validation'])}"
     )
     return result
@@ -1,30 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from zenml import step
+from zenml import log_metadata, step
 from zenml.logger import get_logger
-from openai import OpenAI
 
-from utils.pydantic_models import BatchFileTaskList, BatchFileTask
+from utils.clients import get_openai_client
+from utils.instrumentation import StageTimer
+from utils.pydantic_models import (
+    BatchFile,
+    BatchFileList,
+    BatchFileTask,
+    BatchFileTaskList,
+)
+from utils.retry import retry_with_backoff
+from utils.shards import shard_directory, shard_tag
+from utils.task_store import TaskStore
+from utils.upload_manifest import UploadManifest, file_sha256
 
 logger = get_logger(__name__)
-client = OpenAI()
 
 
-@step
-def upload_files_to_openai(files: list[Path]) -> BatchFileTaskList:
-    tasks = []
-    logger.info(f"Uploading {len(files)} files to OpenAI for batch processing")
+def _upload_file(
+    file: BatchFile, manifest: UploadManifest, max_retries: int
+) -> BatchFileTask:
+    path = Path(file.path)
+    checksum = file_sha256(path)
+    file_id = manifest.get(checksum)
 
-    for path in files:
+    if file_id is not None:
+        logger.info(f"Skipping {path}, already uploaded as {file_id}.")
+    else:
         logger.info(f"Uploading file: {path}")
-        batch_input_file = client.files.create(file=open(path, "rb"), purpose="batch")
-        task = BatchFileTask(
-            file_id=batch_input_file.id,
-            path=str(path),
-            status="pending",
-            result_file_id=None,
-            batch_id=None,
+
+        def create():
+            with open(path, "rb") as f:
+                return get_openai_client().files.create(file=f, purpose="batch")
+
+        file_id = retry_with_backoff(create, max_retries=max_retries).id
+        manifest.record(checksum, file_id, path)
+        logger.info(f"File uploaded with ID: {file_id}")
+
+    return BatchFileTask(
+        file_id=file_id,
+        path=str(path),
+        status="pending",
+        result_file_id=None,
+        batch_id=None,
+        estimated_tokens=file.estimated_tokens,
+    )
+
+
+# Records state in the task store, which a cached run would skip
+@step(enable_cache=False)
+def upload_files_to_openai(
+    files: BatchFileList,
+    max_workers: int = 4,
+    max_retries: int = 5,
+    manifest_path: str = "./batches/upload_manifest.json",
+    num_shards: int = 1,
+    shard_index: int = 0,
+    task_store_path: str | None = "./batches/tasks.sqlite",
+) -> BatchFileTaskList:
+    """Upload batch files to OpenAI concurrently and resumably.
+
+    Files are uploaded by a bounded thread pool, transient API errors are
+    retried with exponential backoff. Every finished upload is recorded in a
+    local manifest keyed by the file's SHA-256 checksum, so on a rerun files
+    with unchanged content are skipped and their existing file ID is reused.
+    The tasks replace those of the shard in the task store, tasks of unchanged
+    files keep their recorded batch state, see ``TaskStore.replace_shard``.
+
+    Args:
+        files: Batch files to upload.
+        max_workers: Maximum number of concurrent uploads.
+        max_retries: Retries per file for transient errors.
+        manifest_path: Path of the upload manifest, the manifest of a shard is
+            kept in the shard's subdirectory of its parent directory.
+        num_shards: Number of shards the data is prepared in.
+        shard_index: Index of the uploaded shard.
+        task_store_path: Task store the tasks are written to, None to skip.
+
+    Returns:
+        BatchFileTaskList: One task per file, in the order of ``files``, carrying
+            the file's token estimate.
+    """
+    logger.info(f"Uploading {len(files.files)} files to OpenAI for batch processing")
+    # Sharded workers may share the batch path, every shard gets its own
+    # manifest so that no two workers rewrite the same file
+    manifest_file = Path(manifest_path)
+    manifest = UploadManifest(
+        shard_directory(manifest_file.parent, shard_index, num_shards)
+        / manifest_file.name
+    )
+    timer = StageTimer()
+
+    with (
+        timer.stage(
+            "upload",
+            rows=len(files.files),
+            bytes=sum(Path(file.path).stat().st_size for file in files.files),
+        ),
+        ThreadPoolExecutor(max_workers=max_workers) as executor,
+    ):
+        tasks = list(
+            executor.map(
+                lambda file: _upload_file(file, manifest, max_retries), files.files
+            )
         )
-        logger.info(f"File uploaded with ID: {task.file_id}")
-        tasks.append(task)
+    log_metadata(metadata=timer.metadata())
+
+    if task_store_path:
+        with TaskStore(task_store_path) as store:
+            store.replace_shard(shard_tag(shard_index, num_shards), tasks)
 
     return BatchFileTaskList(tasks=tasks)
@@ -0,0 +1,116 @@
+from itertools import groupby
+from time import perf_counter
+from zenml import log_metadata, step
+from zenml.logger import get_logger
+from datasets import DatasetDict, Image
+
+from utils.images import image_size, read_image_bytes
+from utils.instrumentation import peak_rss_bytes
+from utils.text_metrics import caption_metrics
+
+logger = get_logger(__name__)
+
+
+def _peak_memory_mb(device) -> float:
+    """Peak allocated GPU memory, or the peak RSS of the process on CPU."""
+    import torch
+
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    return peak_rss_bytes() / 2**20
+
+
+@step
+def evaluate_model(
+    data: DatasetDict,
+    model_name: str,
+    split: str = "test",
+    image_row: str = "image",
+    alt_text_row: str = "alt_text",
+    max_batch_size: int = 16,
+    max_new_tokens: int = 64,
+    max_characters: int = 150,
+    load_in_4bit: bool = False,
+    device: str | None = None,
+    limit: int | None = None,
+) -> dict[str, float]:
+    """Caption the held-out split and score the captions against the references.
+
+    Rows are sorted by image size and then by reference length before they
+    are batched, so every batch holds images with the same number of image
+    tokens, which share the cached prompt prefix of ``AltTextGenerator``, and
+    captions of similar expected length. Quality, see ``caption_metrics``,
+    is recorded together with throughput and peak memory as metadata.
+
+    Args:
+        data: Dataset with the evaluation split.
+        model_name: Merged model to evaluate, repository or local directory.
+        split: Split to evaluate on.
+        image_row: Image column.
+        alt_text_row: Reference alt text column.
+        max_batch_size: Maximum number of images per batch.
+        max_new_tokens: Maximum number of generated tokens per caption.
+        max_characters: Length limit of the length compliance rate.
+        load_in_4bit: Whether to evaluate the model quantized to 4 bit.
+        device: Device to run on, defaults to CUDA when available.
+        limit: Optional maximum number of rows to evaluate.
+
+    Returns:
+        dict[str, float]: Quality and throughput metrics.
+    """
+    import torch
+
+    from utils.inference import AltTextGenerator, load_model
+
+    rows = data[split].select_columns([image_row, alt_text_row])
+    if limit is not None:
+        rows = rows.select(range(min(limit, len(rows))))
+    rows = rows.cast_column(image_row, Image(decode=False))
+
+    images, references, sizes = [], [], []
+    for row in rows:
+        image = read_image_bytes(row[image_row])
+        if image is None:
+            continue
+        images.append(image)
+        references.append(row[alt_text_row])
+        sizes.append(image_size(image))
+
+    order = sorted(range(len(images)), key=lambda i: (sizes[i], len(references[i])))
+    batches = [
+        indices[start : start + max_batch_size]
+        for _, group in groupby(order, key=lambda i: sizes[i])
+        for indices in [list(group)]
+        for start in range(0, len(indices), max_batch_size)
+    ]
+
+    model, processor = load_model(model_name, device, load_in_4bit)
+    if model.device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(model.device)
+    generator = AltTextGenerator(model, processor, max_new_tokens=max_new_tokens)
+
+    predictions = [""] * len(images)
+    started = perf_counter()
+    for number, batch in enumerate(batches, start=1):
+        captions = generator([images[i] for i in batch])
+        for i, caption in zip(batch, captions):
+            predictions[i] = caption
+        logger.info(f"Evaluated batch {number} of {len(batches)}.")
+    elapsed = perf_counter() - started
+
+    metrics = caption_metrics(predictions, references, max_characters)
+    metrics.update(
+        {
+            "images": len(images),
+            "batches": len(batches),
+            "seconds": round(elapsed, 3),
+            "images_per_second": round(len(images) / elapsed, 2) if elapsed else 0,
+            "tokens_per_second": (
+                round(generator.generated_tokens / elapsed, 2) if elapsed else 0
+            ),
+            "peak_memory_mb": round(_peak_memory_mb(model.device), 1),
+        }
+    )
+    log_metadata(metadata={"evaluation": metrics})
+    logger.info(f"Evaluation of {model_name} on {split}: {metrics}")
+    return metrics
@@ -0,0 +1,117 @@
+import shutil
+from collections.abc import Iterator
+from pathlib import Path
+from time import perf_counter
+from zenml import log_metadata, step
+from zenml.logger import get_logger
+from datasets import Dataset, DatasetDict
+from transformers import AutoProcessor, ProcessorMixin
+
+from utils.feature_cache import (
+    feature_cache_key,
+    finalize_feature_cache,
+    is_feature_cache_complete,
+    write_feature_split,
+)
+from utils.instrumentation import StageTimer
+from utils.prompts import format_batch_for_training
+
+logger = get_logger(__name__)
+
+CACHED_SPLITS = ("train", "validation")
+
+
+def _iter_features(
+    processor: ProcessorMixin, dataset: Dataset, timer: StageTimer
+) -> Iterator[dict]:
+    samples = timer.timed(
+        "format_samples", dataset.with_transform(format_batch_for_training)
+    )
+    for sample in samples:
+        with timer.stage("tokenize", rows=1):
+            inputs = processor.apply_chat_template(
+                sample["messages"],
+                tokenize=True,
+                return_dict=True,
+                return_tensors="np",
+            )
+        yield {name: value[0] for name, value in inputs.items()}
+
+
+@step
+def preprocess_training_features(
+    data: DatasetDict,
+    model_name: str = "unsloth/gemma-3n-E4B-it",
+    cache_dir: str = "./cache/features",
+    pixel_dtype: str = "float16",
+    enabled: bool = True,
+) -> str | None:
+    """Tokenize and preprocess the training data once into a memory-mapped cache.
+
+    Chat templating, tokenization and image preprocessing are run once per
+    sample and the resulting token IDs and pixel values are stored as flat
+    binary files that ``FeatureCacheDataset`` memory maps. The cache lives in
+    a directory keyed by the model name, the processor configuration and the
+    fingerprints of the splits, so any change to one of them creates a new
+    cache while reruns with the same inputs reuse it.
+
+    Args:
+        data: Dataset with train and validation splits.
+        model_name: Model whose processor is used.
+        cache_dir: Root directory of the feature caches.
+        pixel_dtype: Storage dtype of the pixel values.
+        enabled: Whether to build the cache, training falls back to processing
+            samples on the fly when disabled.
+
+    Returns:
+        str | None: Directory of the feature cache, None when disabled.
+    """
+    if not enabled:
+        logger.info("Feature cache disabled, samples are processed during training.")
+        return None
+
+    processor = AutoProcessor.from_pretrained(model_name)
+    key = feature_cache_key(
+        model_name,
+        processor.to_json_string(),
+        [f"{split}:{data[split]._fingerprint}" for split in CACHED_SPLITS],
+    )
+    directory = Path(cache_dir) / key
+
+    if is_feature_cache_complete(directory):
+        logger.info(f"Feature cache hit: {directory}")
+        log_metadata(metadata={"feature_cache": {"hit": True, "key": key}})
+        return str(directory)
+
+    logger.info(f"Feature cache miss, preprocessing into {directory}")
+    tmp_directory = directory.with_name(f"{key}.tmp")
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    started = perf_counter()
+    timer = StageTimer()
+    sizes = {}
+
+    for split in CACHED_SPLITS:
+        # Formatting and tokenization are timed as nested stages
+        with timer.stage("write_features"):
+            sizes[split] = write_feature_split(
+                tmp_directory / split,
+                _iter_features(processor, data[split], timer),
+                dtypes={"pixel_values": pixel_dtype},
+            )
+        timer.add("write_features", rows=sizes[split])
+
+    finalize_feature_cache(tmp_directory, directory)
+    elapsed = perf_counter() - started
+    log_metadata(
+        metadata={
+            "feature_cache": {
+                "hit": False,
+                "key": key,
+                "samples": sizes,
+                "preprocess_seconds": round(elapsed, 3),
+            },
+            **timer.metadata(),
+        }
+    )
+    logger.info(f"Preprocessed {sizes} samples in {elapsed:.1f}s.")
+    return str(directory)
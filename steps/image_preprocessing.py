@@ -0,0 +1,109 @@
+import hashlib
+from pathlib import Path
+from zenml import log_metadata, step
+from zenml.logger import get_logger
+from datasets import Dataset
+
+from utils.images import downscale_image_bytes, read_image_bytes, total_image_bytes
+
+logger = get_logger(__name__)
+
+
+def _downscale_batch(
+    batch: dict, image_row: str, max_side: int, quality: int, cache_dir: str
+) -> dict:
+    images = []
+
+    for value in batch[image_row]:
+        data = read_image_bytes(value)
+
+        if data is None:
+            images.append(value)
+            continue
+
+        key = hashlib.sha256(data).hexdigest()
+        cache_path = Path(cache_dir) / f"{key}_{max_side}_q{quality}.bin"
+
+        if cache_path.exists():
+            resized = cache_path.read_bytes()
+        else:
+            try:
+                resized = downscale_image_bytes(data, max_side, quality)
+            except OSError:
+                images.append(value)
+                continue
+            if resized == data:
+                # Already fits, caching it would only duplicate the image
+                images.append(value)
+                continue
+            tmp_path = cache_path.with_suffix(".tmp")
+            tmp_path.write_bytes(resized)
+            tmp_path.replace(cache_path)
+
+        images.append({"bytes": resized, "path": None})
+
+    return {image_row: images}
+
+
+@step
+def downscale_images(
+    data: Dataset,
+    image_row: str = "image",
+    max_side: int | None = None,
+    quality: int = 85,
+    cache_dir: str = "./cache/images",
+    num_proc: int | None = None,
+) -> Dataset:
+    """Downscale oversized images before batch requests are generated.
+
+    Images whose longest side exceeds ``max_side`` are resized and re-encoded
+    at ``quality``. Resized images are cached on disk keyed by the SHA-256 of
+    the original bytes and the resize settings, so reruns only read the
+    cache. Images that already fit are kept as they are and not cached.
+    The step is a no-op when ``max_side`` is not set.
+
+    Args:
+        data: Dataset with an undecoded image column.
+        image_row: Name of the column containing image data. Defaults to "image".
+        max_side: Maximum width and height in pixels, None disables the step.
+        quality: JPEG/WEBP encoder quality between 1 and 100.
+        cache_dir: Directory for the downscaled image cache.
+        num_proc: Number of processes used by ``Dataset.map``.
+
+    Returns:
+        Dataset: The dataset with downscaled images.
+    """
+    if max_side is None:
+        logger.info("No max_side configured, skipping image downscaling.")
+        return data
+
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    bytes_before = total_image_bytes(data.with_format("arrow")[image_row])
+
+    data = data.map(
+        _downscale_batch,
+        batched=True,
+        fn_kwargs={
+            "image_row": image_row,
+            "max_side": max_side,
+            "quality": quality,
+            "cache_dir": cache_dir,
+        },
+        num_proc=num_proc,
+        desc="Downscaling images",
+    )
+
+    bytes_after = total_image_bytes(data.with_format("arrow")[image_row])
+    saved = 1 - bytes_after / bytes_before if bytes_before else 0.0
+    log_metadata(
+        metadata={
+            "image_bytes_before": bytes_before,
+            "image_bytes_after": bytes_after,
+            "image_bytes_saved_ratio": round(saved, 4),
+        }
+    )
+    logger.info(
+        f"Downscaled images to at most {max_side}px: {bytes_before} bytes -> "
+        f"{bytes_after} bytes ({saved:.1%} saved)."
+    )
+    return data
@@ -0,0 +1,127 @@
+from collections.abc import Iterator
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+from zenml import log_metadata, step
+from zenml.logger import get_logger
+from datasets import Image, load_dataset
+
+from utils.images import image_size, read_image_bytes
+from utils.inference import (
+    AltTextGenerator,
+    CaptionRequest,
+    CaptionWriter,
+    bucketed_batches,
+    load_model,
+)
+
+logger = get_logger(__name__)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+
+def _iter_images(source: str, image_row: str, split: str) -> Iterator[tuple]:
+    directory = Path(source)
+    if directory.is_dir():
+        for path in sorted(directory.rglob("*")):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                yield path.relative_to(directory).as_posix(), path.read_bytes()
+        return
+
+    data = load_dataset(source, split=split).select_columns([image_row])
+    data = data.cast_column(image_row, Image(decode=False))
+    for index, row in enumerate(data):
+        yield str(index), read_image_bytes(row[image_row])
+
+
+def _iter_requests(
+    source: str, image_row: str, split: str, limit: int | None
+) -> Iterator[CaptionRequest]:
+    for id_, image in islice(_iter_images(source, image_row, split), limit):
+        if image is None:
+            logger.warning(f"Skipping {id_}: no image data.")
+            continue
+        try:
+            size = image_size(image)
+        except OSError as e:
+            logger.warning(f"Skipping {id_}: unreadable image ({e}).")
+            continue
+        yield CaptionRequest(id_, image, size)
+
+
+@step
+def generate_alt_text_locally(
+    source: str,
+    model_name: str = "scheidti/gemma-3n-E4B-it-alt-text-merged-16bit",
+    image_row: str = "image",
+    split: str = "test",
+    output_path: str = "./outputs/alt_text.jsonl",
+    max_batch_size: int = 16,
+    max_wait_seconds: float = 0.5,
+    max_new_tokens: int = 64,
+    reuse_prompt_cache: bool = True,
+    device: str | None = None,
+    limit: int | None = None,
+) -> str:
+    """Caption the images of a dataset or directory with the fine-tuned model.
+
+    The merged model is loaded once. Images are read in the background and
+    dynamically batched by image size, so the rows of a batch have the same
+    number of image tokens and share the cached prompt prefix, see
+    ``AltTextGenerator``. Captions are streamed to ``output_path`` as they are
+    generated.
+
+    Args:
+        source: Local image directory or Hugging Face dataset name.
+        model_name: Merged model to load.
+        image_row: Image column of a dataset source.
+        split: Split of a dataset source.
+        output_path: Output file, ``.jsonl`` or ``.parquet``.
+        max_batch_size: Maximum number of images per batch.
+        max_wait_seconds: Maximum time an image waits for its batch to fill.
+        max_new_tokens: Maximum number of generated tokens per caption.
+        reuse_prompt_cache: Whether to reuse the key/value cache of the shared
+            prompt prefix.
+        device: Device to run on, defaults to CUDA when available.
+        limit: Optional maximum number of images to caption.
+
+    Returns:
+        str: Path of the written captions.
+    """
+    model, processor = load_model(model_name, device)
+    generator = AltTextGenerator(
+        model,
+        processor,
+        max_new_tokens=max_new_tokens,
+        reuse_prompt_cache=reuse_prompt_cache,
+    )
+
+    started = perf_counter()
+    batches = 0
+
+    with CaptionWriter(output_path) as writer:
+        for batch in bucketed_batches(
+            _iter_requests(source, image_row, split, limit),
+            key=lambda request: request.size,
+            max_batch_size=max_batch_size,
+            max_wait_seconds=max_wait_seconds,
+        ):
+            captions = generator([request.image for request in batch])
+            writer.write([request.id for request in batch], captions)
+            batches += 1
+            logger.info(f"Captioned {writer.rows} images in {batches} batches.")
+
+    elapsed = perf_counter() - started
+    log_metadata(
+        metadata={
+            "inference": {
+                "images": writer.rows,
+                "batches": batches,
+                "prompt_cache_batches": generator.cached_batches,
+                "seconds": round(elapsed, 3),
+                "images_per_second": round(writer.rows / elapsed, 2) if elapsed else 0,
+            }
+        }
+    )
+    logger.info(f"Wrote {writer.rows} captions to {output_path} in {elapsed:.1f}s.")
+    return output_path
@@ -1,25 +1,80 @@
-import torch
-import torch._dynamo as dynamo
+from pathlib import Path
+import numpy as np
 from zenml import step
 from zenml.logger import get_logger
 from datasets import DatasetDict
-from unsloth import FastVisionModel
-from unsloth.trainer import UnslothVisionDataCollator
-from trl import SFTTrainer, SFTConfig
-
-from utils.prompts import format_data_for_training
 
 logger = get_logger(__name__)
-dynamo.config.cache_size_limit = 2048
 
 
 @step
 def train_model(
     data: DatasetDict,
+    features: str | None = None,
     model_name: str = "unsloth/gemma-3n-E4B-it",
     hf_repo_id: str = "scheidti/gemma-3n-E4B-it-alt-text-lora",
     hf_merged_repo_id: str = "scheidti/gemma-3n-E4B-it-alt-text-merged-16bit",
-):
+    batching: str = "default",
+    max_tokens_per_batch: int = 8192,
+    max_batch_size: int | None = None,
+    packing: bool = False,
+    max_seq_length: int = 2048,
+) -> str:
+    """Fine-tune the model with LoRA and push the adapter and merged model.
+
+    With ``batching="length_grouped"`` samples of similar token length are
+    grouped into micro-batches of at most ``max_tokens_per_batch`` padded
+    tokens instead of training on one sample per step. With ``packing``
+    several short samples are concatenated into sequences of at most
+    ``max_seq_length`` tokens, with attention masked per sample. Both need the
+    token lengths of the feature cache and are disabled without one. Samples
+    of the feature cache longer than ``max_seq_length`` are dropped.
+
+    Args:
+        data: Dataset with train and validation splits.
+        features: Directory of the preprocessed feature cache, if any.
+        model_name: Base model to fine-tune.
+        hf_repo_id: Repository of the LoRA adapter.
+        hf_merged_repo_id: Repository of the merged 16-bit model.
+        batching: "default" for one sample per step, "length_grouped" for
+            token-budget batches of similar length.
+        max_tokens_per_batch: Padded token budget of a length-grouped batch.
+        max_batch_size: Optional cap on the samples of a length-grouped batch.
+        packing: Whether to pack several samples into one sequence.
+        max_seq_length: Maximum sequence length, also the length of a pack.
+
+    Returns:
+        str: Repository of the merged model.
+    """
+    # Imported on use so that other pipelines start without loading torch and
+    # unsloth, which has to be imported before trl to patch it.
+    import torch._dynamo as dynamo
+    from unsloth import FastVisionModel
+    from unsloth.trainer import UnslothVisionDataCollator
+    from trl import SFTTrainer, SFTConfig
+
+    from utils.feature_cache import FeatureCacheCollator, FeatureCacheDataset
+    from utils.length_batching import (
+        PackedDataset,
+        TokenBudgetBatchSampler,
+        drop_long_samples,
+        pack_sequences,
+    )
+    from utils.prompts import format_batch_for_training
+    from utils.trainers import BatchSamplerSFTTrainer
+
+    dynamo.config.cache_size_limit = 2048
+
+    if batching not in ("default", "length_grouped"):
+        raise ValueError(f"Unknown batching mode: {batching}")
+
+    if features is None and (batching != "default" or packing):
+        logger.warning(
+            "Length-grouped batching and packing need the feature cache, "
+            "falling back to one sample per step."
+        )
+        batching, packing = "default", False
+
     train = data["train"]
     validation = data["validation"]
 
@@ -47,17 +102,66 @@ def train_model(
         ],
     )
 
-    converted_train = [format_data_for_training(sample) for sample in train]
-    converted_validation = [format_data_for_training(sample) for sample in validation]
+    if features is not None:
+        logger.info(f"Training on preprocessed features from {features}.")
+        train_dataset = FeatureCacheDataset(Path(features) / "train")
+        eval_dataset = FeatureCacheDataset(Path(features) / "validation")
+        lengths = train_dataset.sequence_lengths()
+        train_dataset, kept = drop_long_samples(
+            train_dataset, lengths, max_seq_length
+        )
+        if len(kept) < len(lengths):
+            logger.warning(
+                f"Dropped {len(lengths) - len(kept)} training samples longer "
+                f"than {max_seq_length} tokens."
+            )
+        lengths = kept
+
+        if packing:
+            packs = pack_sequences(lengths, max_seq_length)
+            logger.info(f"Packed {len(lengths)} samples into {len(packs)} sequences.")
+            lengths = np.array([lengths[pack].sum() for pack in packs])
+            train_dataset = PackedDataset(train_dataset, packs)
+
+        data_collator = FeatureCacheCollator(
+            pad_token_id=processor.tokenizer.pad_token_id,
+            ignore_token_ids=[
+                token_id
+                for token_id in [getattr(processor, "image_token_id", None)]
+                if token_id is not None
+            ],
+            dtype=model.dtype,
+        )
+    else:
+        # Conversations are built lazily per batch, images are only decoded
+        # when the data collator requests the rows.
+        train_dataset = train.with_transform(format_batch_for_training)
+        eval_dataset = validation.with_transform(format_batch_for_training)
+        data_collator = UnslothVisionDataCollator(model, processor)
 
     FastVisionModel.for_training(model)
 
-    trainer = SFTTrainer(
+    trainer_kwargs = {}
+    trainer_class = SFTTrainer
+    if batching == "length_grouped":
+        trainer_class = BatchSamplerSFTTrainer
+        trainer_kwargs["train_batch_sampler"] = TokenBudgetBatchSampler(
+            lengths,
+            max_tokens=max_tokens_per_batch,
+            max_batch_size=max_batch_size,
+            seed=3407,
+        )
+        logger.info(
+            f"Grouped {len(train_dataset)} training items into "
+            f"{len(trainer_kwargs['train_batch_sampler'])} length-grouped batches."
+        )
+
+    trainer = trainer_class(
         model=model,
-        train_dataset=converted_train,
-        eval_dataset=converted_validation,
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
         processing_class=processor.tokenizer,
-        data_collator=UnslothVisionDataCollator(model, processor),
+        data_collator=data_collator,
         args=SFTConfig(
             per_device_train_batch_size=1,
             gradient_accumulation_steps=4,
@@ -78,8 +182,9 @@ def train_model(
             remove_unused_columns=False,
             dataset_text_field="",
             dataset_kwargs={"skip_prepare_dataset": True},
-            max_seq_length=2048,
+            max_seq_length=max_seq_length,
         ),
+        **trainer_kwargs,
     )
 
     trainer_stats = trainer.train()
@@ -88,3 +193,4 @@ def train_model(
     processor.push_to_hub(hf_repo_id)
     model.push_to_hub_merged(hf_merged_repo_id, processor, save_method="merged_16bit")
     logger.info("Model and processor pushed to Hugging Face Hub.")
+    return hf_merged_repo_id
@@ -0,0 +1,113 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.stub_openai import StubOpenAI  # noqa: E402
+from utils.clients import get_openai_client  # noqa: E402
+
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    """Local OpenAI stub that all OpenAI clients created in the test talk to."""
+    with StubOpenAI() as stub:
+        monkeypatch.setenv("OPENAI_BASE_URL", stub.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        get_openai_client.cache_clear()
+        yield stub
+    get_openai_client.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def tiny_vlm_path(tmp_path_factory) -> Path:
+    """Directory of a tiny randomly initialized Llava model and its processor.
+
+    The word-level tokenizer knows a handful of words, every other word of the
+    prompt is encoded as the unknown token.
+    """
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import (
+        CLIPImageProcessor,
+        CLIPVisionConfig,
+        LlamaConfig,
+        LlavaConfig,
+        LlavaForConditionalGeneration,
+        LlavaProcessor,
+        PreTrainedTokenizerFast,
+    )
+
+    words = "system user assistant : image alt text the a of".split()
+    special = ["[UNK]", "<pad>", "</s>", "<image>", "<s>"]
+    vocab = {token: i for i, token in enumerate(special + words)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        unk_token="[UNK]",
+        pad_token="<pad>",
+        eos_token="</s>",
+        bos_token="<s>",
+        model_input_names=["input_ids", "attention_mask"],
+    )
+    tokenizer.add_special_tokens({"additional_special_tokens": ["<image>"]})
+    chat_template = (
+        "{% for m in messages %}{{ m['role'] }} : "
+        "{% for c in m['content'] %}{% if c['type'] == 'text' %}{{ c['text'] }} "
+        "{% else %}<image> {% endif %}{% endfor %}</s> {% endfor %}"
+        "{% if add_generation_prompt %}assistant : {% endif %}"
+    )
+    processor = LlavaProcessor(
+        image_processor=CLIPImageProcessor(
+            size={"shortest_edge": 28}, crop_size={"height": 28, "width": 28}
+        ),
+        tokenizer=tokenizer,
+        patch_size=14,
+        vision_feature_select_strategy="default",
+        chat_template=chat_template,
+        num_additional_image_tokens=1,
+    )
+    config = LlavaConfig(
+        vision_config=CLIPVisionConfig(
+            hidden_size=16,
+            intermediate_size=32,
+            num_hidden_layers=1,
+            num_attention_heads=2,
+            image_size=28,
+            patch_size=14,
+        ),
+        text_config=LlamaConfig(
+            vocab_size=len(vocab),
+            hidden_size=32,
+            intermediate_size=64,
+            num_hidden_layers=2,
+            num_attention_heads=4,
+            num_key_value_heads=2,
+            pad_token_id=vocab["<pad>"],
+            eos_token_id=vocab["</s>"],
+            bos_token_id=vocab["<s>"],
+            # Large weights make the outputs depend strongly on every input
+            initializer_range=0.5,
+        ),
+        image_token_index=vocab["<image>"],
+    )
+    torch.manual_seed(0)
+    model = LlavaForConditionalGeneration(config)
+    model.generation_config.eos_token_id = vocab["</s>"]
+    model.generation_config.pad_token_id = vocab["<pad>"]
+
+    path = tmp_path_factory.mktemp("tiny_vlm")
+    model.save_pretrained(path)
+    processor.save_pretrained(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def noise_images() -> list[bytes]:
+    """Four PNG noise images of the same size."""
+    from benchmarks.synthetic import synthetic_images
+
+    return synthetic_images(4, size=40, image_format="PNG")
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from openai import AsyncOpenAI
+
+from utils.batch_poller import BatchPoller
+from utils.pydantic_models import BatchFileTask
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("utils.retry.backoff_delay", lambda *args: 0.0)
+
+
+def _tasks(stub, count: int) -> list[BatchFileTask]:
+    tasks = []
+    for number in range(count):
+        file = stub._store_file(
+            b'{"custom_id": "img_a"}\n', f"batch_{number}.jsonl", "batch"
+        )
+        tasks.append(
+            BatchFileTask(file_id=file["id"], path=file["filename"], status="pending")
+        )
+    return tasks
+
+
+async def _poll(tasks: list[BatchFileTask], **kwargs) -> None:
+    # SDK retries are off, transient errors reach our own retries
+    async with AsyncOpenAI(max_retries=0) as client:
+        poller = BatchPoller(client, min_wait=0.01, max_wait=0.01, **kwargs)
+        await poller.run(tasks)
+
+
+def test_transient_submit_errors_are_retried(openai_stub):
+    tasks = _tasks(openai_stub, 2)
+    openai_stub.failures["POST /v1/batches"] = 2
+
+    asyncio.run(_poll(tasks, list_batches=False))
+
+    assert openai_stub.calls["POST /v1/batches"] == 4
+    assert [task.status for task in tasks] == ["completed"] * 2
+    assert len({task.batch_id for task in tasks}) == 2
@@ -0,0 +1,159 @@
+import json
+
+import pytest
+
+import steps.batch_tasks as batch_tasks
+import steps.data_uploader as data_uploader
+from utils.batch_poller import BatchPoller
+from utils.batch_retries import successful_custom_ids
+from utils.pydantic_models import BatchFile, BatchFileList
+
+UPLOAD = "POST /v1/files"
+SUBMIT = "POST /v1/batches"
+DOWNLOAD = "GET /v1/files/{id}/content"
+
+
+@pytest.fixture(autouse=True)
+def no_metadata(monkeypatch):
+    for module in (batch_tasks, data_uploader):
+        monkeypatch.setattr(module, "log_metadata", lambda **kwargs: None)
+    monkeypatch.setattr("utils.retry.backoff_delay", lambda *args: 0.0)
+
+
+@pytest.fixture
+def batch_files(tmp_path) -> BatchFileList:
+    files = []
+    for number in range(2):
+        path = tmp_path / f"batch_{number}.jsonl"
+        with open(path, "w") as f:
+            for request in range(3):
+                line = {
+                    "custom_id": f"img_{number}_{request}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": "stub", "messages": []},
+                }
+                f.write(json.dumps(line) + "\n")
+        files.append(BatchFile(path=str(path), requests=3, estimated_tokens=30))
+    return BatchFileList(files=files)
+
+
+def _prepare(files: BatchFileList, tmp_path, store: bool = True):
+    return data_uploader.upload_files_to_openai.entrypoint(
+        files,
+        manifest_path=str(tmp_path / "upload_manifest.json"),
+        task_store_path=str(tmp_path / "tasks.sqlite") if store else None,
+    )
+
+
+def _wait(tasks, tmp_path, store: bool = True, **kwargs):
+    return batch_tasks.wait_and_update_batch.entrypoint(
+        tasks,
+        wait_seconds=0.01,
+        min_wait_seconds=0.01,
+        path=str(tmp_path),
+        task_store_path=str(tmp_path / "tasks.sqlite") if store else None,
+        **kwargs,
+    )
+
+
+def _process(tmp_path, **kwargs):
+    store = str(tmp_path / "tasks.sqlite")
+    tasks = batch_tasks.load_batch_task_list.entrypoint(task_store_path=store)
+    return _wait(tasks, tmp_path, **kwargs)
+
+
+def test_preparing_the_data_again_keeps_submitted_batches(
+    openai_stub, batch_files, tmp_path
+):
+    _prepare(batch_files, tmp_path)
+    first = _process(tmp_path)
+
+    _prepare(batch_files, tmp_path)
+    second = _process(tmp_path)
+
+    assert openai_stub.calls["POST /v1/files"] == 2
+    assert openai_stub.calls[SUBMIT] == 2
+    assert second.tasks == first.tasks
+    assert all(task.status == "completed" for task in second.tasks)
+
+
+def test_failed_batches_are_retried_as_new_files(openai_stub, batch_files, tmp_path):
+    openai_stub.failed_batches = 2
+    _prepare(BatchFileList(files=batch_files.files[:1]), tmp_path)
+
+    tasks = _process(tmp_path, max_batch_retries=2).tasks
+
+    assert [task.status for task in tasks] == ["failed", "failed", "completed"]
+    assert [task.attempt for task in tasks] == [0, 1, 2]
+    assert [task.retry_of for task in tasks[1:]] == [
+        tasks[0].file_id,
+        tasks[1].file_id,
+    ]
+    assert len({task.file_id for task in tasks}) == 3
+    assert len({task.batch_id for task in tasks}) == 3
+    assert successful_custom_ids(task.result_path for task in tasks) == {
+        f"img_0_{request}" for request in range(3)
+    }
+    assert (openai_stub.calls[UPLOAD], openai_stub.calls[SUBMIT]) == (3, 3)
+
+    # A rerun resumes from the task store and reuses the recorded retries
+    again = _process(tmp_path, max_batch_retries=2).tasks
+
+    assert again == tasks
+    assert (openai_stub.calls[UPLOAD], openai_stub.calls[SUBMIT]) == (3, 3)
+
+
+def test_failed_batches_are_retried_without_a_task_store(
+    openai_stub, batch_files, tmp_path
+):
+    openai_stub.failed_batches = 1
+    uploaded = _prepare(BatchFileList(files=batch_files.files[:1]), tmp_path, False)
+
+    tasks = _wait(uploaded, tmp_path, store=False, max_batch_retries=1).tasks
+
+    assert [task.status for task in tasks] == ["failed", "completed"]
+    assert tasks[1].file_id != tasks[0].file_id
+    assert openai_stub.calls[SUBMIT] == 2
+
+
+@pytest.mark.parametrize(
+    ("token_budget", "in_flight"), [(30, [30, 30]), (None, [30, 60])]
+)
+def test_token_budget_limits_the_tokens_in_flight(
+    monkeypatch, openai_stub, batch_files, tmp_path, token_budget, in_flight
+):
+    submitted = []
+    submit = BatchPoller._submit
+
+    async def record_submit(poller, task):
+        submitted.append(poller._in_flight_tokens)
+        await submit(poller, task)
+
+    monkeypatch.setattr(BatchPoller, "_submit", record_submit)
+    _prepare(batch_files, tmp_path)
+
+    tasks = _process(tmp_path, token_budget=token_budget).tasks
+
+    assert submitted == in_flight
+    assert all(task.status == "completed" for task in tasks)
+
+
+@pytest.mark.parametrize("download_results", [True, False])
+def test_results_are_downloaded_while_waiting(
+    openai_stub, batch_files, tmp_path, download_results
+):
+    _prepare(batch_files, tmp_path)
+
+    tasks = _process(tmp_path, download_results=download_results)
+    downloaded_while_waiting = openai_stub.calls[DOWNLOAD]
+    result_files = batch_tasks.download_batch_results.entrypoint(
+        tasks, path=str(tmp_path), task_store_path=str(tmp_path / "tasks.sqlite")
+    )
+
+    assert downloaded_while_waiting == (2 if download_results else 0)
+    assert openai_stub.calls[DOWNLOAD] == 2
+    assert sorted(result_files) == sorted(
+        tmp_path / f"{task.file_id}_result.jsonl" for task in tasks.tasks
+    )
+    assert len(successful_custom_ids(map(str, result_files))) == 6
@@ -0,0 +1,105 @@
+import json
+
+import openai
+import pytest
+
+import steps.data_uploader as data_uploader
+from utils.pydantic_models import BatchFile, BatchFileList
+from utils.task_store import TaskStore
+
+UPLOAD = "POST /v1/files"
+
+
+@pytest.fixture(autouse=True)
+def no_sdk_retries(monkeypatch):
+    """Leave retries to ``retry_with_backoff`` and skip its delays."""
+    monkeypatch.setattr(
+        data_uploader,
+        "get_openai_client",
+        lambda: openai.OpenAI(max_retries=0),
+    )
+    monkeypatch.setattr("utils.retry.backoff_delay", lambda *args: 0.0)
+    monkeypatch.setattr(data_uploader, "log_metadata", lambda **kwargs: None)
+
+
+@pytest.fixture
+def batch_files(tmp_path) -> BatchFileList:
+    files = []
+    for number in range(3):
+        path = tmp_path / f"batch_{number}.jsonl"
+        path.write_text(json.dumps({"custom_id": f"img_{number}"}) + "\n")
+        files.append(BatchFile(path=str(path), requests=1, estimated_tokens=10))
+    return BatchFileList(files=files)
+
+
+def _upload(files: BatchFileList, tmp_path, **kwargs):
+    return data_uploader.upload_files_to_openai.entrypoint(
+        files,
+        max_workers=2,
+        manifest_path=str(tmp_path / "upload_manifest.json"),
+        task_store_path=str(tmp_path / "tasks.sqlite"),
+        **kwargs,
+    )
+
+
+def test_transient_upload_errors_are_retried(openai_stub, batch_files, tmp_path):
+    openai_stub.failures[UPLOAD] = 2
+
+    tasks = _upload(batch_files, tmp_path, max_retries=2)
+
+    assert openai_stub.calls[UPLOAD] == 5
+    assert [task.path for task in tasks.tasks] == [
+        file.path for file in batch_files.files
+    ]
+    assert len({task.file_id for task in tasks.tasks}) == 3
+    assert all(task.estimated_tokens == 10 for task in tasks.tasks)
+    with TaskStore(tmp_path / "tasks.sqlite") as store:
+        assert store.tasks(["shard-00000-of-00001"]) == tasks.tasks
+
+
+def test_upload_fails_once_retries_are_exhausted(openai_stub, batch_files, tmp_path):
+    openai_stub.failures[UPLOAD] = 2
+
+    with pytest.raises(openai.InternalServerError):
+        _upload(BatchFileList(files=batch_files.files[:1]), tmp_path, max_retries=1)
+
+    assert openai_stub.calls[UPLOAD] == 2
+
+
+def test_rerun_reuses_the_file_ids_of_the_manifest(
+    openai_stub, batch_files, tmp_path
+):
+    first = _upload(batch_files, tmp_path)
+    changed = batch_files.files[1].path
+    with open(changed, "a") as f:
+        f.write(json.dumps({"custom_id": "img_changed"}) + "\n")
+
+    second = _upload(batch_files, tmp_path)
+
+    assert openai_stub.calls[UPLOAD] == 4
+    for before, after in zip(first.tasks, second.tasks):
+        if before.path == changed:
+            assert after.file_id != before.file_id
+        else:
+            assert after.file_id == before.file_id
+    manifest = json.loads((tmp_path / "upload_manifest.json").read_text())
+    assert {entry["file_id"] for entry in manifest.values()} == {
+        task.file_id for task in first.tasks + second.tasks
+    }
+
+
+def test_every_shard_keeps_its_own_manifest(openai_stub, batch_files, tmp_path):
+    for shard_index in range(2):
+        files = BatchFileList(files=batch_files.files[shard_index::2])
+        _upload(files, tmp_path, num_shards=2, shard_index=shard_index)
+
+    manifests = sorted(tmp_path.glob("shard-*/upload_manifest.json"))
+    entries = [json.loads(path.read_text()) for path in manifests]
+
+    assert [path.parent.name for path in manifests] == [
+        "shard-00000-of-00002",
+        "shard-00001-of-00002",
+    ]
+    assert [len(manifest) for manifest in entries] == [2, 1]
+    assert not (tmp_path / "upload_manifest.json").exists()
+    assert not list(tmp_path.rglob("*.tmp"))
@@ -0,0 +1,66 @@
+import pytest
+from datasets import Dataset, DatasetDict, Features, Image, Value
+
+import steps.evaluation_tasks as evaluation_tasks
+from benchmarks.synthetic import synthetic_images
+from utils.inference import AltTextGenerator, load_model
+from utils.text_metrics import caption_metrics
+
+REFERENCES = [
+    "a text of the image",
+    "alt text",
+    "the image",
+    "a a a",
+    "image of the text",
+    "text",
+]
+
+
+@pytest.fixture
+def images(noise_images) -> list[bytes]:
+    """Four images of one size and two of another."""
+    return noise_images + synthetic_images(2, size=56, image_format="PNG", seed=1)
+
+
+@pytest.fixture
+def data(images) -> DatasetDict:
+    test = Dataset.from_dict(
+        {
+            "image": [{"bytes": image, "path": None} for image in images] + [None],
+            "alt_text": REFERENCES + ["no image"],
+        },
+        features=Features({"image": Image(decode=False), "alt_text": Value("string")}),
+    )
+    return DatasetDict({"test": test})
+
+
+def test_evaluate_model_scores_the_generated_captions(
+    monkeypatch, tiny_vlm_path, images, data
+):
+    logged = {}
+    monkeypatch.setattr(
+        evaluation_tasks, "log_metadata", lambda metadata: logged.update(metadata)
+    )
+
+    metrics = evaluation_tasks.evaluate_model.entrypoint(
+        data,
+        model_name=str(tiny_vlm_path),
+        max_batch_size=3,
+        max_new_tokens=8,
+        device="cpu",
+    )
+
+    # Captions do not depend on the batch, so they can be generated one by one
+    model, processor = load_model(str(tiny_vlm_path), device="cpu")
+    generator = AltTextGenerator(model, processor, max_new_tokens=8)
+    predictions = [generator([image])[0] for image in images]
+    expected = caption_metrics(predictions, REFERENCES)
+
+    assert logged == {"evaluation": metrics}
+    assert {name: metrics[name] for name in expected} == expected
+    # The row without an image is skipped, the four images of the same size
+    # take two batches of at most three
+    assert metrics["images"] == 6
+    assert metrics["batches"] == 3
+    assert metrics["tokens_per_second"] > 0
+    assert metrics["peak_memory_mb"] > 0
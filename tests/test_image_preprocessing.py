@@ -0,0 +1,67 @@
+import io
+
+import pytest
+from datasets import Dataset, Features, Image, Value
+from PIL import Image as PILImage
+
+import steps.image_preprocessing as image_preprocessing
+from benchmarks.synthetic import synthetic_images
+from utils.images import total_image_bytes
+
+
+@pytest.fixture
+def logged(monkeypatch) -> dict:
+    logged = {}
+    monkeypatch.setattr(
+        image_preprocessing, "log_metadata", lambda metadata: logged.update(metadata)
+    )
+    return logged
+
+
+@pytest.fixture
+def data(tmp_path) -> Dataset:
+    """A large and a small image stored as bytes and the same as local files."""
+    images = synthetic_images(1, size=64) + synthetic_images(1, size=16, seed=1)
+    paths = []
+    for number, image in enumerate(images):
+        path = tmp_path / f"image_{number}.jpg"
+        path.write_bytes(image)
+        paths.append(str(path))
+
+    return Dataset.from_dict(
+        {
+            "image": [{"bytes": image, "path": None} for image in images]
+            + [{"bytes": None, "path": path} for path in paths],
+            "id": ["large", "small", "large_file", "small_file"],
+        },
+        features=Features({"image": Image(decode=False), "id": Value("string")}),
+    )
+
+
+def test_total_image_bytes_counts_path_only_images(data):
+    stored = sum(len(image["bytes"]) for image in data["image"][:2])
+
+    # The files hold the same images as the stored bytes
+    assert total_image_bytes(data.with_format("arrow")["image"]) == 2 * stored
+
+
+def test_only_resized_images_are_cached(tmp_path, logged, data):
+    cache_dir = tmp_path / "cache"
+
+    result = image_preprocessing.downscale_images.entrypoint(
+        data, max_side=32, cache_dir=str(cache_dir)
+    )
+
+    images = result["image"]
+    for resized in (images[0], images[2]):
+        assert PILImage.open(io.BytesIO(resized["bytes"])).size == (32, 32)
+    assert images[1] == data["image"][1]
+    assert images[3] == data["image"][3]
+    # One cache entry for the large image, stored as bytes and as a file
+    assert len(list(cache_dir.iterdir())) == 1
+
+    before = total_image_bytes(data.with_format("arrow")["image"])
+    after = total_image_bytes(result.with_format("arrow")["image"])
+    assert logged["image_bytes_before"] == before
+    assert logged["image_bytes_after"] == after
+    assert logged["image_bytes_saved_ratio"] == round(1 - after / before, 4)
@@ -0,0 +1,45 @@
+import pytest
+
+from utils.inference import AltTextGenerator, load_model
+
+
+@pytest.fixture(scope="module")
+def tiny_vlm(tiny_vlm_path):
+    return load_model(str(tiny_vlm_path), device="cpu")
+
+
+def _captions(tiny_vlm, images: list[bytes], reuse_prompt_cache: bool):
+    model, processor = tiny_vlm
+    generator = AltTextGenerator(
+        model, processor, max_new_tokens=8, reuse_prompt_cache=reuse_prompt_cache
+    )
+    return generator(images), generator
+
+
+def test_prompt_cache_generates_the_same_captions_as_generate(
+    tiny_vlm, noise_images
+):
+    cached, cached_generator = _captions(tiny_vlm, noise_images, True)
+    plain, plain_generator = _captions(tiny_vlm, noise_images, False)
+
+    assert cached_generator.cached_batches == 1
+    assert plain_generator.cached_batches == 0
+    assert cached == plain
+    assert cached_generator.generated_tokens == plain_generator.generated_tokens
+    assert cached_generator.generated_tokens > 0
+
+
+def test_prompt_cache_is_shared_by_batches_of_the_same_prefix(
+    tiny_vlm, noise_images
+):
+    model, processor = tiny_vlm
+    generator = AltTextGenerator(model, processor, max_new_tokens=8)
+
+    first = generator(noise_images[:2])
+    second = generator(noise_images[2:4])
+    together = generator(noise_images)
+
+    assert generator.cached_batches == 3
+    assert len(generator._prompt_caches) == 1
+    assert first + second == together
+
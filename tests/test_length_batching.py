@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from utils.feature_cache import FeatureCacheCollator
+from utils.length_batching import PackedDataset, drop_long_samples, pack_sequences
+
+PAD_TOKEN_ID = 0
+
+
+def _sample(length: int, rng: np.random.Generator) -> dict[str, np.ndarray]:
+    return {
+        "input_ids": rng.integers(1, 32, length),
+        "attention_mask": np.ones(length, dtype=np.int64),
+    }
+
+
+@pytest.fixture(scope="module")
+def tiny_model() -> LlamaForCausalLM:
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=32,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def test_drop_long_samples_keeps_samples_within_the_limit():
+    dataset = [10, 11, 12, 13]
+    lengths = np.array([3, 9, 5, 6])
+
+    kept, kept_lengths = drop_long_samples(dataset, lengths, max_length=5)
+
+    assert [kept[i] for i in range(len(kept))] == [10, 12]
+    assert kept_lengths.tolist() == [3, 5]
+    packs = pack_sequences(kept_lengths, max_length=5)
+    assert all(kept_lengths[pack].sum() <= 5 for pack in packs)
+
+
+def test_drop_long_samples_returns_the_dataset_unchanged_without_long_samples():
+    dataset = [10, 11]
+    lengths = np.array([3, 5])
+
+    kept, kept_lengths = drop_long_samples(dataset, lengths, max_length=5)
+
+    assert kept is dataset
+    assert kept_lengths is lengths
+
+
+def test_pack_sequences_fills_packs_up_to_the_maximum_length():
+    lengths = np.array([5, 3, 4, 2, 6, 1])
+
+    packs = pack_sequences(lengths, max_length=8)
+
+    assert sorted(i for pack in packs for i in pack) == list(range(len(lengths)))
+    assert all(lengths[pack].sum() <= 8 for pack in packs)
+    assert len(packs) == 3
+
+
+@pytest.mark.parametrize("attn_implementation", ["eager", "sdpa"])
+def test_packed_loss_matches_the_loss_of_separate_samples(
+    tiny_model, attn_implementation
+):
+    tiny_model.config._attn_implementation = attn_implementation
+    rng = np.random.default_rng(0)
+    samples = [_sample(length, rng) for length in (5, 3, 7, 4)]
+    collator = FeatureCacheCollator(PAD_TOKEN_ID)
+    packs = pack_sequences(np.array([5, 3, 7, 4]), max_length=12)
+    packed = PackedDataset(samples, packs)
+
+    with torch.no_grad():
+        batch = collator([packed[i] for i in range(len(packed))])
+        packed_loss = tiny_model(**batch).loss
+
+        # The model averages over all predicted tokens, every sample predicts
+        # all but its first token
+        losses, weights = [], []
+        for sample in samples:
+            single = collator([sample])
+            losses.append(tiny_model(**single).loss)
+            weights.append(len(sample["input_ids"]) - 1)
+        separate_loss = sum(
+            loss * weight for loss, weight in zip(losses, weights)
+        ) / sum(weights)
+
+    assert len(packs) < len(samples)
+    torch.testing.assert_close(packed_loss, separate_loss)
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import steps.batch_tasks as batch_tasks
+from utils.batch_results import iter_batch_results
+from utils.pydantic_models import BatchFileTask, BatchFileTaskList
+from utils.task_store import TaskStore
+
+CHAT = "POST /v1/chat/completions"
+SHARD = "shard-00000-of-00001"
+
+
+@pytest.fixture(autouse=True)
+def no_metadata(monkeypatch):
+    monkeypatch.setattr(batch_tasks, "log_metadata", lambda **kwargs: None)
+    monkeypatch.setattr("utils.retry.backoff_delay", lambda *args: 0.0)
+
+
+@pytest.fixture
+def task_list(tmp_path) -> BatchFileTaskList:
+    tasks = []
+    for number in range(3):
+        path = tmp_path / f"batch_{number}.jsonl"
+        with open(path, "w") as f:
+            for request in range(2):
+                line = {
+                    "custom_id": f"img_{number}_{request}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": "stub", "messages": []},
+                }
+                f.write(json.dumps(line) + "\n")
+        tasks.append(
+            BatchFileTask(file_id=f"file-{number}", path=str(path), status="pending")
+        )
+
+    with TaskStore(tmp_path / "tasks.sqlite") as store:
+        store.replace_shard(SHARD, tasks)
+    return BatchFileTaskList(tasks=tasks)
+
+
+def _run(task_list: BatchFileTaskList, tmp_path, **kwargs) -> BatchFileTaskList:
+    return batch_tasks.wait_and_update_batch.entrypoint(
+        task_list,
+        path=str(tmp_path / "results"),
+        mode="realtime",
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_concurrent_requests=1,
+        max_retries=0,
+        task_store_path=str(tmp_path / "tasks.sqlite"),
+        **kwargs,
+    )
+
+
+def _successful_ids(tasks: BatchFileTaskList) -> set[str]:
+    return {
+        result.custom_id
+        for task in tasks.tasks
+        for result in iter_batch_results(task.result_path)
+        if result.status_code == 200 and result.alt_text
+    }
+
+
+def test_realtime_writes_batch_api_results(openai_stub, task_list, tmp_path):
+    tasks = _run(task_list, tmp_path)
+
+    assert openai_stub.calls[CHAT] == 6
+    assert not any("batches" in route for route in openai_stub.calls)
+    assert [task.status for task in tasks.tasks] == ["completed"] * 3
+    assert all(task.error_path is None for task in tasks.tasks)
+    assert len(_successful_ids(tasks)) == 6
+
+
+def test_failed_requests_are_retried_in_realtime(openai_stub, task_list, tmp_path):
+    # Both requests of the first file and the first of the second file fail
+    openai_stub.failures[CHAT] = 3
+
+    tasks = _run(task_list, tmp_path, max_batch_retries=1)
+
+    first, second, third, *retries = tasks.tasks
+    assert (first.status, second.status, third.status) == (
+        "failed",
+        "completed",
+        "completed",
+    )
+    assert second.error_path is not None and third.error_path is None
+    assert [(task.retry_of, task.attempt) for task in retries] == [
+        ("file-0", 1),
+        ("file-1", 1),
+    ]
+    assert all(task.status == "completed" for task in retries)
+    assert openai_stub.calls[CHAT] == 9
+    assert len(_successful_ids(tasks)) == 6
+
+    with TaskStore(tmp_path / "tasks.sqlite") as store:
+        assert store.tasks([SHARD]) == tasks.tasks
+
+
+def test_rerun_resumes_from_the_written_results(openai_stub, task_list, tmp_path):
+    openai_stub.failures[CHAT] = 1
+    first = _run(task_list, tmp_path, max_batch_retries=1)
+    calls = openai_stub.calls[CHAT]
+
+    again = _run(BatchFileTaskList(tasks=first.tasks), tmp_path, max_batch_retries=1)
+
+    assert openai_stub.calls[CHAT] == calls
+    assert [task.status for task in again.tasks] == [
+        task.status for task in first.tasks
+    ]
+    assert len(again.tasks) == len(first.tasks)
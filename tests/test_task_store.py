@@ -0,0 +1,34 @@
+from utils.pydantic_models import BatchFileTask
+from utils.task_store import TaskStore
+
+SHARD = "shard-00000-of-00001"
+
+
+def _task(file_id: str, **kwargs) -> BatchFileTask:
+    return BatchFileTask(
+        file_id=file_id, path=f"{file_id}.jsonl", status="pending", **kwargs
+    )
+
+
+def test_replace_shard_keeps_the_state_of_unchanged_files(tmp_path):
+    with TaskStore(tmp_path / "tasks.sqlite") as store:
+        store.replace_shard(SHARD, [_task("file-a"), _task("file-b")])
+        for task in store.tasks([SHARD]):
+            task.status = "failed"
+            task.batch_id = f"batch-{task.file_id}"
+            store.update(task)
+        retry_a = _task("file-a-retry", attempt=1, retry_of="file-a")
+        retry_b = _task("file-b-retry", attempt=1, retry_of="file-b")
+        store.add(SHARD, [retry_a, retry_b])
+
+        # file-b changed and was uploaded as file-c
+        store.replace_shard(
+            SHARD, [_task("file-a", estimated_tokens=5), _task("file-c")]
+        )
+        tasks = store.tasks([SHARD])
+
+    assert [task.file_id for task in tasks] == ["file-a", "file-c", "file-a-retry"]
+    assert (tasks[0].status, tasks[0].batch_id) == ("failed", "batch-file-a")
+    assert tasks[0].estimated_tokens == 5
+    assert (tasks[1].status, tasks[1].batch_id) == ("pending", None)
+    assert tasks[2] == retry_a
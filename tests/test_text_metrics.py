@@ -0,0 +1,66 @@
+import re
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from utils.text_metrics import caption_metrics, ngram_f1
+
+
+def _brute_force_f1(prediction: str, reference: str, n: int) -> float:
+    def ngrams(text: str) -> Counter:
+        words = re.findall(r"\w+", text.lower())
+        return Counter(tuple(words[i : i + n]) for i in range(len(words) - n + 1))
+
+    predicted, referenced = ngrams(prediction), ngrams(reference)
+    overlap = sum((predicted & referenced).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(predicted.values())
+    recall = overlap / sum(referenced.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def _random_texts(rng: np.random.Generator, count: int) -> list[str]:
+    words = ["A", "dog", "cat", "on", "the", "grass", "red", "ball"]
+    return [
+        " ".join(rng.choice(words, rng.integers(0, 8))) for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_ngram_f1_matches_brute_force_counts(n):
+    rng = np.random.default_rng(n)
+    predictions = _random_texts(rng, 200) + ["", "dog", "a dog, a dog!"]
+    references = _random_texts(rng, 200) + ["a dog", "", "A dog on a dog"]
+
+    expected = [
+        _brute_force_f1(prediction, reference, n)
+        for prediction, reference in zip(predictions, references)
+    ]
+
+    np.testing.assert_allclose(ngram_f1(predictions, references, n), expected)
+
+
+def test_ngram_f1_of_no_pairs_is_empty():
+    assert ngram_f1([], [], 2).shape == (0,)
+
+
+def test_ngram_f1_rejects_unpaired_texts():
+    with pytest.raises(ValueError):
+        ngram_f1(["a dog"], [])
+
+
+def test_caption_metrics():
+    metrics = caption_metrics(
+        ["A dog on the grass", "A red ball"],
+        ["A dog on grass", "A cat"],
+        max_characters=15,
+    )
+
+    assert metrics == {
+        "unigram_f1": round((2 * 4 / 9 + 2 * 1 / 5) / 2, 4),
+        "bigram_f1": round((2 * 2 / 7 + 0) / 2, 4),
+        "length_compliance": 0.5,
+        "mean_characters": 14.0,
+    }
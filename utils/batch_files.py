@@ -0,0 +1,208 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import BinaryIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.images import image_bytes_to_base64, image_size
+from utils.prompts import generate_alt_text_prompt
+from utils.pydantic_models import BatchFile
+from utils.tokens import (
+    MESSAGE_OVERHEAD_TOKENS,
+    estimate_image_tokens,
+    estimate_text_tokens,
+)
+
+IMAGE_INDEX_FILE = "image_index.parquet"
+IMAGE_CUSTOM_ID_PREFIX = "img_"
+
+RequestChunk = list[tuple[str, pa.Buffer | bytes]]
+
+
+def build_batch_request(
+    custom_id: str, openai_model: str, image_base64: str, image_format: str
+) -> dict:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": openai_model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": generate_alt_text_prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/{image_format};base64,{image_base64}",
+                            },
+                        },
+                    ],
+                }
+            ],
+        },
+    }
+
+
+def encode_jsonl_line(entry: dict) -> bytes:
+    return json.dumps(entry).encode() + b"\n"
+
+
+def estimate_request_tokens(width: int, height: int, openai_model: str) -> int:
+    return (
+        MESSAGE_OVERHEAD_TOKENS
+        + estimate_text_tokens(generate_alt_text_prompt)
+        + estimate_image_tokens(width, height, openai_model)
+    )
+
+
+def encode_request_chunk(
+    chunk: RequestChunk, openai_model: str
+) -> tuple[list[tuple[bytes, int]], list[str]]:
+    """Encode a chunk of raw images into Batch API request lines.
+
+    This runs inside the worker processes of ``ordered_map`` and therefore only
+    takes and returns plain picklable values.
+
+    Args:
+        chunk: Pairs of custom ID and encoded image bytes. Images in an
+            accepted format are passed through without decoding.
+        openai_model: Model used for the chat completion requests.
+
+    Returns:
+        tuple: The JSONL request lines with their estimated input tokens and
+            the custom IDs of skipped images.
+    """
+    lines = []
+    skipped = []
+
+    for custom_id, data in chunk:
+        try:
+            base64, format = image_bytes_to_base64(data)
+            width, height = image_size(data)
+        except OSError:
+            skipped.append(custom_id)
+            continue
+
+        line = encode_jsonl_line(
+            build_batch_request(custom_id, openai_model, base64, format)
+        )
+        lines.append((line, estimate_request_tokens(width, height, openai_model)))
+
+    return lines, skipped
+
+
+def image_hash(data: bytes | memoryview | pa.Buffer) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def image_custom_id(hash: str) -> str:
+    return f"{IMAGE_CUSTOM_ID_PREFIX}{hash}"
+
+
+class ImageIndexWriter:
+    """Stream the row to image hash index of a dataset into a Parquet file.
+
+    Row ``i`` of the index holds the content hash of the image in dataset row
+    ``i``, or null if the row has no usable image. Requests are only sent once
+    per hash, the index is used to fan the results back out to all rows.
+    ``metadata``, e.g. the model and prompt of the requests, is stored in the
+    file's schema, see ``read_image_index_metadata``.
+    """
+
+    schema = pa.schema([("image_hash", pa.string())])
+
+    def __init__(self, path: Path, metadata: dict[str, str] | None = None):
+        self.path = path
+        self.schema = self.schema.with_metadata(metadata or {})
+        self._writer = pq.ParquetWriter(path, self.schema)
+
+    def __enter__(self) -> "ImageIndexWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, hashes: list[str | None]) -> None:
+        self._writer.write_table(pa.table({"image_hash": hashes}, schema=self.schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def read_image_index(path: Path) -> pa.ChunkedArray:
+    return pq.read_table(path, columns=["image_hash"])["image_hash"]
+
+
+def read_image_index_metadata(path: Path) -> dict[str, str]:
+    metadata = pq.read_schema(path).metadata or {}
+    return {key.decode(): value.decode() for key, value in metadata.items()}
+
+
+class JsonlShardWriter:
+    """Stream JSONL lines into numbered shard files.
+
+    A new shard is started whenever the next line would push the current
+    shard over ``max_bytes`` or once it already holds ``max_lines`` lines, so
+    that every file stays inside the Batch API's per-file limits. Lines are
+    written straight to disk and nothing is buffered beyond the open file.
+    Request count, size and estimated input tokens of every shard are kept
+    in ``files``.
+
+    Args:
+        directory: Directory the shard files are written to.
+        prefix: File name prefix, shards are named ``{prefix}_{n}.jsonl``.
+        max_bytes: Maximum size of a single shard in bytes.
+        max_lines: Maximum number of lines (requests) in a single shard.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str = "batch",
+        max_bytes: int = 190_000_000,
+        max_lines: int = 50_000,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.files: list[BatchFile] = []
+        self._file: BinaryIO | None = None
+
+    def __enter__(self) -> "JsonlShardWriter":
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, line: bytes, tokens: int = 0) -> None:
+        if self._file is not None and (
+            self.files[-1].requests >= self.max_lines
+            or self.files[-1].bytes + len(line) > self.max_bytes
+        ):
+            self.close()
+
+        if self._file is None:
+            self._open_next()
+
+        self._file.write(line)
+        shard = self.files[-1]
+        shard.bytes += len(line)
+        shard.requests += 1
+        shard.estimated_tokens += tokens
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open_next(self) -> None:
+        path = self.directory / f"{self.prefix}_{len(self.files)}.jsonl"
+        self._file = open(path, "wb")
+        self.files.append(BatchFile(path=str(path)))
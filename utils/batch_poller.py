@@ -0,0 +1,191 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from openai import AsyncOpenAI
+from openai.types import Batch
+from zenml.logger import get_logger
+
+from utils.pydantic_models import BatchFileTask
+from utils.retry import async_retry_with_backoff
+
+logger = get_logger(__name__)
+
+TERMINAL_STATUSES = {"failed", "expired", "cancelled", "completed"}
+# Tasks without a batch yet, they are submitted, everything else is only
+# polled. Failed requests of finished batches are retried in new tasks, see
+# ``BatchRetrier``.
+SUBMIT_STATUSES = {"pending"}
+
+
+class BatchPoller:
+    """Drive a list of batch tasks to a terminal state concurrently.
+
+    Existing batches are looked up once through a single listing of all
+    batches, indexed by input file ID. Missing batches are then submitted in
+    task order and every in-flight batch is polled in its own coroutine. The
+    poll interval starts at ``min_wait`` and grows by ``backoff`` up to
+    ``max_wait`` while the status does not change.
+
+    With a ``token_budget`` the estimated input tokens of all in-flight
+    batches are kept below the budget, to stay inside the organization's
+    enqueued token limit. The next batch is submitted as soon as a finished
+    batch frees enough capacity. A batch larger than the budget is only
+    submitted when nothing else is in flight.
+
+    Args:
+        client: Async OpenAI client.
+        min_wait: Initial poll interval in seconds.
+        max_wait: Maximum poll interval in seconds.
+        backoff: Factor the poll interval grows by after an unchanged poll.
+        token_budget: Maximum estimated input tokens in flight, None for no
+            limit.
+        on_terminal: Coroutine function called with each task as soon as it
+            reaches a terminal state, e.g. to start downloading its results
+            while other batches are still running.
+        on_update: Function called with each task after its batch state was
+            updated, e.g. to persist it.
+        list_batches: Whether to look up existing batches by listing all
+            batches. Without the listing, the recorded state of the tasks is
+            trusted: terminal tasks are not refreshed and only tasks with a
+            batch ID are retrieved.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        min_wait: float = 5.0,
+        max_wait: float = 60.0,
+        backoff: float = 1.5,
+        token_budget: int | None = None,
+        on_terminal: Callable[[BatchFileTask], Awaitable[None]] | None = None,
+        on_update: Callable[[BatchFileTask], None] | None = None,
+        list_batches: bool = True,
+    ):
+        self.client = client
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self.token_budget = token_budget
+        self.on_terminal = on_terminal
+        self.on_update = on_update
+        self.list_batches = list_batches
+        self._in_flight_tokens = 0
+        self._capacity = asyncio.Condition()
+
+    async def run(self, tasks: list[BatchFileTask]) -> None:
+        index = await self._index_batches() if self.list_batches else {}
+        stale = []
+
+        for task in tasks:
+            batch = index.get(task.file_id)
+            if batch is not None and task.batch_id in (None, batch.id):
+                logger.info(
+                    f"Found existing OpenAI Batch {batch.id} for task {task.file_id}."
+                )
+                self._update(task, batch)
+            elif task.batch_id is not None and (
+                self.list_batches or task.status not in TERMINAL_STATUSES
+            ):
+                stale.append(task)
+
+        for task, batch in zip(
+            stale,
+            await asyncio.gather(
+                *(self.client.batches.retrieve(task.batch_id) for task in stale)
+            ),
+        ):
+            self._update(task, batch)
+
+        pollers = []
+        for task in tasks:
+            if task.status in TERMINAL_STATUSES:
+                pollers.append(asyncio.create_task(self._finish(task)))
+            elif task.status not in SUBMIT_STATUSES:
+                self._in_flight_tokens += task.estimated_tokens or 0
+                pollers.append(asyncio.create_task(self._track(task)))
+
+        for task in tasks:
+            if task.status in SUBMIT_STATUSES:
+                await self._acquire(task)
+                await self._submit(task)
+                pollers.append(asyncio.create_task(self._track(task)))
+
+        await asyncio.gather(*pollers)
+
+    async def _index_batches(self) -> dict[str, Batch]:
+        index = {}
+        # Batches are listed newest first, keep the latest batch per input file
+        async for batch in self.client.batches.list(limit=100):
+            index.setdefault(batch.input_file_id, batch)
+        return index
+
+    def _fits(self, tokens: int) -> bool:
+        return (
+            self.token_budget is None
+            or self._in_flight_tokens == 0
+            or self._in_flight_tokens + tokens <= self.token_budget
+        )
+
+    async def _acquire(self, task: BatchFileTask) -> None:
+        tokens = task.estimated_tokens or 0
+
+        async with self._capacity:
+            if not self._fits(tokens):
+                logger.info(
+                    f"Waiting for token capacity for task {task.file_id}, "
+                    f"{self._in_flight_tokens} tokens in flight, {tokens} needed."
+                )
+            await self._capacity.wait_for(lambda: self._fits(tokens))
+            self._in_flight_tokens += tokens
+
+    async def _track(self, task: BatchFileTask) -> None:
+        try:
+            await self._poll(task)
+        finally:
+            async with self._capacity:
+                self._in_flight_tokens -= task.estimated_tokens or 0
+                self._capacity.notify_all()
+
+        await self._finish(task)
+
+    async def _finish(self, task: BatchFileTask) -> None:
+        if self.on_terminal is not None:
+            await self.on_terminal(task)
+
+    async def _submit(self, task: BatchFileTask) -> None:
+        batch = await async_retry_with_backoff(
+            lambda: self.client.batches.create(
+                input_file_id=task.file_id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+        )
+        self._update(task, batch)
+        logger.info(
+            f"Created OpenAI Batch with ID {task.batch_id} for task {task.file_id}."
+        )
+
+    async def _poll(self, task: BatchFileTask) -> None:
+        wait = self.min_wait
+
+        while task.status not in TERMINAL_STATUSES:
+            await asyncio.sleep(wait)
+            previous = task.status
+            batch = await async_retry_with_backoff(
+                lambda: self.client.batches.retrieve(task.batch_id)
+            )
+            self._update(task, batch)
+
+            if task.status != previous:
+                logger.info(f"Updated task {task.file_id} status to {task.status}.")
+                wait = self.min_wait
+            else:
+                wait = min(wait * self.backoff, self.max_wait)
+
+    def _update(self, task: BatchFileTask, batch: Batch) -> None:
+        task.batch_id = batch.id
+        task.status = batch.status
+        task.result_file_id = batch.output_file_id
+        task.error_file_id = batch.error_file_id
+        if self.on_update is not None:
+            self.on_update(task)
@@ -0,0 +1,55 @@
+import json
+from collections.abc import Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+class BatchResult(NamedTuple):
+    custom_id: str
+    status_code: int | None
+    alt_text: str | None
+
+
+def iter_batch_results(path: Path) -> Iterator[BatchResult]:
+    """Parse a Batch API output file line by line.
+
+    Only the fields needed to build the dataset are extracted, so memory use
+    stays constant regardless of the file size. Lines of failed requests have
+    no response and are reported with a status code of None.
+    """
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            response = record.get("response") or {}
+            status_code = response.get("status_code")
+            alt_text = None
+
+            if status_code == 200:
+                choices = (response.get("body") or {}).get("choices") or [{}]
+                alt_text = (choices[0].get("message") or {}).get("content")
+
+            yield BatchResult(record["custom_id"], status_code, alt_text)
+
+
+def fan_out_captions(
+    image_hashes: pa.ChunkedArray, captions: dict[str, str]
+) -> pa.ChunkedArray:
+    """Map every row's image hash to its caption in a single vectorized lookup.
+
+    Args:
+        image_hashes: Image hash of every dataset row, see ``ImageIndexWriter``.
+        captions: Caption per image hash.
+
+    Returns:
+        pa.ChunkedArray: Caption of every row, empty for rows without one.
+    """
+    keys = pa.array(list(captions.keys()), pa.string())
+    values = pa.array(list(captions.values()), pa.string())
+    positions = pc.index_in(image_hashes, value_set=keys)
+    return pc.fill_null(pc.take(values, positions), "")
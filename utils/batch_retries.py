@@ -0,0 +1,161 @@
+import json
+import re
+from collections.abc import Iterable
+from pathlib import Path
+
+from openai import AsyncOpenAI
+from zenml.logger import get_logger
+
+from utils.batch_poller import TERMINAL_STATUSES
+from utils.batch_results import iter_batch_results
+from utils.pydantic_models import BatchFileTask
+from utils.retry import async_retry_with_backoff
+from utils.upload_manifest import UploadManifest, file_sha256
+
+logger = get_logger(__name__)
+
+# Request lines start with their custom ID, see ``build_batch_request``
+_CUSTOM_ID_PREFIX = re.compile(rb'^\{"custom_id": "((?:[^"\\]|\\.)*)"')
+
+
+def request_custom_id(line: bytes) -> str:
+    """Custom ID of a batch request line, without parsing the whole line."""
+    match = _CUSTOM_ID_PREFIX.match(line)
+    if match is not None:
+        return json.loads(b'"' + match.group(1) + b'"')
+    return json.loads(line)["custom_id"]
+
+
+def successful_custom_ids(paths: Iterable[str | None]) -> set[str]:
+    """Custom IDs with a successful response in any of the output files."""
+    succeeded = set()
+    for path in paths:
+        if path is not None and Path(path).exists():
+            succeeded.update(
+                result.custom_id
+                for result in iter_batch_results(Path(path))
+                if result.status_code == 200
+            )
+    return succeeded
+
+
+def write_retry_file(
+    input_path: Path, output_path: Path, exclude: set[str]
+) -> tuple[int, int]:
+    """Copy the request lines of ``input_path`` not in ``exclude``.
+
+    Returns:
+        tuple[int, int]: Number of copied lines and of all request lines.
+    """
+    copied = total = 0
+    with open(input_path, "rb") as source, open(output_path, "wb") as target:
+        for line in source:
+            if not line.strip():
+                continue
+            total += 1
+            if request_custom_id(line) not in exclude:
+                target.write(line)
+                copied += 1
+    return copied, total
+
+
+class BatchRetrier:
+    """Build retry tasks for the failed requests of finished batches.
+
+    A task that ended failed, expired or cancelled, or completed with errors,
+    is compared with its downloaded output: every request without a
+    successful response goes into a retry file next to the task's batch
+    file, which is uploaded as a new task. Every retry is a new upload with
+    a file ID of its own, even if no request succeeded and the retry file
+    equals the retried file. Retry files are deterministic and their uploads
+    are recorded in the upload manifest by checksum and attempt, so a rerun
+    reuses the uploaded file and the existing batch instead of retrying
+    again.
+
+    Without a manifest, retry files are not uploaded and their tasks get a
+    local file ID derived from the retried task, for requests that are sent
+    in realtime.
+
+    Args:
+        client: Async OpenAI client.
+        manifest: Manifest of uploaded files, None to not upload retry files.
+        max_attempts: Maximum number of retries of a request.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        manifest: UploadManifest | None,
+        max_attempts: int = 2,
+    ):
+        self.client = client
+        self.manifest = manifest
+        self.max_attempts = max_attempts
+
+    async def retry_tasks(self, tasks: list[BatchFileTask]) -> list[BatchFileTask]:
+        """New tasks for the failed requests of ``tasks``, not yet submitted."""
+        retried = {task.retry_of for task in tasks if task.retry_of}
+        retries = []
+
+        for task in tasks:
+            if (
+                task.status not in TERMINAL_STATUSES
+                or task.file_id in retried
+                or task.attempt >= self.max_attempts
+                or (
+                    task.status == "completed"
+                    and not (task.error_file_id or task.error_path)
+                )
+            ):
+                continue
+
+            retry = await self._retry_task(task)
+            if retry is not None:
+                retries.append(retry)
+
+        return retries
+
+    async def _retry_task(self, task: BatchFileTask) -> BatchFileTask | None:
+        succeeded = successful_custom_ids([task.result_path])
+        input_path = Path(task.path)
+        stem = input_path.stem.split("_retry")[0]
+        retry_path = input_path.with_name(f"{stem}_retry{task.attempt + 1}.jsonl")
+        failed, total = write_retry_file(input_path, retry_path, succeeded)
+
+        if failed == 0:
+            retry_path.unlink()
+            return None
+
+        if self.manifest is None:
+            file_id = f"{task.file_id.split('-retry')[0]}-retry{task.attempt + 1}"
+        else:
+            file_id = await self._upload(retry_path, task.attempt + 1)
+
+        logger.info(
+            f"Retrying {failed} of {total} requests of task {task.file_id} "
+            f"({task.status}) as {file_id}, attempt {task.attempt + 1}."
+        )
+        return BatchFileTask(
+            file_id=file_id,
+            path=str(retry_path),
+            status="pending",
+            estimated_tokens=(task.estimated_tokens or 0) * failed // max(total, 1),
+            attempt=task.attempt + 1,
+            retry_of=task.file_id,
+        )
+
+    async def _upload(self, retry_path: Path, attempt: int) -> str:
+        # Retries are recorded under a key of their own: the retry of a batch
+        # without any successful request has the same content as the file it
+        # retries, it must get a new file ID and with it a new batch
+        key = f"{file_sha256(retry_path)}-retry{attempt}"
+        file_id = self.manifest.get(key)
+        if file_id is None:
+
+            async def create():
+                with open(retry_path, "rb") as f:
+                    return await self.client.files.create(file=f, purpose="batch")
+
+            file_id = (await async_retry_with_backoff(create)).id
+            self.manifest.record(key, file_id, retry_path)
+        return file_id
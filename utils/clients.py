@@ -0,0 +1,22 @@
+from functools import cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from zenml.client import Client
+
+
+@cache
+def get_openai_client() -> "OpenAI":
+    """Shared OpenAI client, created on first use."""
+    from openai import OpenAI
+
+    return OpenAI()
+
+
+@cache
+def get_zenml_client() -> "Client":
+    """Shared ZenML client, created on first use."""
+    from zenml.client import Client
+
+    return Client()
@@ -0,0 +1,189 @@
+import hashlib
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import NamedTuple
+
+from datasets import Dataset, DatasetDict, load_dataset
+from datasets.features.features import require_decoding
+from datasets.table import embed_table_storage
+from huggingface_hub import CommitOperationAdd, CommitOperationDelete, HfApi
+
+LOCAL_URI_PREFIX = "file://"
+
+
+class PublishSummary(NamedTuple):
+    shards: int
+    uploaded: int
+    deleted: int
+    uploaded_bytes: int
+
+
+def embed_external_files(dataset: Dataset) -> Dataset:
+    """Embed the bytes of images stored only as local paths into the table.
+
+    Parquet shards hold the table as it is, so an image that only references
+    a local file would be published as a dangling path. This is the embedding
+    ``push_to_hub`` applies to its shards.
+    """
+    if not any(
+        require_decoding(feature, ignore_decode_attribute=True)
+        for feature in dataset.features.values()
+    ):
+        return dataset
+
+    return (
+        dataset.with_format("arrow")
+        .map(embed_table_storage, batched=True, keep_in_memory=True)
+        .with_format(**dataset.format)
+    )
+
+
+class DatasetSink(ABC):
+    """Storage for published datasets, made of content-addressed Parquet shards.
+
+    A split is cut into shards of ``rows_per_shard`` rows, named
+    ``data/{split}-{position}-{hash}.parquet`` after their position and the
+    SHA-256 of their content. Publishing only transfers shards whose name does
+    not exist in the sink yet and removes shards that are no longer part of
+    the split. Since rows are only appended between runs, a rerun usually
+    only uploads the last few shards. Images stored as local paths are
+    embedded into the shards, see ``embed_external_files``.
+
+    Args:
+        rows_per_shard: Number of rows per Parquet shard.
+    """
+
+    def __init__(self, rows_per_shard: int = 5000):
+        self.rows_per_shard = rows_per_shard
+
+    @property
+    @abstractmethod
+    def uri(self) -> str:
+        """URI that ``open_dataset_sink`` resolves back to this sink."""
+
+    @abstractmethod
+    def existing_files(self) -> set[str]:
+        """Relative paths of all shard files in the sink."""
+
+    @abstractmethod
+    def commit(self, added: dict[str, Path], deleted: list[str]) -> None:
+        """Add the given local files under their relative path, delete others."""
+
+    @abstractmethod
+    def load(self) -> DatasetDict:
+        """Load all published splits."""
+
+    def publish(self, dataset: Dataset, split: str = "train") -> PublishSummary:
+        existing = self.existing_files()
+        shards = []
+        added = {}
+
+        with tempfile.TemporaryDirectory() as staging:
+            for position, start in enumerate(
+                range(0, len(dataset), self.rows_per_shard)
+            ):
+                local_path = Path(staging) / f"{position}.parquet"
+                end = min(start + self.rows_per_shard, len(dataset))
+                shard = embed_external_files(dataset.select(range(start, end)))
+                shard.to_parquet(local_path)
+
+                digest = hashlib.sha256(local_path.read_bytes()).hexdigest()[:16]
+                name = f"data/{split}-{position:05d}-{digest}.parquet"
+                shards.append(name)
+
+                if name in existing:
+                    local_path.unlink()
+                else:
+                    added[name] = local_path
+
+            deleted = sorted(
+                name
+                for name in existing
+                if name.startswith(f"data/{split}-") and name not in shards
+            )
+            uploaded_bytes = sum(path.stat().st_size for path in added.values())
+
+            if added or deleted:
+                self.commit(added, deleted)
+
+        return PublishSummary(len(shards), len(added), len(deleted), uploaded_bytes)
+
+
+class LocalDatasetSink(DatasetSink):
+    """Dataset sink backed by a local directory."""
+
+    def __init__(self, directory: str | Path, rows_per_shard: int = 5000):
+        super().__init__(rows_per_shard)
+        self.directory = Path(directory).resolve()
+
+    @property
+    def uri(self) -> str:
+        return f"{LOCAL_URI_PREFIX}{self.directory}"
+
+    def existing_files(self) -> set[str]:
+        return {
+            path.relative_to(self.directory).as_posix()
+            for path in self.directory.glob("data/*.parquet")
+        }
+
+    def commit(self, added: dict[str, Path], deleted: list[str]) -> None:
+        (self.directory / "data").mkdir(parents=True, exist_ok=True)
+        for name, local_path in added.items():
+            shutil.move(local_path, self.directory / name)
+        for name in deleted:
+            (self.directory / name).unlink(missing_ok=True)
+
+    def load(self) -> DatasetDict:
+        splits = {path.name.split("-")[0] for path in self.directory.glob("data/*")}
+        return load_dataset(
+            "parquet",
+            data_files={
+                split: str(self.directory / "data" / f"{split}-*.parquet")
+                for split in splits
+            },
+        )
+
+
+class HuggingFaceDatasetSink(DatasetSink):
+    """Dataset sink backed by a Hugging Face Hub dataset repository."""
+
+    def __init__(self, repo_id: str, rows_per_shard: int = 5000):
+        super().__init__(rows_per_shard)
+        self.repo_id = repo_id
+        self.api = HfApi()
+
+    @property
+    def uri(self) -> str:
+        return self.repo_id
+
+    def existing_files(self) -> set[str]:
+        self.api.create_repo(self.repo_id, repo_type="dataset", exist_ok=True)
+        return {
+            name
+            for name in self.api.list_repo_files(self.repo_id, repo_type="dataset")
+            if name.startswith("data/") and name.endswith(".parquet")
+        }
+
+    def commit(self, added: dict[str, Path], deleted: list[str]) -> None:
+        operations = [
+            CommitOperationAdd(path_in_repo=name, path_or_fileobj=str(local_path))
+            for name, local_path in added.items()
+        ] + [CommitOperationDelete(path_in_repo=name) for name in deleted]
+        self.api.create_commit(
+            self.repo_id,
+            operations=operations,
+            commit_message=f"Update {len(added)} shards, delete {len(deleted)}",
+            repo_type="dataset",
+        )
+
+    def load(self) -> DatasetDict:
+        return load_dataset(self.repo_id)
+
+
+def open_dataset_sink(uri: str) -> DatasetSink:
+    """Return the sink for a URI, ``file://`` paths or Hugging Face repo IDs."""
+    if uri.startswith(LOCAL_URI_PREFIX):
+        return LocalDatasetSink(uri.removeprefix(LOCAL_URI_PREFIX))
+    return HuggingFaceDatasetSink(uri)
@@ -0,0 +1,96 @@
+import asyncio
+from pathlib import Path
+
+from openai import AsyncOpenAI
+from zenml.logger import get_logger
+
+from utils.batch_poller import TERMINAL_STATUSES
+from utils.pydantic_models import BatchFileTask
+from utils.retry import async_retry_with_backoff
+
+logger = get_logger(__name__)
+
+
+async def download_file(
+    client: AsyncOpenAI, file_id: str, path: Path, chunk_size: int = 1024 * 1024
+) -> None:
+    """Stream an OpenAI file to disk in fixed size chunks.
+
+    The content is written to a ``.part`` file next to ``path`` which is
+    renamed once the download is complete, so ``path`` either does not exist
+    or holds the whole file.
+    """
+    tmp_path = path.with_name(f"{path.name}.part")
+
+    async with client.files.with_streaming_response.content(file_id) as response:
+        with open(tmp_path, "wb") as f:
+            async for chunk in response.iter_bytes(chunk_size):
+                f.write(chunk)
+
+    tmp_path.replace(path)
+
+
+def result_file_path(directory: Path, task: BatchFileTask, kind: str) -> Path:
+    """Path of a task's ``result`` or ``errors`` file in ``directory``.
+
+    Retry tasks are named by their attempt as well, so their files can never
+    overwrite those of the task they retry.
+    """
+    attempt = f"_attempt{task.attempt}" if task.attempt else ""
+    return directory / f"{task.file_id}{attempt}_{kind}.jsonl"
+
+
+class ResultDownloader:
+    """Download the output and error files of finished batch tasks.
+
+    Instances are awaited once per task and can be shared between coroutines,
+    at most ``max_concurrent`` downloads run at the same time. Files of failed,
+    expired and cancelled batches are downloaded as well, they hold the
+    requests that completed before the batch ended. Files that were already
+    downloaded are skipped.
+
+    Args:
+        client: Async OpenAI client.
+        directory: Directory the result files are written to.
+        max_concurrent: Maximum number of simultaneous downloads.
+        chunk_size: Size of the streamed chunks in bytes.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        directory: Path,
+        max_concurrent: int = 4,
+        chunk_size: int = 1024 * 1024,
+    ):
+        self.client = client
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def __call__(self, task: BatchFileTask) -> None:
+        if task.status not in TERMINAL_STATUSES:
+            return
+
+        if task.result_file_id and not _exists(task.result_path):
+            path = result_file_path(self.directory, task, "result")
+            await self._download(task.result_file_id, path)
+            task.result_path = str(path)
+
+        if task.error_file_id and not _exists(task.error_path):
+            path = result_file_path(self.directory, task, "errors")
+            await self._download(task.error_file_id, path)
+            task.error_path = str(path)
+
+    async def _download(self, file_id: str, path: Path) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        async with self._semaphore:
+            logger.info(f"Downloading {file_id} to {path}.")
+            await async_retry_with_backoff(
+                lambda: download_file(self.client, file_id, path, self.chunk_size)
+            )
+        logger.info(f"Downloaded {file_id} to {path}.")
+
+
+def _exists(path: str | None) -> bool:
+    return path is not None and Path(path).exists()
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import shutil
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset as TorchDataset
+
+COMPLETE_MARKER = "_COMPLETE"
+# Features with one entry per token, padded to the longest sequence in a batch
+SEQUENCE_FEATURES = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def feature_cache_key(
+    model_name: str, processor_config: str, data_hashes: list[str]
+) -> str:
+    """Key of a feature cache, changes with the model, processor or data."""
+    digest = hashlib.sha256()
+    for part in [model_name, processor_config, *data_hashes]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def write_feature_split(
+    directory: Path,
+    features: Iterable[dict[str, np.ndarray]],
+    dtypes: dict[str, str],
+) -> int:
+    """Append the features of every sample to one flat binary file per feature.
+
+    For every feature the offset and shape of each sample are stored in
+    ``index.npz``, which is enough to slice samples back out of a memory map
+    of the flat file. Samples are written one at a time, so memory use does
+    not depend on the split size.
+
+    Args:
+        directory: Directory of the split, must not exist yet.
+        features: Features of every sample, arrays without a batch dimension.
+        dtypes: Storage dtype per feature name, e.g. to keep pixel values as
+            float16. Features not listed keep their dtype.
+
+    Returns:
+        int: Number of written samples.
+    """
+    directory.mkdir(parents=True)
+    files = {}
+    offsets: dict[str, list[int]] = {}
+    shapes: dict[str, list[tuple[int, ...]]] = {}
+    meta = {}
+    count = 0
+
+    try:
+        for sample in features:
+            for name, array in sample.items():
+                if name not in files:
+                    files[name] = open(directory / f"{name}.bin", "wb")
+                    offsets[name] = [0]
+                    shapes[name] = []
+                    meta[name] = dtypes.get(name, str(array.dtype))
+
+                array = np.ascontiguousarray(array, dtype=meta[name])
+                files[name].write(array.tobytes())
+                offsets[name].append(offsets[name][-1] + array.size)
+                shapes[name].append(array.shape)
+            count += 1
+    finally:
+        for f in files.values():
+            f.close()
+
+    index = {}
+    for name in files:
+        index[f"{name}.offsets"] = np.asarray(offsets[name], np.int64)
+        index[f"{name}.shapes"] = np.asarray(shapes[name], np.int64)
+
+    np.savez(directory / "index.npz", **index)
+    meta_json = json.dumps({"dtypes": meta, "size": count})
+    (directory / "meta.json").write_text(meta_json)
+    return count
+
+
+def finalize_feature_cache(tmp_directory: Path, directory: Path) -> None:
+    """Atomically move a fully written cache into place."""
+    (tmp_directory / COMPLETE_MARKER).touch()
+    if directory.exists():
+        shutil.rmtree(directory)
+    tmp_directory.replace(directory)
+
+
+def is_feature_cache_complete(directory: Path) -> bool:
+    return (directory / COMPLETE_MARKER).exists()
+
+
+class FeatureCacheDataset(TorchDataset):
+    """Read-only view of one split of a feature cache.
+
+    Features are memory mapped, indexing a sample only slices the maps and
+    does not copy or recompute anything.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        meta = json.loads((self.directory / "meta.json").read_text())
+        index = np.load(self.directory / "index.npz")
+        self.size = meta["size"]
+        self.offsets = {}
+        self.shapes = {}
+        self.maps = {}
+
+        for name, dtype in meta["dtypes"].items():
+            self.offsets[name] = index[f"{name}.offsets"]
+            self.shapes[name] = index[f"{name}.shapes"]
+            self.maps[name] = np.memmap(
+                self.directory / f"{name}.bin", dtype=dtype, mode="r"
+            )
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, idx: int) -> dict[str, np.ndarray]:
+        sample = {}
+        for name, data in self.maps.items():
+            start, end = self.offsets[name][idx], self.offsets[name][idx + 1]
+            sample[name] = data[start:end].reshape(self.shapes[name][idx])
+        return sample
+
+    def sequence_lengths(self) -> np.ndarray:
+        """Token count of every sample, without touching the token data."""
+        return np.diff(self.offsets["input_ids"])
+
+
+class FeatureCacheCollator:
+    """Collate cached samples into a padded training batch.
+
+    Every item is either a sample or a pack, a list of samples that is
+    concatenated into a single row. Sequence features are right padded to the
+    longest row of the batch, the remaining features (pixel values) of all
+    samples are stacked in order. Labels are the input IDs with padding and
+    ``ignore_token_ids`` (e.g. image placeholder tokens) masked out.
+
+    When a batch contains packs, position IDs restart for every packed sample
+    and the attention mask becomes a 4D block-diagonal causal mask, so packed
+    samples cannot attend to each other. The first label of every packed
+    sample is masked, as it would otherwise be predicted from the previous
+    sample.
+
+    Args:
+        pad_token_id: Token ID used for padding.
+        ignore_token_ids: Token IDs excluded from the loss.
+        dtype: Floating point dtype of the returned non-sequence features and
+            of the 4D attention mask.
+    """
+
+    def __init__(
+        self,
+        pad_token_id: int,
+        ignore_token_ids: Iterable[int] = (),
+        dtype: torch.dtype = torch.float32,
+    ):
+        self.pad_token_id = pad_token_id
+        self.ignore_token_ids = torch.tensor(
+            list(ignore_token_ids), dtype=torch.long
+        )
+        self.dtype = dtype
+
+    def __call__(self, items: list) -> dict[str, torch.Tensor]:
+        rows = [item if isinstance(item, list) else [item] for item in items]
+        max_length = max(
+            sum(len(sample["input_ids"]) for sample in row) for row in rows
+        )
+        batch = {}
+
+        for name in rows[0][0]:
+            if name in SEQUENCE_FEATURES:
+                pad = self.pad_token_id if name == "input_ids" else 0
+                padded = torch.full((len(rows), max_length), pad, dtype=torch.long)
+                for index, row in enumerate(rows):
+                    values = np.concatenate([sample[name] for sample in row])
+                    padded[index, : len(values)] = torch.from_numpy(
+                        values.astype(np.int64)
+                    )
+                batch[name] = padded
+            else:
+                stacked = torch.from_numpy(
+                    np.stack([sample[name] for row in rows for sample in row])
+                )
+                batch[name] = (
+                    stacked.to(self.dtype) if stacked.is_floating_point() else stacked
+                )
+
+        labels = batch["input_ids"].clone()
+        labels[batch["attention_mask"] == 0] = -100
+        labels[torch.isin(labels, self.ignore_token_ids)] = -100
+
+        if any(len(row) > 1 for row in rows):
+            segments = torch.zeros((len(rows), max_length), dtype=torch.long)
+            position_ids = torch.zeros((len(rows), max_length), dtype=torch.long)
+
+            for index, row in enumerate(rows):
+                start = 0
+                for segment, sample in enumerate(row, start=1):
+                    length = len(sample["input_ids"])
+                    segments[index, start : start + length] = segment
+                    position_ids[index, start : start + length] = torch.arange(length)
+                    labels[index, start] = -100
+                    start += length
+
+            batch["position_ids"] = position_ids
+            batch["attention_mask"] = self._block_causal_mask(segments)
+
+        batch["labels"] = labels
+        return batch
+
+    def _block_causal_mask(self, segments: torch.Tensor) -> torch.Tensor:
+        length = segments.shape[1]
+        causal = torch.tril(torch.ones((length, length), dtype=torch.bool))
+        allowed = (
+            (segments[:, :, None] == segments[:, None, :])
+            & (segments[:, :, None] > 0)
+            & causal
+        )
+        mask = torch.zeros(allowed.shape, dtype=self.dtype)
+        mask.masked_fill_(~allowed, torch.finfo(self.dtype).min)
+        return mask[:, None]
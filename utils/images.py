@@ -1,19 +1,168 @@
 import base64
 import io
+import os
+from collections.abc import Iterator
+
+import pyarrow as pa
+import pyarrow.compute as pc
 from PIL import Image
 
+ACCEPTED_FORMATS = ["JPEG", "PNG", "WEBP", "GIF"]
+TRANSCODE_FORMAT = "PNG"
+
+_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"GIF87a": "GIF",
+    b"GIF89a": "GIF",
+}
+
+
+def detect_image_format(data: bytes | memoryview) -> str | None:
+    """Detect the format of encoded image bytes from their magic number.
+
+    Only the formats accepted by the OpenAI vision endpoints are detected, any
+    other format returns None.
+    """
+    header = bytes(memoryview(data)[:12])
+
+    for signature, format in _SIGNATURES.items():
+        if header.startswith(signature):
+            return format
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+
+    return None
+
+
+def image_size(data: bytes | memoryview) -> tuple[int, int]:
+    """Read width and height of an encoded image from its header only."""
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def _transcode(image: Image.Image) -> bytes:
+    if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=TRANSCODE_FORMAT)
+    return buffer.getvalue()
+
+
+def downscale_image_bytes(
+    data: bytes | memoryview, max_side: int, quality: int = 85
+) -> bytes:
+    """Shrink an encoded image so that its longest side is at most ``max_side``.
+
+    Images that already fit and are in an accepted format are returned
+    unchanged. Everything else is resized, keeping the aspect ratio, and
+    re-encoded as JPEG, or as WEBP when the image has an alpha channel, at the
+    given quality.
+
+    Args:
+        data: Encoded image, any object supporting the buffer protocol.
+        max_side: Maximum width and height in pixels.
+        quality: Encoder quality between 1 and 100.
+
+    Returns:
+        bytes: The encoded, possibly downscaled image.
+    """
+    image = Image.open(io.BytesIO(data))
 
-def image_to_base64(image: Image.Image) -> tuple[str, str] | bool:
+    if max(image.size) <= max_side and detect_image_format(data) is not None:
+        return bytes(data)
+
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
     buffer = io.BytesIO()
-    format = getattr(image, "format")
+
+    has_alpha = "A" in image.getbands() or (
+        image.mode == "P" and "transparency" in image.info
+    )
+
+    if has_alpha:
+        image.convert("RGBA").save(buffer, format="WEBP", quality=quality)
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+
+    return buffer.getvalue()
+
+
+def image_bytes_to_base64(data: bytes | memoryview) -> tuple[str, str]:
+    """Base64 encode already encoded image bytes.
+
+    Bytes in one of the accepted formats are passed through unchanged, without
+    decoding the image. Everything else is decoded once and transcoded to PNG.
+
+    Args:
+        data: Encoded image, any object supporting the buffer protocol.
+
+    Returns:
+        tuple[str, str]: The base64 string and the lower case image format.
+    """
+    format = detect_image_format(data)
 
     if format is None:
-        return False
+        data = _transcode(Image.open(io.BytesIO(data)))
+        format = TRANSCODE_FORMAT
+
+    return base64.b64encode(data).decode(), format.lower()
+
+
+def read_image_bytes(value: dict | None) -> bytes | None:
+    """Return the encoded bytes of an undecoded ``datasets.Image`` value.
+
+    Undecoded image cells are ``{"bytes": ..., "path": ...}`` dicts, where the
+    bytes may be missing for images that are stored as local files.
+    """
+    if not value:
+        return None
+
+    if value.get("bytes"):
+        return value["bytes"]
+
+    if value.get("path"):
+        with open(value["path"], "rb") as f:
+            return f.read()
+
+    return None
+
+
+def iter_image_buffers(
+    column: pa.ChunkedArray,
+) -> Iterator[pa.Buffer | bytes | None]:
+    """Yield the encoded bytes of an undecoded image column without copying.
+
+    ``datasets.Image`` columns are stored as ``struct<bytes, path>`` in Arrow.
+    Stored bytes are returned as Arrow buffers that point into the table memory,
+    images that are only referenced by a local path are read from disk.
+    """
+    for chunk in column.chunks:
+        cells = zip(chunk.is_valid(), chunk.field("bytes"), chunk.field("path"))
+        for valid, image, path in cells:
+            if not valid.as_py():
+                yield None
+            elif image.is_valid:
+                yield image.as_buffer()
+            elif path.is_valid:
+                with open(path.as_py(), "rb") as f:
+                    yield f.read()
+            else:
+                yield None
 
-    if format not in ["JPEG", "PNG", "WEBP", "GIF"]:
-        return False
 
-    image.save(buffer, format=format)
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+def total_image_bytes(column: pa.ChunkedArray) -> int:
+    """Sum the encoded byte size of an undecoded image column.
 
-    return img_str, format.lower()
+    Images that are only referenced by a local path count with the size of
+    their file, which is read from the file system without opening it.
+    """
+    total = 0
+    for chunk in column.chunks:
+        images = chunk.field("bytes")
+        total += pc.sum(pc.binary_length(images)).as_py() or 0
+        path_only = pc.and_(chunk.is_valid(), pc.is_null(images))
+        paths = pc.filter(chunk.field("path"), path_only).drop_null()
+        total += sum(os.path.getsize(path) for path in paths.to_pylist())
+    return total
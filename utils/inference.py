@@ -0,0 +1,374 @@
+import copy
+import io
+import json
+import queue
+import threading
+import time
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+from PIL import Image
+from transformers import (
+    AutoModelForImageTextToText,
+    AutoProcessor,
+    DynamicCache,
+    PreTrainedModel,
+    ProcessorMixin,
+)
+
+from utils.prompts import format_data_for_inference
+
+# Inputs with one entry per token, sliced along with the input IDs when the
+# prompt prefix is served from the cache
+SEQUENCE_INPUTS = ("input_ids", "token_type_ids")
+CAPTION_SCHEMA = pa.schema([("id", pa.string()), ("alt_text", pa.string())])
+
+
+def load_model(
+    model_name: str, device: str | None = None, load_in_4bit: bool = False
+) -> tuple[PreTrainedModel, ProcessorMixin]:
+    """Load a vision-language model and its processor for generation.
+
+    Args:
+        model_name: Hugging Face repository or local directory of the model.
+        device: Device to run on, defaults to CUDA when available.
+        load_in_4bit: Whether to quantize the weights to 4 bit with
+            bitsandbytes, which needs CUDA.
+
+    Returns:
+        tuple[PreTrainedModel, ProcessorMixin]: Model in eval mode and processor.
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    processor = AutoProcessor.from_pretrained(model_name)
+
+    if load_in_4bit:
+        from transformers import BitsAndBytesConfig
+
+        model = AutoModelForImageTextToText.from_pretrained(
+            model_name,
+            torch_dtype="auto",
+            quantization_config=BitsAndBytesConfig(load_in_4bit=True),
+            device_map=device,
+        )
+    else:
+        model = AutoModelForImageTextToText.from_pretrained(
+            model_name, torch_dtype="auto"
+        ).to(device)
+
+    model.eval()
+    return model, processor
+
+
+class CaptionRequest(NamedTuple):
+    id: str
+    image: bytes
+    size: tuple[int, int]
+
+
+class _ProducerError(NamedTuple):
+    error: BaseException
+
+
+def bucketed_batches(
+    items: Iterable[Any],
+    key: Callable[[Any], Hashable],
+    max_batch_size: int,
+    max_wait_seconds: float,
+    max_pending: int | None = None,
+) -> Iterator[list[Any]]:
+    """Dynamically batch items with the same key.
+
+    Items are read by a background thread and collected in one bucket per
+    key. A bucket is emitted as soon as it holds ``max_batch_size`` items or
+    its oldest item has waited ``max_wait_seconds``, so a slow source or a
+    rare key never holds back the items already read. Remaining buckets are
+    emitted once the source is exhausted.
+
+    Args:
+        items: Source of the items, consumed in a background thread.
+        key: Bucket of an item, e.g. the image size.
+        max_batch_size: Maximum number of items per batch.
+        max_wait_seconds: Maximum time an item waits for its bucket to fill.
+        max_pending: Maximum number of items read ahead of the consumer,
+            defaults to four batches.
+
+    Yields:
+        list[Any]: Items of one batch, all with the same key.
+    """
+    pending: queue.Queue = queue.Queue(maxsize=max_pending or 4 * max_batch_size)
+    done = object()
+
+    def produce() -> None:
+        try:
+            for item in items:
+                pending.put(item)
+        except BaseException as e:
+            pending.put(_ProducerError(e))
+        pending.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    buckets: dict[Hashable, list[Any]] = {}
+    deadlines: dict[Hashable, float] = {}
+
+    while True:
+        timeout = None
+        if deadlines:
+            timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+
+        try:
+            item = pending.get(timeout=timeout)
+        except queue.Empty:
+            pass
+        else:
+            if item is done:
+                break
+            if isinstance(item, _ProducerError):
+                raise item.error
+
+            bucket_key = key(item)
+            if bucket_key not in buckets:
+                buckets[bucket_key] = []
+                deadlines[bucket_key] = time.monotonic() + max_wait_seconds
+            buckets[bucket_key].append(item)
+
+            if len(buckets[bucket_key]) >= max_batch_size:
+                del deadlines[bucket_key]
+                yield buckets.pop(bucket_key)
+
+        now = time.monotonic()
+        for bucket_key in [k for k, deadline in deadlines.items() if deadline <= now]:
+            del deadlines[bucket_key]
+            yield buckets.pop(bucket_key)
+
+    yield from buckets.values()
+
+
+class CaptionWriter:
+    """Stream captions to a JSONL or Parquet file, chosen by the file suffix.
+
+    JSONL lines are flushed after every batch, Parquet rows are buffered into
+    row groups of ``rows_per_group`` rows.
+    """
+
+    def __init__(self, path: str | Path, rows_per_group: int = 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.rows_per_group = rows_per_group
+        self.rows = 0
+        self._buffer: list[tuple[str, str]] = []
+
+        if self.path.suffix == ".parquet":
+            self._file = None
+            self._parquet = pq.ParquetWriter(self.path, CAPTION_SCHEMA)
+        elif self.path.suffix == ".jsonl":
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._parquet = None
+        else:
+            raise ValueError(f"Unsupported output format: {self.path.suffix}")
+
+    def write(self, ids: list[str], captions: list[str]) -> None:
+        self.rows += len(ids)
+
+        if self._file is not None:
+            for id_, caption in zip(ids, captions):
+                record = {"id": id_, "alt_text": caption}
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            return
+
+        self._buffer.extend(zip(ids, captions))
+        if len(self._buffer) >= self.rows_per_group:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        ids, captions = zip(*self._buffer)
+        self._parquet.write_table(
+            pa.table({"id": ids, "alt_text": captions}, schema=CAPTION_SCHEMA)
+        )
+        self._buffer = []
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        else:
+            self._flush()
+            self._parquet.close()
+
+    def __enter__(self) -> "CaptionWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class AltTextGenerator:
+    """Generate alt text for batches of images with a vision-language model.
+
+    The chat prompt of ``utils.prompts`` is the same for every image up to
+    the first image token. Its key/value cache is computed once and shared by
+    every batch whose rows have identical lengths, which is the case for
+    images of the same size, so only the image and the generation prompt are
+    prefilled per batch. Batches with rows of different lengths are left
+    padded and generated without the prompt cache.
+
+    Args:
+        model: Loaded model, in eval mode.
+        processor: Processor of the model.
+        max_new_tokens: Maximum number of generated tokens per caption.
+        reuse_prompt_cache: Whether to reuse the cache of the prompt prefix.
+    """
+
+    def __init__(
+        self,
+        model: PreTrainedModel,
+        processor: ProcessorMixin,
+        max_new_tokens: int = 64,
+        reuse_prompt_cache: bool = True,
+    ):
+        self.model = model
+        self.processor = processor
+        self.max_new_tokens = max_new_tokens
+        self.reuse_prompt_cache = reuse_prompt_cache
+        # Generation appends to the end of every row
+        processor.tokenizer.padding_side = "left"
+        self.image_token_id = getattr(processor, "image_token_id", None)
+        if self.image_token_id is None:
+            self.image_token_id = getattr(model.config, "image_token_id", None)
+
+        eos_token_id = model.generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = processor.tokenizer.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self.eos_token_ids = torch.tensor(eos_token_id, device=model.device)
+        self.pad_token_id = processor.tokenizer.pad_token_id
+        if self.pad_token_id is None:
+            self.pad_token_id = int(self.eos_token_ids[0])
+
+        self._prompt_caches: dict[tuple[int, ...], DynamicCache] = {}
+        self.cached_batches = 0
+        self.generated_tokens = 0
+
+    @torch.inference_mode()
+    def __call__(self, images: list[bytes]) -> list[str]:
+        messages = [
+            format_data_for_inference(
+                Image.open(io.BytesIO(image)).convert("RGB")
+            )["messages"]
+            for image in images
+        ]
+        inputs = self.processor.apply_chat_template(
+            messages,
+            add_generation_prompt=True,
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt",
+            padding=True,
+        ).to(self.model.device)
+        inputs = {
+            name: value.to(self.model.dtype) if value.is_floating_point() else value
+            for name, value in inputs.items()
+        }
+
+        prefix_length = self._prefix_length(inputs)
+        if prefix_length:
+            tokens = self._generate_from_prefix(inputs, prefix_length)
+            self.cached_batches += 1
+        else:
+            tokens = self.model.generate(
+                **inputs, max_new_tokens=self.max_new_tokens, do_sample=False
+            )[:, inputs["input_ids"].shape[1] :]
+
+        self.generated_tokens += self._count_tokens(tokens)
+        captions = self.processor.batch_decode(tokens, skip_special_tokens=True)
+        return [caption.strip() for caption in captions]
+
+    def _count_tokens(self, tokens: torch.Tensor) -> int:
+        """Number of generated tokens up to and including the first EOS per row."""
+        is_eos = torch.isin(tokens, self.eos_token_ids).int()
+        after_eos = is_eos.cumsum(dim=1) - is_eos
+        return int((after_eos == 0).sum())
+
+    def _prefix_length(self, inputs: dict[str, torch.Tensor]) -> int:
+        """Length of the prompt prefix shared by all rows, 0 if it can't be reused."""
+        input_ids = inputs["input_ids"]
+        if (
+            not self.reuse_prompt_cache
+            or self.image_token_id is None
+            or not inputs["attention_mask"].all()
+        ):
+            return 0
+
+        image_positions = (input_ids[0] == self.image_token_id).nonzero()
+        if len(image_positions) == 0:
+            return 0
+
+        prefix_length = int(image_positions[0])
+        if not (input_ids[:, :prefix_length] == input_ids[:1, :prefix_length]).all():
+            return 0
+        return prefix_length
+
+    def _prompt_cache(self, prefix_ids: torch.Tensor) -> DynamicCache:
+        key = tuple(prefix_ids.tolist())
+        if key not in self._prompt_caches:
+            outputs = self.model(
+                input_ids=prefix_ids[None],
+                past_key_values=DynamicCache(),
+                use_cache=True,
+            )
+            self._prompt_caches[key] = outputs.past_key_values
+        return self._prompt_caches[key]
+
+    def _generate_from_prefix(
+        self, inputs: dict[str, torch.Tensor], prefix_length: int
+    ) -> torch.Tensor:
+        """Greedy decoding that starts from a copy of the prompt prefix cache."""
+        input_ids = inputs["input_ids"]
+        batch_size, length = input_ids.shape
+        device = input_ids.device
+
+        cache = copy.deepcopy(self._prompt_cache(input_ids[0, :prefix_length]))
+        cache.batch_repeat_interleave(batch_size)
+        attention_mask = inputs["attention_mask"]
+        model_inputs = {
+            name: value[:, prefix_length:] if name in SEQUENCE_INPUTS else value
+            for name, value in inputs.items()
+            if name != "attention_mask"
+        }
+
+        outputs = self.model(
+            **model_inputs,
+            attention_mask=attention_mask,
+            past_key_values=cache,
+            cache_position=torch.arange(prefix_length, length, device=device),
+            use_cache=True,
+        )
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        tokens = []
+
+        for step in range(self.max_new_tokens):
+            next_tokens = outputs.logits[:, -1].argmax(dim=-1)
+            next_tokens = next_tokens.masked_fill(finished, self.pad_token_id)
+            tokens.append(next_tokens)
+            finished |= torch.isin(next_tokens, self.eos_token_ids)
+            if finished.all() or step == self.max_new_tokens - 1:
+                break
+
+            attention_mask = torch.cat(
+                [attention_mask, attention_mask.new_ones((batch_size, 1))], dim=1
+            )
+            outputs = self.model(
+                input_ids=next_tokens[:, None],
+                attention_mask=attention_mask,
+                past_key_values=cache,
+                cache_position=torch.tensor([length + step], device=device),
+                use_cache=True,
+            )
+
+        return torch.stack(tokens, dim=1)
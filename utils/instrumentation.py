@@ -0,0 +1,145 @@
+import sys
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, TypeVar
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+T = TypeVar("T")
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process or of its largest child process.
+
+    Children are included so that the peak of process pool workers counts.
+    Uses ``resource`` where available and psutil's peak working set on
+    Windows, 0 if neither is available.
+    """
+    if resource is not None:
+        peak = max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    try:
+        import psutil
+    except ImportError:
+        return 0
+    return getattr(psutil.Process().memory_info(), "peak_wset", 0)
+
+
+class _Stage:
+    __slots__ = ("seconds", "calls", "rows", "bytes")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.bytes = 0
+
+
+class StageTimer:
+    """Accumulate time, rows and bytes of named pipeline stages.
+
+    Stages are timed with ``stage`` or, for lazily produced items, with
+    ``timed``. Stages may nest, the time of a nested stage is only counted
+    for the nested stage, so the seconds of all stages add up to the total
+    instrumented time. Nesting is tracked per thread, stages of concurrent
+    threads are summed.
+
+    ``metadata`` returns the stages with their throughput and the peak RSS,
+    ready to be logged as ZenML step metadata.
+    """
+
+    def __init__(self):
+        self._stages: dict[str, _Stage] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list[float]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record(
+        self, name: str, seconds: float, rows: int, bytes: int, calls: int = 1
+    ) -> None:
+        with self._lock:
+            stage = self._stages.setdefault(name, _Stage())
+            stage.seconds += seconds
+            stage.calls += calls
+            stage.rows += rows
+            stage.bytes += bytes
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0, bytes: int = 0) -> Iterator[None]:
+        """Time the block as one call of stage ``name``."""
+        stack = self._stack()
+        # Time spent in nested stages, subtracted from this one
+        stack.append(0.0)
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._record(name, elapsed - nested, rows, bytes)
+
+    def timed(
+        self,
+        name: str,
+        items: Iterable[T],
+        rows: Callable[[T], int] | None = None,
+        bytes: Callable[[T], int] | None = None,
+    ) -> Iterator[T]:
+        """Yield ``items``, timing the production of every item as stage ``name``.
+
+        Args:
+            name: Stage name.
+            items: Items, typically a lazy iterator doing the work of the stage.
+            rows: Number of rows of an item, one row per item by default.
+            bytes: Number of bytes of an item.
+        """
+        iterator = iter(items)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            self.add(name, rows(item) if rows else 1, bytes(item) if bytes else 0)
+            yield item
+
+    def add(self, name: str, rows: int = 0, bytes: int = 0) -> None:
+        """Count rows and bytes towards stage ``name`` without timing."""
+        self._record(name, 0.0, rows, bytes, calls=0)
+
+    def metadata(self) -> dict[str, Any]:
+        stages = {}
+        with self._lock:
+            for name, stage in self._stages.items():
+                stages[name] = {
+                    "seconds": round(stage.seconds, 4),
+                    "calls": stage.calls,
+                    "rows": stage.rows,
+                    "bytes": stage.bytes,
+                    "rows_per_second": (
+                        round(stage.rows / stage.seconds, 2) if stage.seconds else 0
+                    ),
+                    "bytes_per_second": (
+                        round(stage.bytes / stage.seconds) if stage.seconds else 0
+                    ),
+                }
+        return {
+            "stages": stages,
+            "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+        }
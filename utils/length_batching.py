@@ -0,0 +1,156 @@
+from collections.abc import Iterator, Sequence
+
+import numpy as np
+from torch.utils.data import Dataset as TorchDataset, Sampler, Subset
+
+
+def length_grouped_batches(
+    lengths: np.ndarray,
+    max_tokens: int,
+    max_batch_size: int | None = None,
+    seed: int = 0,
+    window: int | None = None,
+) -> list[list[int]]:
+    """Group samples of similar length into batches under a padded token budget.
+
+    Samples are shuffled, then sorted by length inside windows of ``window``
+    samples and cut greedily into batches whose padded size, batch size times
+    longest sample, stays within ``max_tokens``. The batch order is shuffled
+    again, so batches are random across epochs while padding stays minimal.
+
+    Args:
+        lengths: Token length of every sample.
+        max_tokens: Maximum padded tokens per batch. A single sample longer
+            than the budget gets a batch of its own.
+        max_batch_size: Optional cap on the number of samples per batch.
+        seed: Seed of the shuffles.
+        window: Number of samples sorted together, defaults to all samples.
+
+    Returns:
+        list[list[int]]: Sample indices of every batch.
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(lengths))
+    window = window or max(len(order), 1)
+    batches = []
+
+    for start in range(0, len(order), window):
+        chunk = order[start : start + window]
+        chunk = chunk[np.argsort(lengths[chunk], kind="stable")]
+        batch: list[int] = []
+        longest = 0
+
+        for idx in chunk:
+            candidate = max(longest, int(lengths[idx]))
+            full = max_batch_size is not None and len(batch) >= max_batch_size
+            if batch and (full or candidate * (len(batch) + 1) > max_tokens):
+                batches.append(batch)
+                batch, candidate = [], int(lengths[idx])
+            batch.append(int(idx))
+            longest = candidate
+
+        if batch:
+            batches.append(batch)
+
+    rng.shuffle(batches)
+    return batches
+
+
+def drop_long_samples(
+    dataset: TorchDataset, lengths: np.ndarray, max_length: int
+) -> tuple[TorchDataset, np.ndarray]:
+    """Drop samples longer than ``max_length`` tokens.
+
+    Samples are dropped rather than truncated, a truncated sample could lose
+    part of its image tokens or its whole caption.
+
+    Returns:
+        tuple[TorchDataset, np.ndarray]: The remaining samples and their lengths.
+    """
+    keep = np.flatnonzero(lengths <= max_length)
+    if len(keep) == len(lengths):
+        return dataset, lengths
+    return Subset(dataset, keep.tolist()), lengths[keep]
+
+
+def pack_sequences(lengths: np.ndarray, max_length: int) -> list[list[int]]:
+    """Pack samples into sequences of at most ``max_length`` tokens.
+
+    Uses first-fit decreasing: the longest samples are placed first, each
+    into the first pack with enough room left.
+
+    Returns:
+        list[list[int]]: Sample indices of every pack.
+    """
+    packs: list[list[int]] = []
+    remaining: list[int] = []
+
+    for idx in np.argsort(-lengths, kind="stable"):
+        length = int(lengths[idx])
+        for pack, room in enumerate(remaining):
+            if length <= room:
+                packs[pack].append(int(idx))
+                remaining[pack] -= length
+                break
+        else:
+            packs.append([int(idx)])
+            remaining.append(max_length - length)
+
+    return packs
+
+
+class PackedDataset(TorchDataset):
+    """Dataset whose items are packs, lists of samples of the wrapped dataset."""
+
+    def __init__(self, dataset: TorchDataset, packs: Sequence[list[int]]):
+        self.dataset = dataset
+        self.packs = packs
+
+    def __len__(self) -> int:
+        return len(self.packs)
+
+    def __getitem__(self, idx: int) -> list:
+        return [self.dataset[i] for i in self.packs[idx]]
+
+
+class TokenBudgetBatchSampler(Sampler[list[int]]):
+    """Batch sampler yielding the batches of ``length_grouped_batches``.
+
+    A new grouping is drawn for every epoch, seeded with ``seed + epoch``.
+    """
+
+    def __init__(
+        self,
+        lengths: np.ndarray,
+        max_tokens: int,
+        max_batch_size: int | None = None,
+        seed: int = 0,
+        window: int | None = None,
+    ):
+        self.lengths = np.asarray(lengths)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.seed = seed
+        self.window = window
+        self.epoch = 0
+        self._batches = self._group()
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self._batches = self._group()
+
+    def _group(self) -> list[list[int]]:
+        return length_grouped_batches(
+            self.lengths,
+            self.max_tokens,
+            max_batch_size=self.max_batch_size,
+            seed=self.seed + self.epoch,
+            window=self.window,
+        )
+
+    def __iter__(self) -> Iterator[list[int]]:
+        yield from self._batches
+        self.set_epoch(self.epoch + 1)
+
+    def __len__(self) -> int:
+        return len(self._batches)
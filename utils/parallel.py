@@ -0,0 +1,46 @@
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_map(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    num_workers: int = 1,
+    max_pending: int | None = None,
+) -> Iterator[R]:
+    """Apply ``fn`` to ``items`` in a process pool and yield results in input order.
+
+    Unlike ``Executor.map`` the input iterable is consumed lazily: at most
+    ``max_pending`` items (defaults to twice the worker count) are in flight at
+    any time, which keeps memory bounded for large or generated inputs. With a
+    single worker everything runs in the calling process.
+
+    Args:
+        fn: Picklable function applied to every item.
+        items: Items to process.
+        num_workers: Number of worker processes.
+        max_pending: Maximum number of submitted but not yet yielded items.
+
+    Yields:
+        The results of ``fn`` in the order of ``items``.
+    """
+    if num_workers <= 1:
+        yield from map(fn, items)
+        return
+
+    max_pending = max_pending or 2 * num_workers
+    pending: deque[Future[R]] = deque()
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
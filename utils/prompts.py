@@ -12,7 +12,8 @@ Avoid phrases like "image of" unless essential. Provide only the alt text withou
 """
 
 
-def format_data_for_training(sample, image_row = "image", alt_text_row = "alt_text"):
+def format_data_for_inference(image):
+    """Prompt messages for a single image, without the assistant answer."""
     return {
         "messages": [
             {
@@ -28,13 +29,38 @@ def format_data_for_training(sample, image_row = "image", alt_text_row = "alt_te
                     },
                     {
                         "type": "image",
-                        "image": sample[image_row],
+                        "image": image,
                     },
                 ],
             },
+        ],
+    }
+
+
+def format_data_for_training(sample, image_row = "image", alt_text_row = "alt_text"):
+    return {
+        "messages": [
+            *format_data_for_inference(sample[image_row])["messages"],
             {
                 "role": "assistant",
                 "content": [{"type": "text", "text": sample[alt_text_row]}],
             },
         ],
     }
+
+
+def format_batch_for_training(batch, image_row="image", alt_text_row="alt_text"):
+    """Batched variant of ``format_data_for_training``.
+
+    Meant as an on-the-fly transform, e.g. ``Dataset.with_transform`` or a
+    batched ``IterableDataset.map``, so conversations are only built for the
+    rows of the batch currently requested instead of for the whole dataset.
+    """
+    return {
+        "messages": [
+            format_data_for_training(
+                {image_row: image, alt_text_row: alt_text}, image_row, alt_text_row
+            )["messages"]
+            for image, alt_text in zip(batch[image_row], batch[alt_text_row])
+        ]
+    }
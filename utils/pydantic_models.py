@@ -2,10 +2,22 @@ from typing import List, Literal
 from pydantic import BaseModel
 
 
+class BatchFile(BaseModel):
+    path: str
+    requests: int = 0
+    bytes: int = 0
+    estimated_tokens: int = 0
+
+
+class BatchFileList(BaseModel):
+    files: List[BatchFile]
+
+
 class BatchFileTask(BaseModel):
     file_id: str
     path: str
     status: Literal[
+        "pending",
         "validating",
         "failed",
         "in_progress",
@@ -17,6 +29,13 @@ class BatchFileTask(BaseModel):
     ] = "validating"
     result_file_id: str | None = None
     batch_id: str | None = None
+    estimated_tokens: int | None = None
+    result_path: str | None = None
+    error_file_id: str | None = None
+    error_path: str | None = None
+    # Retry tasks only hold the failed requests of the task they retry
+    attempt: int = 0
+    retry_of: str | None = None
 
 
 class BatchFileTaskList(BaseModel):
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``per_minute`` units per minute.
+
+    The bucket holds at most ``capacity`` units, a full minute's worth by
+    default, which bounds the burst after an idle period.
+    """
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.available = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available, 0 if they already are."""
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.available) / self.rate)
+
+    def take(self, amount: float) -> None:
+        """Take units without waiting, the bucket may go into debt."""
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Async limiter for requests per minute and tokens per minute.
+
+    ``acquire`` waits until both buckets can serve the request. Waiters are
+    served one at a time in arrival order, so a large request is not starved
+    by a stream of small ones. Once the actual token usage of a request is
+    known, ``record_usage`` corrects the estimate it was admitted with.
+
+    Args:
+        requests_per_minute: Request limit, None for no limit.
+        tokens_per_minute: Token limit, None for no limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ):
+        self.requests = None
+        self.tokens = None
+        if requests_per_minute:
+            self.requests = TokenBucket(requests_per_minute)
+        if tokens_per_minute:
+            self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 0) -> None:
+        async with self._lock:
+            while True:
+                delay = max(
+                    self.requests.wait_time(1) if self.requests else 0.0,
+                    self.tokens.wait_time(tokens) if self.tokens else 0.0,
+                )
+                if delay == 0:
+                    break
+                await asyncio.sleep(delay)
+
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        if self.tokens:
+            self.tokens.take(actual_tokens - estimated_tokens)
@@ -0,0 +1,151 @@
+import asyncio
+import json
+from pathlib import Path
+
+import openai
+from openai import AsyncOpenAI
+from zenml.logger import get_logger
+
+from utils.batch_files import encode_jsonl_line
+from utils.rate_limit import RateLimiter
+from utils.retry import async_retry_with_backoff
+
+logger = get_logger(__name__)
+
+
+def _result_line(custom_id: str, status_code: int | None, body, error) -> bytes:
+    """Output line in the format of the Batch API."""
+    response = None
+    if status_code is not None:
+        response = {"status_code": status_code, "body": body}
+    return encode_jsonl_line(
+        {"custom_id": custom_id, "response": response, "error": error}
+    )
+
+
+class RealtimeRunner:
+    """Send the requests of batch input files to the API directly.
+
+    Each request of a batch input file is sent to its endpoint as soon as the
+    rate limiter admits it, at most ``max_concurrent`` at a time. Rate limit,
+    server and connection errors are retried with exponential backoff.
+    Results are written in the Batch API output format, successes to the
+    output file and failures to the error file, so they can be consumed and
+    retried like downloaded batch results.
+
+    Args:
+        client: Async OpenAI client, its connection pool should allow
+            ``max_concurrent`` connections.
+        limiter: Requests and tokens per minute limiter.
+        max_concurrent: Maximum number of requests in flight.
+        max_retries: Retries per request for transient errors.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        limiter: RateLimiter,
+        max_concurrent: int = 32,
+        max_retries: int = 5,
+    ):
+        self.client = client
+        self.limiter = limiter
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.requests = 0
+        self.failed = 0
+
+    async def run_file(
+        self,
+        input_path: Path,
+        output_path: Path,
+        error_path: Path,
+        estimated_tokens: int = 0,
+    ) -> tuple[int, int]:
+        """Process all requests of ``input_path`` into ``output_path``.
+
+        Results are written to ``.part`` files that are renamed once every
+        request finished, the output file last, so an existing ``output_path``
+        is always complete. The error file is only kept if a request failed.
+
+        Args:
+            input_path: Batch input file.
+            output_path: Output file for successful responses.
+            error_path: Error file for failed requests.
+            estimated_tokens: Estimated input tokens of the whole file, spread
+                evenly over its requests for the token limit.
+
+        Returns:
+            tuple[int, int]: Number of successful and of failed requests.
+        """
+        with open(input_path, "rb") as f:
+            lines = sum(1 for line in f if line.strip())
+        tokens_per_request = estimated_tokens // max(lines, 1)
+
+        tmp_path = output_path.with_name(f"{output_path.name}.part")
+        tmp_error_path = error_path.with_name(f"{error_path.name}.part")
+        slots = asyncio.Semaphore(self.max_concurrent)
+        pending = set()
+        counts = {True: 0, False: 0}
+
+        with (
+            open(input_path, "rb") as source,
+            open(tmp_path, "wb") as output,
+            open(tmp_error_path, "wb") as errors,
+        ):
+
+            async def run(request: dict) -> None:
+                try:
+                    succeeded, line = await self._send(request, tokens_per_request)
+                    (output if succeeded else errors).write(line)
+                    counts[succeeded] += 1
+                finally:
+                    slots.release()
+
+            for line in source:
+                if not line.strip():
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(run(json.loads(line)))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            await asyncio.gather(*pending)
+
+        if counts[False]:
+            tmp_error_path.replace(error_path)
+        else:
+            tmp_error_path.unlink()
+            error_path.unlink(missing_ok=True)
+        tmp_path.replace(output_path)
+        return counts[True], counts[False]
+
+    async def _send(self, request: dict, estimated_tokens: int) -> tuple[bool, bytes]:
+        custom_id = request["custom_id"]
+        body = request["body"]
+        path = request["url"].removeprefix("/v1")
+
+        async def post():
+            await self.limiter.acquire(estimated_tokens)
+            return await self.client.post(path, body=body, cast_to=object)
+
+        self.requests += 1
+        try:
+            response = await async_retry_with_backoff(
+                post, max_retries=self.max_retries
+            )
+        except openai.APIStatusError as e:
+            self.failed += 1
+            logger.warning(f"Request {custom_id} failed with {e.status_code}.")
+            return False, _result_line(custom_id, e.status_code, e.body, None)
+        except openai.APIError as e:
+            self.failed += 1
+            logger.warning(f"Request {custom_id} failed: {e}")
+            return False, _result_line(
+                custom_id, None, None, {"code": type(e).__name__, "message": str(e)}
+            )
+
+        usage = response.get("usage") or {}
+        if usage.get("prompt_tokens") is not None:
+            self.limiter.record_usage(estimated_tokens, usage["prompt_tokens"])
+        return True, _result_line(custom_id, 200, response, None)
@@ -0,0 +1,134 @@
+import hashlib
+import sqlite3
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+# SQLite limits the number of parameters of a single statement
+_QUERY_CHUNK_SIZE = 500
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+class ResponseCache:
+    """Persistent cache of generated alt texts in a local SQLite database.
+
+    Responses are keyed by model, prompt hash and image content hash, so a
+    caption is reused whenever the same image is sent with the same prompt to
+    the same model again. With ``max_bytes`` the least recently used entries
+    are evicted once the stored alt texts exceed that size. Lookups are
+    counted in ``hits`` and ``misses``.
+
+    Args:
+        path: Path of the SQLite database, created if missing.
+        max_bytes: Maximum total size of the stored alt texts, None for no
+            limit.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int | None = None):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                alt_text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, prompt_hash, image_hash)
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_used
+                ON responses (last_used);
+            """
+        )
+
+    def __enter__(self) -> "ResponseCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_many(
+        self, model: str, prompt_hash: str, image_hashes: Iterable[str]
+    ) -> dict[str, str]:
+        """Return the cached alt text of every hit and mark hits as used."""
+        image_hashes = list(dict.fromkeys(image_hashes))
+        found = {}
+
+        with self._connection:
+            for start in range(0, len(image_hashes), _QUERY_CHUNK_SIZE):
+                chunk = image_hashes[start : start + _QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT image_hash, alt_text FROM responses "
+                    f"WHERE model = ? AND prompt_hash = ? "
+                    f"AND image_hash IN ({placeholders})",
+                    [model, prompt_hash, *chunk],
+                ).fetchall()
+                found.update(rows)
+                self._connection.execute(
+                    f"UPDATE responses SET last_used = ? "
+                    f"WHERE model = ? AND prompt_hash = ? "
+                    f"AND image_hash IN ({placeholders})",
+                    [time.time(), model, prompt_hash, *chunk],
+                )
+
+        self.hits += len(found)
+        self.misses += len(image_hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, prompt_hash: str, alt_texts: dict[str, str]) -> None:
+        """Store alt texts by image hash, then evict down to ``max_bytes``."""
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (model, prompt_hash, image_hash, alt_text, len(alt_text), now)
+                    for image_hash, alt_text in alt_texts.items()
+                ),
+            )
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least recently used entries beyond ``max_bytes``."""
+        if self.max_bytes is None:
+            return 0
+
+        with self._connection:
+            cursor = self._connection.execute(
+                """
+                DELETE FROM responses WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, SUM(size) OVER (
+                            ORDER BY last_used DESC, rowid DESC
+                        ) AS total
+                        FROM responses
+                    ) WHERE total > ?
+                )
+                """,
+                [self.max_bytes],
+            )
+        return cursor.rowcount
+
+    def size(self) -> tuple[int, int]:
+        """Number of entries and total size of the stored alt texts."""
+        count, total = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        return count, total
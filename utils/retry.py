@@ -0,0 +1,63 @@
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float = 60.0) -> float:
+    """Exponential backoff with full jitter for the given zero-based attempt."""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def retry_with_backoff(
+    fn: Callable[[], T],
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    retry_on: tuple[type[Exception], ...] = RETRYABLE_ERRORS,
+) -> T:
+    """Call ``fn`` and retry transient errors with exponential backoff.
+
+    Args:
+        fn: Function to call without arguments.
+        max_retries: Number of retries after the first attempt.
+        base_delay: Delay in seconds before the first retry.
+        retry_on: Exception types that trigger a retry.
+
+    Returns:
+        The return value of ``fn``.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except retry_on:
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff_delay(attempt, base_delay))
+
+
+async def async_retry_with_backoff(
+    fn: Callable[[], Awaitable[T]],
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    retry_on: tuple[type[Exception], ...] = RETRYABLE_ERRORS,
+) -> T:
+    """Async variant of ``retry_with_backoff``."""
+    for attempt in range(max_retries + 1):
+        try:
+            return await fn()
+        except retry_on:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt, base_delay))
@@ -0,0 +1,49 @@
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from utils.clients import get_zenml_client
+
+if TYPE_CHECKING:
+    from zenml.models import PipelineRunResponse
+
+
+def shard_tag(shard_index: int, num_shards: int) -> str:
+    """Tag of the pipeline runs that prepared one shard of the data."""
+    return f"shard-{shard_index:05d}-of-{num_shards:05d}"
+
+
+def shard_directory(path: Path, shard_index: int, num_shards: int) -> Path:
+    """Directory of a shard's batch files, ``path`` itself when unsharded."""
+    if num_shards == 1:
+        return path
+    return path / shard_tag(shard_index, num_shards)
+
+
+def latest_shard_runs(
+    pipeline_name: str, num_shards: int = 1
+) -> list["PipelineRunResponse"]:
+    """Latest successful run of a pipeline for every shard, in shard order.
+
+    Sharded runs are found by their ``shard_tag``. Without sharding this is
+    the pipeline's last successful run.
+    """
+    client = get_zenml_client()
+    if num_shards == 1:
+        return [client.get_pipeline(pipeline_name).last_successful_run]
+
+    runs = []
+    for shard_index in range(num_shards):
+        page = client.list_pipeline_runs(
+            pipeline_name=pipeline_name,
+            tag=shard_tag(shard_index, num_shards),
+            status="completed",
+            sort_by="desc:created",
+            size=1,
+        )
+        if not page.items:
+            raise RuntimeError(
+                f"No successful run of {pipeline_name} for shard {shard_index} "
+                f"of {num_shards}."
+            )
+        runs.append(page.items[0])
+    return runs
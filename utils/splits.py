@@ -0,0 +1,82 @@
+import hashlib
+
+import numpy as np
+from datasets import Dataset, DatasetDict, Image
+
+from utils.images import iter_image_buffers
+
+HASH_SCALE = 2.0**64
+
+
+def stable_row_positions(
+    dataset: Dataset, column: str, batch_size: int = 1000
+) -> np.ndarray:
+    """Map every row to a stable position in [0, 1) from a hash of ``column``.
+
+    Image columns are hashed by their encoded bytes, other columns by their
+    string value. Hashing is a loop with one blake2b call per row, reading the
+    image bytes as zero-copy Arrow buffers. A row's position only depends on
+    its own content, so it does not change when rows are added, removed or
+    reordered.
+
+    Returns:
+        np.ndarray: Position of every row, in row order.
+    """
+    digests = bytearray()
+    is_image = isinstance(dataset.features[column], Image)
+
+    for table in dataset.with_format("arrow").iter(batch_size=batch_size):
+        if is_image:
+            values = iter_image_buffers(table[column])
+        else:
+            values = (
+                b"" if value is None else str(value).encode()
+                for value in table[column].to_pylist()
+            )
+        for value in values:
+            digests += hashlib.blake2b(value or b"", digest_size=8).digest()
+
+    return np.frombuffer(bytes(digests), dtype=">u8") / HASH_SCALE
+
+
+def hash_split(
+    dataset: Dataset,
+    column: str,
+    test_fraction: float,
+    validation_fraction: float,
+) -> DatasetDict:
+    """Split a dataset into train, validation and test by a stable row hash.
+
+    Rows are hashed one by one in ``stable_row_positions``, then assigned in
+    a single vectorized pass over the positions: rows below ``test_fraction``
+    go to test, the next ``validation_fraction`` to validation and the rest to
+    train. Every split is written in dataset order into its own contiguous
+    table with ``flatten_indices``, so no split keeps an indices mapping over
+    the full dataset. Since the assignment only depends on the row itself,
+    appended rows never move existing rows to another split, and duplicates
+    of the same content always end up in the same split.
+
+    Args:
+        dataset: Dataset to split.
+        column: Column to hash, e.g. the image or an ID column.
+        test_fraction: Expected fraction of rows in the test split.
+        validation_fraction: Expected fraction of rows in the validation split.
+
+    Returns:
+        DatasetDict: Train, test and validation splits.
+    """
+    if test_fraction < 0 or validation_fraction < 0:
+        raise ValueError("Split fractions must not be negative.")
+    if test_fraction + validation_fraction >= 1:
+        raise ValueError("Test and validation fractions must sum to less than 1.")
+
+    positions = stable_row_positions(dataset, column)
+    bounds = np.array([test_fraction, test_fraction + validation_fraction])
+    labels = np.searchsorted(bounds, positions, side="right")
+
+    return DatasetDict(
+        {
+            name: dataset.select(np.flatnonzero(labels == label)).flatten_indices()
+            for label, name in [(2, "train"), (0, "test"), (1, "validation")]
+        }
+    )
@@ -0,0 +1,172 @@
+import json
+import sqlite3
+from pathlib import Path
+
+from utils.pydantic_models import BatchFileTask
+
+# Fields of a task that change while its batch runs
+BATCH_STATE_FIELDS = (
+    "status",
+    "batch_id",
+    "result_file_id",
+    "result_path",
+    "error_file_id",
+    "error_path",
+)
+
+
+class TaskStore:
+    """Durable local state of batch tasks in a SQLite database.
+
+    Tasks are stored per data preparation shard, see ``shard_tag``, in the
+    order they were added. Every state change is written in its own
+    transaction, so after a crash the tasks resume from their last recorded
+    status, batch ID and result paths. The store also records where the
+    source data of every shard was loaded from, so it can be reloaded without
+    deserializing pipeline artifacts.
+
+    The store is meant for a single host. It uses a rollback journal rather
+    than WAL, whose shared memory index does not work on network file
+    systems, and waits up to ``timeout`` seconds for locks held by other
+    processes. Sharded workers on several machines can share a store on the
+    batch path only if that storage supports file locks.
+
+    Args:
+        path: Path of the SQLite database, created if missing.
+        timeout: Seconds to wait for a lock held by another process.
+    """
+
+    def __init__(self, path: str | Path, timeout: float = 30.0):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=timeout)
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = DELETE;
+            CREATE TABLE IF NOT EXISTS tasks (
+                file_id TEXT PRIMARY KEY,
+                shard TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                batch_id TEXT,
+                task TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_shard ON tasks (shard, position);
+            CREATE TABLE IF NOT EXISTS sources (
+                shard TEXT PRIMARY KEY,
+                source TEXT NOT NULL
+            );
+            """
+        )
+
+    def __enter__(self) -> "TaskStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def replace_shard(self, shard: str, tasks: list[BatchFileTask]) -> None:
+        """Replace the tasks of a shard, e.g. after its data was prepared again.
+
+        Uploads of unchanged files reuse their file ID, see ``UploadManifest``.
+        Such tasks keep their recorded batch state, so their batches are not
+        submitted again, and so do the recorded retries of them. All other
+        tasks of the shard are removed.
+        """
+        recorded = {task.file_id: task for task in self.tasks([shard]) or []}
+        kept = [
+            task.model_copy(
+                update={
+                    field: getattr(recorded[task.file_id], field)
+                    for field in BATCH_STATE_FIELDS
+                }
+            )
+            if task.file_id in recorded
+            else task
+            for task in tasks
+        ]
+        file_ids = {task.file_id for task in kept}
+        # Retries are recorded after the task they retry
+        for task in recorded.values():
+            if task.retry_of in file_ids and task.file_id not in file_ids:
+                kept.append(task)
+                file_ids.add(task.file_id)
+
+        with self._connection:
+            self._connection.execute("DELETE FROM tasks WHERE shard = ?", [shard])
+            self._insert(shard, kept, 0)
+
+    def add(self, shard: str, tasks: list[BatchFileTask]) -> None:
+        """Append tasks to a shard, e.g. retries of its failed requests."""
+        with self._connection:
+            (position,) = self._connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM tasks WHERE shard = ?",
+                [shard],
+            ).fetchone()
+            self._insert(shard, tasks, position)
+
+    def _insert(self, shard: str, tasks: list[BatchFileTask], position: int) -> None:
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    task.file_id,
+                    shard,
+                    position + offset,
+                    task.status,
+                    task.batch_id,
+                    task.model_dump_json(),
+                )
+                for offset, task in enumerate(tasks)
+            ),
+        )
+
+    def update(self, task: BatchFileTask) -> None:
+        """Record the current state of a stored task."""
+        with self._connection:
+            self._connection.execute(
+                "UPDATE tasks SET status = ?, batch_id = ?, task = ? WHERE file_id = ?",
+                [task.status, task.batch_id, task.model_dump_json(), task.file_id],
+            )
+
+    def shard_of(self, file_id: str) -> str | None:
+        row = self._connection.execute(
+            "SELECT shard FROM tasks WHERE file_id = ?", [file_id]
+        ).fetchone()
+        return row[0] if row else None
+
+    def tasks(self, shards: list[str]) -> list[BatchFileTask] | None:
+        """Tasks of the given shards in shard and insertion order.
+
+        Returns None if any of the shards has no tasks in the store.
+        """
+        tasks = []
+        for shard in shards:
+            rows = self._connection.execute(
+                "SELECT task FROM tasks WHERE shard = ? ORDER BY position", [shard]
+            ).fetchall()
+            if not rows:
+                return None
+            tasks.extend(BatchFileTask.model_validate_json(row[0]) for row in rows)
+        return tasks
+
+    def record_source(self, shard: str, source: dict) -> None:
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?)",
+                [shard, json.dumps(source)],
+            )
+
+    def sources(self, shards: list[str]) -> list[dict] | None:
+        """Recorded sources of the given shards, None if any is missing."""
+        sources = []
+        for shard in shards:
+            row = self._connection.execute(
+                "SELECT source FROM sources WHERE shard = ?", [shard]
+            ).fetchone()
+            if row is None:
+                return None
+            sources.append(json.loads(row[0]))
+        return sources
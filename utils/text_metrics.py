@@ -0,0 +1,116 @@
+import re
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+
+
+def _token_ids(texts: list[str]) -> tuple[np.ndarray, np.ndarray, int]:
+    """Lowercased word IDs of all texts, concatenated, and the word counts."""
+    tokens = [_WORD.findall(text.lower()) for text in texts]
+    lengths = np.array([len(words) for words in tokens], dtype=np.int64)
+    flat = np.array([word for words in tokens for word in words], dtype=str)
+    vocabulary, ids = np.unique(flat, return_inverse=True)
+    return ids.astype(np.int64), lengths, len(vocabulary)
+
+
+def _ngram_keys(
+    ids: np.ndarray, lengths: np.ndarray, n: int, vocabulary_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Text index and key of every n-gram that lies within a single text."""
+    offsets = np.cumsum(lengths) - lengths
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(len(ids)) - np.repeat(offsets, lengths)
+    valid = positions <= np.repeat(lengths, lengths) - n
+
+    padded = np.concatenate([ids, np.zeros(n - 1, dtype=np.int64)])
+    keys = np.zeros(len(ids), dtype=np.int64)
+    for k in range(n):
+        keys = keys * vocabulary_size + padded[k : k + len(ids)]
+    return rows[valid], keys[valid]
+
+
+def ngram_f1(predictions: list[str], references: list[str], n: int = 1) -> np.ndarray:
+    """F1 of the clipped n-gram overlap of every prediction and reference pair.
+
+    Texts are lowercased and split into words. All pairs are scored at once
+    by counting (pair, n-gram) keys with numpy, so there is no Python loop
+    over n-grams. A pair where either side has no n-grams scores 0.
+
+    Returns:
+        np.ndarray: F1 score of every pair.
+    """
+    if len(predictions) != len(references):
+        raise ValueError("Predictions and references must have the same length.")
+
+    count = len(predictions)
+    if count == 0:
+        return np.zeros(0)
+
+    ids, lengths, vocabulary_size = _token_ids(predictions + references)
+    rows, keys = _ngram_keys(ids, lengths, n, max(vocabulary_size, 1))
+    is_reference = rows >= count
+    rows = rows % count
+
+    # Renumber the n-grams densely so that (pair, n-gram) fits into one key
+    ngrams, ngram_ids = np.unique(keys, return_inverse=True)
+    stride = max(len(ngrams), 1)
+    pair_keys = rows * stride + ngram_ids
+
+    predicted, predicted_counts = np.unique(
+        pair_keys[~is_reference], return_counts=True
+    )
+    referenced, referenced_counts = np.unique(
+        pair_keys[is_reference], return_counts=True
+    )
+    common, predicted_index, referenced_index = np.intersect1d(
+        predicted, referenced, assume_unique=True, return_indices=True
+    )
+    overlap = np.bincount(
+        common // stride,
+        weights=np.minimum(
+            predicted_counts[predicted_index], referenced_counts[referenced_index]
+        ),
+        minlength=count,
+    )
+
+    predicted_total = np.bincount(rows[~is_reference], minlength=count)
+    referenced_total = np.bincount(rows[is_reference], minlength=count)
+    precision = np.divide(
+        overlap, predicted_total, out=np.zeros(count), where=predicted_total > 0
+    )
+    recall = np.divide(
+        overlap, referenced_total, out=np.zeros(count), where=referenced_total > 0
+    )
+    return np.divide(
+        2 * precision * recall,
+        precision + recall,
+        out=np.zeros(count),
+        where=precision + recall > 0,
+    )
+
+
+def caption_metrics(
+    predictions: list[str], references: list[str], max_characters: int = 150
+) -> dict[str, float]:
+    """Quality metrics of generated alt texts against reference alt texts.
+
+    Args:
+        predictions: Generated alt texts.
+        references: Reference alt texts, in the same order.
+        max_characters: Length limit of the length compliance rate.
+
+    Returns:
+        dict[str, float]: Mean unigram and bigram F1, the fraction of
+            predictions shorter than ``max_characters`` and their mean length.
+    """
+    if not predictions:
+        return {}
+
+    characters = np.char.str_len(np.array(predictions, dtype=str))
+    return {
+        "unigram_f1": round(float(ngram_f1(predictions, references, 1).mean()), 4),
+        "bigram_f1": round(float(ngram_f1(predictions, references, 2).mean()), 4),
+        "length_compliance": round(float((characters < max_characters).mean()), 4),
+        "mean_characters": round(float(characters.mean()), 1),
+    }
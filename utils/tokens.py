@@ -0,0 +1,55 @@
+import math
+
+# Image token multipliers of the patch based vision models, see
+# https://platform.openai.com/docs/guides/images-vision#calculating-costs
+PATCH_MULTIPLIERS = {
+    "gpt-4.1-mini": 1.62,
+    "gpt-4.1-nano": 2.46,
+    "o4-mini": 1.72,
+}
+PATCH_SIZE = 32
+MAX_PATCHES = 1536
+
+# Per message and per request overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 7
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Rough token count of English text, about four characters per token."""
+    return math.ceil(len(text) / 4)
+
+
+def _patch_tokens(width: int, height: int, multiplier: float) -> int:
+    patches = math.ceil(width / PATCH_SIZE) * math.ceil(height / PATCH_SIZE)
+
+    if patches > MAX_PATCHES:
+        scale = math.sqrt(MAX_PATCHES * PATCH_SIZE**2 / (width * height))
+        width, height = width * scale, height * scale
+        # Shrink further so that whole patches fit the width
+        scale = math.floor(width / PATCH_SIZE) / (width / PATCH_SIZE)
+        width, height = width * scale, height * scale
+        patches = math.ceil(width / PATCH_SIZE) * math.ceil(height / PATCH_SIZE)
+
+    return math.ceil(min(patches, MAX_PATCHES) * multiplier)
+
+
+def _tile_tokens(width: int, height: int) -> int:
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def estimate_image_tokens(width: int, height: int, model: str) -> int:
+    """Estimate the input tokens of an image at ``detail: auto`` for ``model``.
+
+    Patch based models (GPT-4.1 mini/nano, o4-mini) count 32px patches times a
+    model specific multiplier, all other models use 512px tiles.
+    """
+    for prefix, multiplier in PATCH_MULTIPLIERS.items():
+        if model.startswith(prefix):
+            return _patch_tokens(width, height, multiplier)
+
+    return _tile_tokens(width, height)
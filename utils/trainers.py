@@ -0,0 +1,20 @@
+from torch.utils.data import DataLoader, Sampler
+from trl import SFTTrainer
+
+
+class BatchSamplerSFTTrainer(SFTTrainer):
+    """SFT trainer drawing its training batches from a batch sampler."""
+
+    def __init__(self, *args, train_batch_sampler: Sampler[list[int]], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train_batch_sampler = train_batch_sampler
+
+    def get_train_dataloader(self) -> DataLoader:
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=self.train_batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadManifest:
+    """Local record of uploaded files, keyed by their SHA-256 checksum.
+
+    Retry files are keyed by checksum and attempt, see ``BatchRetrier``.
+
+    The manifest is rewritten atomically after every recorded upload, so an
+    interrupted run keeps all uploads that finished and a rerun can reuse
+    their file IDs instead of uploading the same content again.
+
+    The file has a single writer: the manifest is read once and rewritten
+    from memory, so processes must not share a manifest file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = (
+            json.loads(path.read_text()) if path.exists() else {}
+        )
+
+    def get(self, checksum: str) -> str | None:
+        entry = self._entries.get(checksum)
+        return entry["file_id"] if entry else None
+
+    def record(self, checksum: str, file_id: str, path: Path) -> None:
+        with self._lock:
+            self._entries[checksum] = {"file_id": file_id, "path": str(path)}
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(self._entries, indent=2))
+            tmp_path.replace(self.path)